@@ -1 +1,3 @@
 __version__ = '0.0.3-dev'
+
+default_app_config = 'disbi.apps.DisbiConfig'
@@ -16,6 +16,8 @@ from django.core.exceptions import ValidationError
 from disbi._import_export import resources
 from disbi._import_export.admin import (ImportExportModelAdmin,
                                        RelatedImportExportModelAdmin)
+from disbi.cache_table import get_cache_statistics
+from disbi.models import CachedTable
 
 
 def dataframe_replace_factory(replace):
@@ -102,3 +104,29 @@ class DisbiMeasurementAdmin(RelatedImportExportModelAdmin):
         ('experiment', admin.RelatedOnlyFieldListFilter),
     )
     list_per_page = 30
+
+
+@admin.register(CachedTable)
+class CachedTableAdmin(admin.ModelAdmin):
+    """
+    Read-only overview of the cached datatables with the usage statistics
+    of the cache above the list.
+    """
+    change_list_template = 'admin/disbi/cachedtable/change_list.html'
+    list_display = ('table_name', 'app_label', 'cached', 'row_count', 'byte_size',
+                    'hits', 'builds', 'build_time', 'last_access')
+    list_filter = ('app_label', 'cached')
+    search_fields = ('table_name',)
+    ordering = ('-last_access',)
+    list_per_page = 50
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def get_readonly_fields(self, request, obj=None):
+        return [field.name for field in self.model._meta.fields]
+    
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        extra_context['cache_statistics'] = get_cache_statistics()
+        return super().changelist_view(request, extra_context=extra_context)
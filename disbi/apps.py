@@ -1,6 +1,21 @@
 # Django
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class DisbiConfig(AppConfig):
     name = 'disbi'
+
+    def ready(self):
+        """
+        Install the triggers for tracking changes after each migration,
+        register the system checks and compile the relation graphs of the
+        apps.
+        """
+        # DISBi
+        import disbi.checks  # Registers the system checks.
+        from disbi.change_tracking import install_triggers_after_migrate
+        from disbi.schema import compile_schemas
+        post_migrate.connect(install_triggers_after_migrate,
+                             dispatch_uid='disbi_install_version_triggers')
+        compile_schemas()
@@ -1,26 +1,39 @@
 """
 Handles the caching of joined tables in the DB.
 """
+# third-party
+import numpy as np
+
 # Django
 from django.apps import apps
 from django.conf import settings
-from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Count, F, Sum
+from django.utils import timezone
 
 # DISBi
-from disbi.db_utils import exec_query, from_db
+from disbi.change_tracking import (get_table_versions, install_experiment_triggers,
+                                   install_version_triggers, pop_changed_experiments)
+from disbi.db_utils import exec_query, from_db, try_advisory_lock
 from disbi.join import Relations
-from disbi.models import BiologicalModel, Checksum, MeasurementModel, MetaModel
+from disbi.models import (BiologicalModel, CachedTable, Checksum,
+                          MeasurementModel, MetaModel)
 from disbi.option_utils import get_models_of_superclass
+from disbi.schema import get_schema
+
+# Suffixes of the tables that belong to a datatable and are dropped with it.
+VALUES_TABLE_SUFFIX = '_values'
+FOLDCHANGE_TABLE_SUFFIX = '_fc'
+COMPANION_SUFFIXES = (VALUES_TABLE_SUFFIX, FOLDCHANGE_TABLE_SUFFIX)
 
 
 def reconstruct_backbone_table(app_label):
     """
     Reconstruct the prejoined backbone table of the biological models.
     """
-    # Use the Relations class to do the JOIN.
-    relations = Relations(app_label, model_superclass=(BiologicalModel, MetaModel))
-    relations.start_join()
-    relations.create_joined_table()        
+    # Use the compiled JOIN of the relation graph.
+    schema = get_schema(app_label)
+    schema.validate()
+    Relations.build_joined_table(app_label, schema.backbone_sql, schema.index_columns)
         
 def get_table_names_by_pattern(pattern):
     """
@@ -39,71 +52,358 @@ def get_table_names_by_pattern(pattern):
     ''' % pattern
     return from_db(select_query, fetch_as='tuple')
 
-def drop_datatables(app_label):
+def get_datatable_names(app_label):
     """
-    Drop all cached datatables.
+    Get the names of all cached datatables of an app.
     
     Args:
         app_label (str): The name of the app the tables belong to.
+    
+    Returns:
+        tuple: The names of the datatables.
     """
     # Construct the pattern that matches all datatables.
     pattern = '%s_%s_%%' % (app_label, settings.DISBI['DATATABLE_PREFIX'])
     dbtables = get_table_names_by_pattern(pattern)
-    drop_query = "DROP TABLE %s;"
     # Flatten
-    dbtables = sum(dbtables, ())
+    return sum(dbtables, ())
+
+def get_companion_tables(table_name):
+    """
+    Get the names of the tables that belong to a datatable.
+    
+    Args:
+        table_name (str): The name of the datatable.
+        
+    Returns:
+        list: The names of the companion tables, which might not exist.
+    """
+    return [table_name + suffix for suffix in COMPANION_SUFFIXES]
+
+def get_datatable_owner(table_name):
+    """
+    Get the name of the datatable a table belongs to.
+    
+    Args:
+        table_name (str): The name of a datatable or a companion table.
+        
+    Returns:
+        str: The name of the datatable.
+    """
+    for suffix in COMPANION_SUFFIXES:
+        if table_name.endswith(suffix):
+            return table_name[:-len(suffix)]
+    return table_name
+
+def drop_datatable(table_name):
+    """
+    Drop a datatable together with its companion tables.
+    
+    Args:
+        table_name (str): The name of the datatable.
+    """
+    exec_query('DROP TABLE IF EXISTS %s;' 
+               % ', '.join([table_name] + get_companion_tables(table_name)))
+
+def drop_datatables(app_label):
+    """
+    Drop all cached datatables.
+    
+    Args:
+        app_label (str): The name of the app the tables belong to.
+    """
+    drop_query = "DROP TABLE IF EXISTS %s;"
     # Drop all tables that matched the pattern.
-    for tablename in dbtables:
+    for tablename in get_datatable_names(app_label):
         exec_query(drop_query % tablename)
+    CachedTable.objects.filter(app_label=app_label).update(cached=False)
 
-def check_table(dbtables):
+def get_datatable_size(table_name):
     """
-    Check whether DB tables changed since the last time.
+    Get the size of a datatable including its companion tables and indexes.
+    
+    Args:
+        table_name (str): The name of the datatable.
+        
+    Returns:
+        int: The size in bytes.
+    """
+    size_query = '''
+    SELECT sum(pg_total_relation_size(to_regclass(name)))
+    FROM unnest(%s) AS name;
+    '''
+    return from_db(size_query, [[table_name] + get_companion_tables(table_name)], 
+                   fetch_as='tuple')[0][0] or 0
+
+def update_datatable_size(table_name):
+    """
+    Update the registered size of a datatable after a companion table 
+    was added or grew.
+    
+    Args:
+        table_name (str): The name of the datatable.
+    """
+    (CachedTable.objects
+     .filter(table_name=table_name)
+     .update(byte_size=get_datatable_size(table_name)))
+
+def register_datatable(table_name, app_label, experiment_ids, dependencies,
+                       row_count=0, build_time=0):
+    """
+    Register a cached datatable with the experiments and DB tables it 
+    was constructed from.
+    
+    Args:
+        table_name (str): The name of the datatable.
+        app_label (str): The name of the app the table belongs to.
+        experiment_ids (iterable of int): The ids of the experiments 
+            contained in the table.
+        dependencies (iterable of str): The DB tables the table was 
+            constructed from.
+    
+    Keyword Args:
+        row_count (int): The number of rows in the table.
+        build_time (float): The time it took to build the table in seconds.
+    """
+    byte_size = get_datatable_size(table_name)
+    fields = {'app_label': app_label,
+              'experiment_ids': sorted(experiment_ids),
+              'dependencies': sorted(dependencies),
+              'cached': True,
+              'byte_size': byte_size,
+              'row_count': row_count,
+              'build_time': build_time,
+              'last_access': timezone.now()}
+    updated = (CachedTable.objects
+               .filter(table_name=table_name)
+               .update(builds=F('builds') + 1, **fields))
+    if not updated:
+        CachedTable.objects.create(table_name=table_name, builds=1, **fields)
+
+def record_datatable_hit(table_name, hit=True):
+    """
+    Count a request that was served from a cached datatable.
+    
+    Args:
+        table_name (str): The name of the datatable.
+        
+    Keyword Args:
+        hit (bool): Count the request as a hit. Otherwise only the time 
+            of the last access is updated, e.g. for the follow-up requests
+            of a view, that was counted already.
+    """
+    fields = {'hits': F('hits') + 1} if hit else {}
+    (CachedTable.objects
+     .filter(table_name=table_name)
+     .update(last_access=timezone.now(), **fields))
+
+def invalidate_datatables(app_label, experiment_ids=(), dbtables=()):
+    """
+    Drop the cached datatables that contain changed experiments or 
+    were constructed from changed DB tables.
+    
+    Datatables that were not registered are dropped as well, as it is
+    unknown what they depend on. Companion tables are dropped along with
+    their datatable.
+    
+    Args:
+        app_label (str): The name of the app the tables belong to.
+    
+    Keyword Args:
+        experiment_ids (iterable of int): The ids of the changed experiments.
+        dbtables (iterable of str): The names of the changed DB tables.
+    """
+    cached_tables = get_datatable_names(app_label)
+    unaffected_tables = set(CachedTable.objects
+                            .filter(app_label=app_label, cached=True,
+                                    table_name__in=cached_tables)
+                            .exclude(experiment_ids__overlap=list(experiment_ids))
+                            .exclude(dependencies__overlap=list(dbtables))
+                            .values_list('table_name', flat=True))
+    drop_query = "DROP TABLE IF EXISTS %s;"
+    for tablename in cached_tables:
+        if get_datatable_owner(tablename) not in unaffected_tables:
+            exec_query(drop_query % tablename)
+    (CachedTable.objects
+     .filter(app_label=app_label, cached=True)
+     .exclude(table_name__in=unaffected_tables)
+     .update(cached=False))
+
+def select_evictions(entries, max_bytes=None, ttl=None, now=None):
+    """
+    Select the cached datatables that should be evicted.
+    
+    At first, all tables that were not accessed within the time to live
+    are selected. If the remaining tables still exceed the size budget, 
+    the least recently used ones are selected until the rest fits.
+    
+    Args:
+        entries (iterable): Objects with the attributes ``table_name``, 
+            ``byte_size`` and ``last_access``, e.g. :class:`.CachedTable`
+            instances.
+    
+    Keyword Args:
+        max_bytes (int): The total size the tables may occupy. No limit 
+            if None.
+        ttl (float): The number of seconds after the last access, after
+            which a table expires. No expiry if None.
+        now (datetime): The current time. Defaults to :func:`timezone.now`.
+    
+    Returns:
+        list: The names of the selected tables, least recently used first.
+    """
+    now = now or timezone.now()
+    evicted = []
+    remaining = []
+    for entry in sorted(entries, key=lambda entry: entry.last_access):
+        if ttl is not None and (now - entry.last_access).total_seconds() > ttl:
+            evicted.append(entry.table_name)
+        else:
+            remaining.append(entry)
+    if max_bytes is not None:
+        total_bytes = sum(entry.byte_size for entry in remaining)
+        for entry in remaining:
+            if total_bytes <= max_bytes:
+                break
+            evicted.append(entry.table_name)
+            total_bytes -= entry.byte_size
+    return evicted
+
+def evict_datatables(app_label=None, max_bytes=None, ttl=None, keep=()):
+    """
+    Drop the cached datatables that expired or exceed the size budget.
+    
+    Limits that are not given are taken from the ``CACHE_MAX_BYTES`` 
+    and ``CACHE_TTL`` settings.
+    
+    Keyword Args:
+        app_label (str): Only consider the tables of this app. Considers 
+            the tables of all apps if None.
+        max_bytes (int): The total size the tables may occupy.
+        ttl (float): The number of seconds after the last access, after
+            which a table expires.
+        keep (iterable of str): Tables that must not be evicted, e.g. 
+            because they were just built.
+            
+    Returns:
+        list: The names of the evicted tables. Tables that are locked 
+        because they are being built are not evicted.
+    """
+    if max_bytes is None:
+        max_bytes = settings.DISBI.get('CACHE_MAX_BYTES')
+    if ttl is None:
+        ttl = settings.DISBI.get('CACHE_TTL')
+    if max_bytes is None and ttl is None:
+        return []
+    entries = CachedTable.objects.filter(cached=True).exclude(table_name__in=list(keep))
+    if app_label is not None:
+        entries = entries.filter(app_label=app_label)
+    selected = select_evictions(entries.only('table_name', 'byte_size', 'last_access'),
+                                max_bytes=max_bytes, ttl=ttl)
+    evicted = []
+    for tablename in selected:
+        # Take the lock that guards building the table. Tables that are
+        # locked are being built and are skipped instead of waiting, so 
+        # that concurrent builds evicting each other's tables do not 
+        # deadlock.
+        with try_advisory_lock(tablename) as acquired:
+            if acquired:
+                drop_datatable(tablename)
+                CachedTable.objects.filter(table_name=tablename).update(cached=False)
+                evicted.append(tablename)
+    return evicted
+
+def get_cache_statistics(percentiles=(50, 90, 99)):
+    """
+    Summarize the usage of the datatable cache.
+    
+    Keyword Args:
+        percentiles (tuple of int): The percentiles of the build times 
+            that are computed.
+    
+    Returns:
+        dict: The number of hits and misses, the hit rate, the number and
+        size of currently cached tables and the build time percentiles 
+        mapped to the percentile.
+    """
+    usage = CachedTable.objects.aggregate(hits=Sum('hits'), misses=Sum('builds'))
+    hits = usage['hits'] or 0
+    misses = usage['misses'] or 0
+    cached = (CachedTable.objects
+              .filter(cached=True)
+              .aggregate(tables=Count('id'), byte_size=Sum('byte_size')))
+    build_times = list(CachedTable.objects
+                       .filter(builds__gt=0)
+                       .values_list('build_time', flat=True))
+    if build_times:
+        build_time_percentiles = list(zip(percentiles, 
+                                          np.percentile(build_times, percentiles)))
+    else:
+        build_time_percentiles = []
+    return {'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else None,
+            'cached_tables': cached['tables'],
+            'cached_bytes': cached['byte_size'] or 0,
+            'build_time_percentiles': build_time_percentiles}
+
+def get_changed_tables(dbtables):
+    """
+    Get the DB tables that changed since the last time.
+    
+    The version counters maintained by the triggers of 
+    :mod:`disbi.change_tracking` are compared to the versions stored
+    as checksums at the last check.
     
     Args:
         dbtables (iterable of str): The tables that should be checked.
         
     Returns:
-        bool: True if at least one table changed, else False.
+        list: The names of the tables that changed.
     """
-    # Construct the query to get a checksum of a table denpending on the RDBMS.
-    checksum_query = '''
-    SELECT        
-    md5(CAST((array_agg(t.* order by id)) AS text)) AS Checksum /* id is a primary key of table (to avoid random sorting) */
-    FROM %s t; 
-    ''' 
-    # Initialize value to False.
-    data_changed = False
+    # Ensure that changes to the tables are tracked.
+    install_version_triggers(dbtables)
+    versions = get_table_versions(dbtables)
+    old_checksums = dict(Checksum.objects
+                         .filter(table_name__in=dbtables)
+                         .values_list('table_name', 'checksum'))
+    changed_tables = []
     # Got through all tables and update the checksums. 
-    # Set data_changed to True in case data changed.
+    # Collect the tables in which data changed.
     for dbtable in dbtables:
-        # Get the checksum of the table.
-        check = from_db(checksum_query % dbtable, fetch_as='namedtuple')[0]
-        new_checksum = check.checksum
-
-        try:
-            # Get the old checksum from the DB.
-            old_check = Checksum.objects.get(table_name=dbtable)
-            if old_check.checksum != new_checksum:
-                # If checksum changed, store the new checksum in the DB 
-                # for later comparision and set `data_changed` to True.
-                old_check.checksum = new_checksum
-                old_check.save()
-                data_changed = True
-                
-        except ObjectDoesNotExist:
+        new_checksum = str(versions[dbtable])
+        if dbtable not in old_checksums:
             # No DB entry yet. Make the DB entry of the checksum and assume 
             # that data has changed.  
             Checksum.objects.create(table_name=dbtable, checksum=new_checksum)
-            data_changed = True
+            changed_tables.append(dbtable)
+        elif old_checksums[dbtable] != new_checksum:
+            # If checksum changed, store the new checksum in the DB 
+            # for later comparision and mark the table as changed.
+            Checksum.objects.filter(table_name=dbtable).update(checksum=new_checksum)
+            changed_tables.append(dbtable)
     
-    return data_changed    
+    return changed_tables
+
+def check_table(dbtables):
+    """
+    Check whether DB tables changed since the last time.
+    
+    Args:
+        dbtables (iterable of str): The tables that should be checked.
+        
+    Returns:
+        bool: True if at least one table changed, else False.
+    """
+    return bool(get_changed_tables(dbtables))
         
 
 def check_for_table_change(exp_model, check_for):
     """
     Wrapper for checking whether data in DB tables has changed.
     
+    Only the cached datatables that are affected by the change are dropped.
+    
     Args:
         check_for (str): Either ``bio`` for checking all tables that
             belong to :class:`.BiologicalModel` or ``data`` for checking
@@ -117,17 +417,34 @@ def check_for_table_change(exp_model, check_for):
     elif check_for == 'data':
         models = get_models_of_superclass(app_label, (MeasurementModel,),
                                           intermediary=True)
+        # Ensure that the changed experiments are logged.
+        install_experiment_triggers(model for model in models
+                                    if issubclass(model, MeasurementModel))
     else:
         raise ValueError('Unknown argument: {}'.format(check_for))
     dbtables = tuple(model._meta.db_table for model in models)
     # Check whether data has actually changed.
-    data_changed = check_table(dbtables)
+    changed_tables = get_changed_tables(dbtables)
     # Call the appropriate function in case data did change.
-    if data_changed:
+    if changed_tables:
         print('db changed, table is rejoined: ', check_for )
         # Call the reconstruct callback function.
         if check_for == 'bio':
             reconstruct_backbone_table(app_label)
-            drop_datatables(app_label)
+            invalidate_datatables(app_label, dbtables=changed_tables)
         elif check_for == 'data':
-            drop_datatables(app_label)
+            changed_experiments = pop_changed_experiments(changed_tables)
+            experiment_ids = set()
+            truncated_tables = []
+            for dbtable in changed_tables:
+                table_experiment_ids = changed_experiments.get(dbtable, set())
+                # None denotes that all experiments of the table changed.
+                # Without logged experiments it is unknown which changed,
+                # e.g. for intermediary tables, which have no experiment 
+                # triggers, or for changes made before the triggers were 
+                # installed.
+                if None in table_experiment_ids or not table_experiment_ids:
+                    truncated_tables.append(dbtable)
+                experiment_ids |= table_experiment_ids - {None}
+            invalidate_datatables(app_label, experiment_ids=experiment_ids,
+                                  dbtables=truncated_tables)
@@ -0,0 +1,197 @@
+"""
+Tracks changes of DB tables with version counters maintained by triggers.
+
+Each table that is watched by DISBi gets a statement level trigger, which
+increments the counter of the table in :class:`.TableVersion` whenever rows
+are inserted, updated or deleted or the table is truncated. Checking whether
+a table changed thus only requires looking up a few integers instead of
+hashing the whole table.
+
+Measurement tables additionally get triggers that log the experiments of
+all changed rows in :class:`.ChangedExperiment`, so that only the cached
+datatables containing those experiments need to be invalidated. Experiment
+tables get them for updating only the condition tokens of the changed 
+experiments, see :mod:`disbi.condition_tokens`.
+"""
+# Django
+from django.db import DEFAULT_DB_ALIAS, connection, transaction
+
+# DISBi
+from disbi.db_utils import db_table_exists, exec_query, from_db
+from disbi.models import (BiologicalModel, ChangedExperiment, MeasurementModel,
+                          MetaModel, TableVersion)
+from disbi.option_utils import get_models_of_superclass
+
+# The triggers that are attached to each watched table mapped to their
+# events and the function they execute. The functions are created in the
+# migrations.
+VERSION_TRIGGERS = {
+    'disbi_table_version': 'AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}',
+}
+VERSION_FUNCTION = 'disbi_increment_table_version'
+# Transition tables can only be referenced by triggers for a single event.
+EXPERIMENT_TRIGGERS = {
+    'disbi_changed_experiments_ins': ('AFTER INSERT ON {table} '
+                                      'REFERENCING NEW TABLE AS disbi_new_rows'),
+    'disbi_changed_experiments_upd': ('AFTER UPDATE ON {table} '
+                                      'REFERENCING OLD TABLE AS disbi_old_rows '
+                                      'NEW TABLE AS disbi_new_rows'),
+    'disbi_changed_experiments_del': ('AFTER DELETE ON {table} '
+                                      'REFERENCING OLD TABLE AS disbi_old_rows'),
+    'disbi_changed_experiments_trunc': 'AFTER TRUNCATE ON {table}',
+}
+EXPERIMENT_FUNCTION = 'disbi_log_changed_experiments'
+
+# Pairs of trigger function and table for which the triggers are known 
+# to exist. Avoids checking the system catalog on every request.
+_watched_tables = set()
+
+
+def get_tracked_tables(app_label):
+    """
+    Get the DB tables of all models of an app whose changes are tracked.
+
+    Args:
+        app_label (str): The label of the app the models live in.
+
+    Returns:
+        tuple: The names of the DB tables of all biological, meta and
+        measurement models including their intermediary tables.
+    """
+    models = get_models_of_superclass(app_label,
+                                      (BiologicalModel, MetaModel, MeasurementModel),
+                                      intermediary=True)
+    return tuple(model._meta.db_table for model in models)
+
+def _install_triggers(triggers, function, dbtables):
+    """
+    Attach triggers to each table, that does not have them yet.
+
+    Args:
+        triggers (dict): The trigger names mapped to their events.
+        function (str): The name of the function the triggers execute.
+        dbtables (dict): The tables mapped to a tuple of arguments for
+            the function.
+    """
+    missing = tuple(dbtable for dbtable in dbtables
+                    if (function, dbtable) not in _watched_tables)
+    if not missing:
+        return
+    select_query = '''
+    SELECT c.relname
+    FROM pg_catalog.pg_trigger t
+    JOIN pg_catalog.pg_class c ON t.tgrelid = c.oid
+    WHERE t.tgname IN %s AND c.relname IN %s
+    GROUP BY c.relname
+    HAVING count(*) = %s;
+    '''
+    triggered = set(sum(from_db(select_query,
+                                [tuple(triggers), missing, len(triggers)],
+                                fetch_as='tuple'), ()))
+    create_query = '''
+    CREATE TRIGGER {trigger} {events}
+    FOR EACH STATEMENT EXECUTE PROCEDURE {function}({args});
+    '''
+    for dbtable in missing:
+        if dbtable not in triggered:
+            args = ', '.join("'%s'" % arg for arg in dbtables[dbtable])
+            # Dropping first locks the table, so that concurrent processes
+            # installing the same triggers do not fail.
+            with transaction.atomic():
+                for trigger, events in triggers.items():
+                    exec_query('DROP TRIGGER IF EXISTS %s ON %s;' % (trigger, dbtable))
+                    exec_query(create_query.format(trigger=trigger,
+                                                   events=events.format(table=dbtable),
+                                                   function=function,
+                                                   args=args))
+        _watched_tables.add((function, dbtable))
+
+def install_version_triggers(dbtables):
+    """
+    Attach the version trigger to each table, that has none yet.
+
+    Args:
+        dbtables (iterable of str): The tables that should be watched.
+    """
+    _install_triggers(VERSION_TRIGGERS, VERSION_FUNCTION,
+                      dict((dbtable, ()) for dbtable in dbtables))
+
+def install_experiment_triggers(models):
+    """
+    Attach the triggers logging changed experiments to the tables of
+    measurement or experiment models, that have none yet.
+
+    Args:
+        models (iterable of Model): The measurement models, whose rows 
+            reference the experiments with their ``experiment`` field, or
+            the experiment models, whose rows are the experiments.
+    """
+    _install_triggers(EXPERIMENT_TRIGGERS, EXPERIMENT_FUNCTION,
+                      dict((model._meta.db_table,
+                            (model._meta.get_field('experiment').column
+                             if issubclass(model, MeasurementModel)
+                             else model._meta.pk.column,))
+                           for model in models))
+
+def get_table_versions(dbtables):
+    """
+    Get the current version of each table.
+
+    Args:
+        dbtables (iterable of str): The tables for which the versions are
+            retrieved.
+
+    Returns:
+        dict: The table names mapped to their versions. Tables that have
+        not been modified since their trigger was installed have version 0.
+    """
+    versions = dict(TableVersion.objects
+                    .filter(table_name__in=dbtables)
+                    .values_list('table_name', 'version'))
+    return dict((dbtable, versions.get(dbtable, 0)) for dbtable in dbtables)
+
+def pop_changed_experiments(dbtables):
+    """
+    Get and remove the logged experiments whose data changed.
+
+    Args:
+        dbtables (iterable of str): The measurement tables for which the
+            changed experiments are retrieved.
+
+    Returns:
+        dict: The table names mapped to a set with the ids of the changed
+        experiments. The set contains None if all experiments of the
+        table have to be considered as changed.
+    """
+    dbtables = tuple(dbtables)
+    if not dbtables:
+        return {}
+    delete_query = '''
+    DELETE FROM %s
+    WHERE table_name IN %%s
+    RETURNING table_name, experiment_id;
+    ''' % ChangedExperiment._meta.db_table
+    changed_experiments = {}
+    for dbtable, experiment_id in from_db(delete_query, [dbtables], fetch_as='tuple'):
+        changed_experiments.setdefault(dbtable, set()).add(experiment_id)
+    return changed_experiments
+
+def install_triggers_after_migrate(app_config, using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    Receiver for the ``post_migrate`` signal, that installs the triggers
+    on the tables of a freshly migrated app.
+    """
+    if using != DEFAULT_DB_ALIAS or connection.vendor != 'postgresql':
+        return
+    if app_config.models_module is None:
+        return
+    # Skip apps without DISBi models or apps that are only partially migrated.
+    if not db_table_exists(ChangedExperiment._meta.db_table):
+        return
+    dbtables = tuple(dbtable for dbtable in get_tracked_tables(app_config.label)
+                     if db_table_exists(dbtable))
+    install_version_triggers(dbtables)
+    measurement_models = [model for model
+                          in get_models_of_superclass(app_config.label, (MeasurementModel,))
+                          if model._meta.db_table in dbtables]
+    install_experiment_triggers(measurement_models)
@@ -0,0 +1,50 @@
+"""
+System checks for the DB setup of DISBi apps.
+"""
+# Django
+from django.core.checks import Error, Tags, Warning, register
+from django.db import DatabaseError, connection
+
+# DISBi
+from disbi.indexes import get_measurement_models, get_missing_measurement_indexes
+from disbi.schema import get_schema, get_schema_app_labels
+
+
+@register(Tags.database)
+def check_measurement_indexes(app_configs, **kwargs):
+    """
+    Warn about measurement tables that lack the composite index on the
+    experiment and the biological foreign key.
+    
+    As a database check, it only runs with ``migrate`` or when 
+    ``check --database`` is requested.
+    """
+    if connection.vendor != 'postgresql':
+        return []
+    try:
+        missing = get_missing_measurement_indexes(get_measurement_models(app_configs))
+    except DatabaseError:
+        # The DB is not reachable or not set up yet.
+        return []
+    return [Warning('%s has no index on (%s), so selecting the data of an '
+                    'experiment requires scanning the table.' 
+                    % (model._meta.db_table, ', '.join(key_columns)),
+                    hint='Run "manage.py create_measurement_indexes".',
+                    obj=model,
+                    id='disbi.W001')
+            for model, (_, key_columns, _) in missing]
+
+
+@register()
+def check_schema_graphs(app_configs, **kwargs):
+    """
+    Report apps whose biological and meta models cannot be joined to the
+    backbone table, see :class:`.SchemaGraph`.
+    """
+    return [Error('The models of %s cannot be joined: %s' % (app_label, error),
+                  hint='The relations of the biological and meta models must '
+                       'form a tree, whose root is marked with di_first=True.',
+                  obj=app_label,
+                  id='disbi.E001')
+            for app_label in get_schema_app_labels(app_configs)
+            for error in get_schema(app_label).errors]
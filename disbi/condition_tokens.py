@@ -0,0 +1,188 @@
+"""
+Stores the values of the combinable experiment fields as indexed tokens.
+
+Combinable fields, e.g. the carbon source, hold several conditions joined
+on the ``SEPARATOR``. Their values are split into tokens, which are stored
+in :class:`.ConditionToken` and indexed with GIN. An experiment matches the
+selected conditions of a combinable field, if all of its tokens are among
+them. This is resolved with one indexed set containment for any number of
+selected conditions. When the version of the experiment table changes,
+the tokens of the experiments logged as changed are replaced, see
+:mod:`disbi.change_tracking`.
+"""
+# standard library
+import threading
+
+# Django
+from django.conf import settings
+from django.db import transaction
+
+# DISBi
+from disbi.change_tracking import (get_table_versions, install_experiment_triggers,
+                                   install_version_triggers, pop_changed_experiments)
+from disbi.db_utils import advisory_lock
+from disbi.models import ConditionToken, ConditionTokenVersion
+
+# The experiment tables mapped to the versions their tokens are known to
+# be up to date with in this process.
+_synced_versions = {}
+_synced_versions_lock = threading.Lock()
+
+
+def get_combinable_fields(experiment_model):
+    """
+    Get the names of the combinable fields of an experiment model.
+
+    Args:
+        experiment_model (Model): The experiment model.
+
+    Returns:
+        list: The field names.
+    """
+    return [field.name for field in experiment_model._meta.get_fields()
+            if getattr(field, 'di_combinable', False)]
+
+def normalize_token(token):
+    """
+    Replace the placeholder for an empty condition with the empty string.
+
+    Args:
+        token (str): A condition.
+
+    Returns:
+        str: The normalized condition.
+    """
+    return '' if token == settings.DISBI['EMPTY_STR'] else token
+
+def tokenize(value):
+    """
+    Split the value of a combinable field into its conditions.
+
+    Args:
+        value (str): The value, with the conditions joined on the
+            ``SEPARATOR``.
+
+    Returns:
+        list: The distinct normalized conditions in sorted order.
+    """
+    return sorted(set(normalize_token(token)
+                      for token in str(value).split(settings.DISBI['SEPARATOR'])))
+
+def _make_condition_tokens(experiments):
+    """
+    Tokenize the combinable fields of experiments.
+
+    Args:
+        experiments (QuerySet): The experiments.
+
+    Returns:
+        list: The unsaved :class:`.ConditionToken` instances.
+    """
+    dbtable = experiments.model._meta.db_table
+    field_names = get_combinable_fields(experiments.model)
+    return [ConditionToken(experiment_table=dbtable, experiment_id=row[0],
+                           field_name=field_name, tokens=tokenize(value))
+            for row in experiments.values_list('pk', *field_names)
+            for field_name, value in zip(field_names, row[1:])
+            if value is not None]
+
+def rebuild_condition_tokens(experiment_model):
+    """
+    Replace the tokens of all experiments of an experiment model.
+
+    Args:
+        experiment_model (Model): The experiment model.
+    """
+    condition_tokens = _make_condition_tokens(experiment_model.objects.all())
+    with transaction.atomic():
+        (ConditionToken.objects
+         .filter(experiment_table=experiment_model._meta.db_table)
+         .delete())
+        ConditionToken.objects.bulk_create(condition_tokens)
+
+def update_condition_tokens(experiment_model, experiment_ids):
+    """
+    Replace the tokens of some experiments of an experiment model.
+
+    Args:
+        experiment_model (Model): The experiment model.
+        experiment_ids (iterable of int): The ids of the experiments.
+            Tokens of deleted experiments are removed.
+    """
+    experiment_ids = list(experiment_ids)
+    condition_tokens = _make_condition_tokens(
+        experiment_model.objects.filter(pk__in=experiment_ids))
+    with transaction.atomic():
+        (ConditionToken.objects
+         .filter(experiment_table=experiment_model._meta.db_table,
+                 experiment_id__in=experiment_ids)
+         .delete())
+        ConditionToken.objects.bulk_create(condition_tokens)
+
+def sync_condition_tokens(experiment_model):
+    """
+    Bring the tokens of an experiment model up to date with its table.
+
+    The version of the table the tokens were built from is stored as
+    :class:`.ConditionTokenVersion`. If the table changed since, only the
+    tokens of the experiments logged as changed are replaced. All tokens are rebuilt if they were
+    never built or the table was truncated.
+
+    Args:
+        experiment_model (Model): The experiment model.
+    """
+    dbtable = experiment_model._meta.db_table
+    # Ensure that changes to the table and its experiments are tracked.
+    install_version_triggers((dbtable,))
+    install_experiment_triggers((experiment_model,))
+    versions = get_table_versions((dbtable,))
+    with _synced_versions_lock:
+        synced_versions = _synced_versions.get(dbtable)
+    if synced_versions == versions:
+        return
+    # Serialize concurrent updates of the tokens of the same table.
+    with advisory_lock('%s_%s' % (ConditionToken._meta.db_table, dbtable)):
+        # Changes committed after reading the version are applied as
+        # well and only lead to another, empty update later.
+        versions = get_table_versions((dbtable,))
+        built_version = (ConditionTokenVersion.objects
+                         .filter(experiment_table=dbtable)
+                         .values_list('version', flat=True)
+                         .first())
+        if built_version != versions[dbtable]:
+            changed_ids = pop_changed_experiments((dbtable,)).get(dbtable, set())
+            if built_version is None:
+                rebuild_condition_tokens(experiment_model)
+                ConditionTokenVersion.objects.create(experiment_table=dbtable,
+                                                     version=versions[dbtable])
+            else:
+                if None in changed_ids:
+                    rebuild_condition_tokens(experiment_model)
+                elif changed_ids:
+                    update_condition_tokens(experiment_model, changed_ids)
+                (ConditionTokenVersion.objects
+                 .filter(experiment_table=dbtable)
+                 .update(version=versions[dbtable]))
+    with _synced_versions_lock:
+        _synced_versions[dbtable] = versions
+
+def filter_by_tokens(experiments, field_name, conditions):
+    """
+    Restrict experiments to those whose conditions of a combinable field
+    are all among the selected conditions.
+
+    Args:
+        experiments (QuerySet): The experiments to filter.
+        field_name (str): The name of the combinable field.
+        conditions (list): The selected conditions.
+
+    Returns:
+        QuerySet: The matching experiments.
+    """
+    matching_ids = ConditionToken.objects.filter(
+        experiment_table=experiments.model._meta.db_table,
+        field_name=field_name,
+        tokens__contained_by=sorted(set(normalize_token(str(condition))
+                                        for condition in conditions)),
+    ).values('experiment_id')
+    return experiments.filter(pk__in=matching_ids)
@@ -2,10 +2,15 @@
 Helper functions for performing operations circumventing the ORM layer.
 """
 # standard library
+import hashlib
 from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
 
 # Django
-from django.db import connection
+from django.db import connection, transaction
+
+# SQLSTATE of errors raised for tables that do not exist.
+UNDEFINED_TABLE = '42P01'
 
 
 # see https://docs.djangoproject.com/en/1.9/topics/db/sql/
@@ -31,6 +36,33 @@ def ordereddictfetchall(cursor):
         for row in cursor.fetchall()
     ]
 
+def convert_rows(column_names, rows, fetch_as='ordereddict'):
+    """
+    Convert rows of tuples to the data type of rows fetched by :func:`from_db`.
+    
+    Args:
+        column_names (list of str): The names of the columns.
+        rows (list of tuple): The rows.
+        
+    Keyword Args:
+        fetch_as (str): The data type, see :func:`from_db`.
+        
+    Raises:
+        ValueError: If a unrecognized value for ``fetch_as`` is given.
+    """
+    if fetch_as == 'ordereddict':
+        return [OrderedDict(zip(column_names, row)) for row in rows]
+    elif fetch_as == 'dict':
+        return [dict(zip(column_names, row)) for row in rows]
+    elif fetch_as == 'namedtuple':
+        nt_result = namedtuple('Result', column_names)
+        return [nt_result(*row) for row in rows]
+    elif fetch_as == 'tuple':
+        return list(rows)
+    raise ValueError('Values cannot be fetched as {fetch_type}. '
+                     .format(fetch_type=fetch_as) +
+                     'Choices are \'ordereddict\', \'dict\', \'namedtuple\' and \'tuple\'.')
+
 def from_db(sql, parameters=None, fetch_as='ordereddict'):
     """
     Fetch values from the DB, given a SQL query.
@@ -67,6 +99,98 @@ def from_db(sql, parameters=None, fetch_as='ordereddict'):
     
     return rows           
 
+def stream_from_db(sql, parameters=None, batch_size=2000):
+    """
+    Fetch values from the DB in batches through a server-side cursor.
+    
+    Only one batch is held in memory at a time. The query is executed
+    when iteration starts and the cursor is closed when the iteration ends
+    or the generator is closed.
+    
+    Args:
+        sql (str): The SQL statement.
+    
+    Keyword Args:
+        parameters: Parameters for a parametrized query. Defaults to None.
+        batch_size (int): The number of rows fetched at once.
+        
+    Yields:
+        The column names as tuple first, then the rows as lists of tuples 
+        in batches.
+    """
+    cursor = connection.chunked_cursor()
+    try:
+        cursor.execute(sql, parameters)
+        # A server-side cursor only describes the columns after the first fetch.
+        rows = cursor.fetchmany(batch_size)
+        yield tuple(col[0] for col in cursor.description)
+        while rows:
+            yield rows
+            rows = cursor.fetchmany(batch_size)
+    finally:
+        cursor.close()
+
+def histogram_from_db(expression, from_clause, condition='TRUE', parameters=None,
+                      bin_count=None):
+    """
+    Compute a histogram of the values of an expression in the DB.
+
+    The values are scanned three times, for their number, range and mean,
+    for the sums of their powers of deviations from the mean and for 
+    counting the values per bin with ``width_bucket``. Only the statistics
+    and the counts are transferred. Missing, NaN and infinite values are 
+    ignored.
+
+    Args:
+        expression (str): The SQL expression of the values.
+        from_clause (str): The relation the values are selected from.
+
+    Keyword Args:
+        condition (str): A SQL condition restricting the selected rows.
+        parameters (list): Parameters for the placeholders in
+            ``expression``, ``from_clause`` and ``condition``.
+        bin_count (function): Called with the number of values, a tuple
+            with the sums of the squared and the cubed deviations from 
+            their mean, the minimum and the maximum to get the number of 
+            bins. Defaults to 10 bins.
+
+    Returns:
+        tuple: The counts per bin and the edges of the bins.
+    """
+    parameters = list(parameters or [])
+    values = '''
+    (SELECT (%s)::float8 AS x FROM %s WHERE %s) AS v
+    WHERE x > '-Infinity'::float8 AND x < 'Infinity'::float8
+    ''' % (expression, from_clause, condition)
+    # Summing the powers of the deviations from the mean avoids the 
+    # cancellation of summing the powers of the values.
+    stats_query = '''
+    WITH v AS (SELECT x FROM %s),
+    m AS (SELECT avg(x) AS mean FROM v)
+    SELECT count(*), min(x), max(x), 
+           sum((x - mean) * (x - mean)), sum((x - mean) * (x - mean) * (x - mean))
+    FROM v, m;
+    ''' % values
+    count, minimum, maximum, *sums = from_db(stats_query, parameters, fetch_as='tuple')[0]
+    if not count:
+        return [0], [0.0, 1.0]
+    if minimum == maximum:
+        return [count], [minimum - 0.5, maximum + 0.5]
+    bins = max(int(bin_count(count, tuple(sums), minimum, maximum)) if bin_count else 10, 1)
+    # The maximum falls into an extra bin, that is merged into the last one.
+    bucket_query = '''
+    SELECT least(width_bucket(x, %%s, %%s, %%s), %%s) AS bucket, count(*)
+    FROM %s
+    GROUP BY bucket;
+    ''' % values
+    counts = [0] * bins
+    for bucket, bucket_count in from_db(bucket_query,
+                                        [minimum, maximum, bins, bins] + parameters,
+                                        fetch_as='tuple'):
+        counts[bucket - 1] = bucket_count
+    edges = [minimum + (maximum - minimum) * i / bins for i in range(bins)] + [maximum]
+    return counts, edges
+
 def exec_query(sql, parameters=None):
     """
     Execute a plain SQL query.
@@ -78,12 +202,64 @@ def exec_query(sql, parameters=None):
     
     Keyword Args:
         parameters (iterable): An iterable of parameters, that will be autoescaped.
+    
+    Returns:
+        int: The number of rows affected by the query as reported by the
+        cursor.
     """
     with connection.cursor() as cursor:
         if parameters is not None:
             cursor.execute(sql, parameters)
         else:
             cursor.execute(sql)
+        return cursor.rowcount
+
+@contextmanager
+def advisory_lock(name):
+    """
+    Hold a PostgreSQL transaction level advisory lock while in the context.
+    
+    Other processes trying to acquire the lock with the same name wait 
+    until the lock is released. The context runs in a transaction and the
+    lock is released when the transaction ends, even if the context 
+    raised an error. Inside an outer transaction, e.g. with 
+    ``ATOMIC_REQUESTS``, the lock is held until the outer transaction ends.
+    
+    Args:
+        name (str): The name identifying the lock.
+    """
+    with transaction.atomic():
+        exec_query('SELECT pg_advisory_xact_lock(hashtext(%s));', [name])
+        yield
+
+@contextmanager
+def try_advisory_lock(name):
+    """
+    Try to acquire the advisory lock of :func:`advisory_lock` without 
+    waiting for it.
+    
+    Args:
+        name (str): The name identifying the lock.
+        
+    Yields:
+        bool: Whether the lock was acquired. If it was, it is held until
+        the transaction of the context ends.
+    """
+    with transaction.atomic():
+        yield from_db('SELECT pg_try_advisory_xact_lock(hashtext(%s));', [name],
+                      fetch_as='tuple')[0][0]
+
+def is_undefined_table(exc):
+    """
+    Check whether a DB error was raised because a table does not exist.
+    
+    Args:
+        exc (DatabaseError): The error.
+        
+    Returns:
+        bool: True if the error has the SQLSTATE of an undefined table.
+    """
+    return getattr(exc.__cause__, 'pgcode', None) == UNDEFINED_TABLE
 
 def db_table_exists(table_name):
     """
@@ -95,7 +271,32 @@ def db_table_exists(table_name):
     Returns:
         bool: True if the table exists, else False.
     """
-    return table_name in connection.introspection.table_names()
+    # Look up the single table, instead of listing all tables, as there
+    # may be many cached tables.
+    row = from_db('SELECT to_regclass(%s) IS NOT NULL;', [table_name], 
+                  fetch_as='tuple')
+    return row[0][0]
+
+def get_index_name(table_name, column):
+    """
+    Construct the name of an index on a single column.
+    
+    Names exceeding the identifier length of PostgreSQL are shortened and
+    made unique with a hash, as PostgreSQL would silently truncate them.
+    
+    Args:
+        table_name (str): The name of the indexed table.
+        column (str): The name of the indexed column.
+        
+    Returns:
+        str: The name of the index.
+    """
+    max_length = connection.ops.max_name_length() or 63
+    index_name = '%s_%s_idx' % (table_name, column)
+    if len(index_name) > max_length:
+        digest = hashlib.md5(index_name.encode()).hexdigest()[:8]
+        index_name = '%s_%s_idx' % (index_name[:max_length - 13], digest)
+    return index_name
 
 def get_columnnames(table_name):
     """
@@ -107,12 +308,14 @@ def get_columnnames(table_name):
     Returns:
         tuple: The column names.
     """
+    # Selecting no rows still describes the columns, even for empty tables.
     query = """
     SELECT *
     FROM %s 
-    LIMIT 1""" % table_name    
-    row = from_db(query, fetch_as='namedtuple')
-    return row[0]._fields
+    LIMIT 0""" % table_name    
+    with connection.cursor() as cursor:
+        cursor.execute(query)
+        return tuple(col[0] for col in cursor.description)
 
 def get_m2m_field(intermediary_model, related_model):
     """
@@ -15,3 +15,7 @@ class NotSupportedError(Exception):
 class NotFoundError(Exception):
     """Raise if a value for a variable could not be set."""
     pass
+    
+class PlotTimeoutError(Exception):
+    """Raise if rendering a plot takes longer than the timeout."""
+    pass
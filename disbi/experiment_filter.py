@@ -1,13 +1,12 @@
 """
 Functions for filtering the experiments based on conditions.
 """
-# standard library
-from copy import deepcopy
-
 # Django
 from django.conf import settings
 
 # DISBi
+from disbi.condition_tokens import (filter_by_tokens, get_combinable_fields,
+                                    sync_condition_tokens)
 from disbi.utils import clean_set
 
 
@@ -72,6 +71,10 @@ def get_experiments_by_condition(conditions, experiment_model):
     """
     Return a set of experiments that match the conditions.
     
+    Combinable conditions match an experiment, if all conditions joined
+    in its field were chosen, see :mod:`disbi.condition_tokens`. All
+    conditions are resolved with a single query.
+    
     Args:
         conditions (dict): A dictionary with conditions as keys and a list of values.
     
@@ -82,29 +85,18 @@ def get_experiments_by_condition(conditions, experiment_model):
     # evaluates to false.
     if not conditions:
         return set() 
-    query_conditions = lookup_format(conditions)
-    # Experiments from parameters.
-    exps_by_condition = set(experiment_model.objects.filter(**query_conditions))
-
-
     # Experimental parameters that can be combined in a microarray experiment.
-    combinable_conditions = [field.name for field in experiment_model._meta.get_fields()
-                             if getattr(field, 'di_combinable', False)]
-    combined_conditions = combine_conditions(conditions, combinable_conditions)
-    combined_query_conditions = lookup_format(combined_conditions)
-    # Experiments from all combinable conditions combined.
-    exps_by_combined_condtion = set(experiment_model.objects.filter(**combined_query_conditions) or ()) 
-    # Experiments from a single combinable condition, combined each.
+    combinable_conditions = [k for k in get_combinable_fields(experiment_model)
+                             if k in conditions]
+    plain_conditions = dict((k, v) for k, v in conditions.items()
+                            if k not in combinable_conditions)
+    experiments = experiment_model.objects.filter(**lookup_format(plain_conditions))
+    if combinable_conditions:
+        sync_condition_tokens(experiment_model)
     for combinable_condition in combinable_conditions:
-        if combinable_condition in conditions.keys():
-            c_conditions = deepcopy(conditions)
-            c_conditions[combinable_condition] = combine_on_sep(conditions[combinable_condition], 
-                                                                settings.DISBI['SEPARATOR'])
-            c_combined_query_conditons = lookup_format(c_conditions)
-            exps_by_combined_condtion |= set(experiment_model.objects.filter(
-                                            **c_combined_query_conditons) or ()) 
-            
-    return exps_by_condition | exps_by_combined_condtion
+        experiments = filter_by_tokens(experiments, combinable_condition, 
+                                       conditions[combinable_condition])
+    return set(experiments)
 
 def get_requested_experiments(formset_list, experiment_model):
     """
@@ -118,18 +110,21 @@ def get_requested_experiments(formset_list, experiment_model):
         and those that matched the requested conditons. 
     """
     
-    # Formsets with these prefixes return model instances,
-    # thus no further query is needed.
+    # Formsets with these prefixes return the primary keys of experiments,
+    # thus they are not conditions.
     no_query = ['experiment']
              
     conditions = {}
+    directly_req_ids = set()
     for formset in formset_list:
         if formset.prefix not in no_query:
             conditions.update(clean_set(formset.cleaned_data))
         elif formset.prefix == 'experiment':
             # Directly requested experiments.
-            directly_req_exps = (set(
+            directly_req_ids = (set(
                 clean_set(formset.cleaned_data).get('experiment') or ())
                                 )
+    directly_req_exps = (set(experiment_model.objects.filter(pk__in=directly_req_ids))
+                         if directly_req_ids else set())
     exps_from_conditions = get_experiments_by_condition(conditions, experiment_model)
     return directly_req_exps | exps_from_conditions
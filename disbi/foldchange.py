@@ -0,0 +1,99 @@
+"""
+Calculates fold changes between the data columns of experiments with NumPy.
+
+The data columns are loaded once into a float array, in which missing
+values are NaN. Any number of fold changes are then calculated in a single
+vectorized division. Divisions by zero and divisions involving missing
+values result in missing values.
+"""
+# third-party
+import numpy as np
+
+
+def to_array(rows):
+    """
+    Load values from the DB into a float array.
+
+    Args:
+        rows (iterable): The values of one column or sequences with the
+            values of several columns per row. Missing values are None.
+
+    Returns:
+        numpy.ndarray: The float array, in which missing values are NaN.
+    """
+    return np.array(rows, dtype=float)
+
+def to_list(array):
+    """
+    Convert a float array to a list, in which missing values are None.
+
+    Args:
+        array (numpy.ndarray): A one-dimensional float array.
+
+    Returns:
+        list: The values with NaN replaced by None.
+    """
+    values = array.astype(object)
+    values[np.isnan(array)] = None
+    return values.tolist()
+
+def divide(dividend, divisor, log2=False):
+    """
+    Divide two arrays element-wise and mask invalid quotients.
+
+    Args:
+        dividend (numpy.ndarray): The dividends.
+        divisor (numpy.ndarray): The divisors.
+
+    Keyword Args:
+        log2 (bool): Return the binary logarithm of the quotients.
+            Quotients that are not positive are masked then.
+
+    Returns:
+        numpy.ndarray: The quotients, that are NaN where the divisor is
+        zero or either value is missing.
+    """
+    dividend, divisor = np.broadcast_arrays(np.asarray(dividend, dtype=float),
+                                            np.asarray(divisor, dtype=float))
+    quotient = np.full(dividend.shape, np.nan)
+    valid = (divisor != 0) & ~np.isnan(dividend) & ~np.isnan(divisor)
+    np.divide(dividend, divisor, out=quotient, where=valid)
+    if log2:
+        return masked_log2(quotient)
+    return quotient
+
+def masked_log2(quotient):
+    """
+    Calculate the binary logarithm of quotients and mask invalid results.
+
+    Args:
+        quotient (numpy.ndarray): The quotients, in which missing values
+            are NaN.
+
+    Returns:
+        numpy.ndarray: The logarithms, that are NaN where the quotient is
+        missing or not positive.
+    """
+    quotient = np.asarray(quotient, dtype=float)
+    log_quotient = np.full(quotient.shape, np.nan)
+    np.log2(quotient, out=log_quotient, where=~np.isnan(quotient) & (quotient > 0))
+    return log_quotient
+
+def fold_changes(data, pairs, log2=False):
+    """
+    Calculate the fold changes between pairs of columns.
+
+    Args:
+        data (numpy.ndarray): A two-dimensional array with one column per
+            experiment column, see :func:`to_array`.
+        pairs (iterable): Tuples with the indexes of the dividend and
+            divisor columns in ``data``.
+
+    Keyword Args:
+        log2 (bool): Calculate the binary logarithm of the fold changes.
+
+    Returns:
+        numpy.ndarray: A two-dimensional array with one column per pair.
+    """
+    pairs = np.array(list(pairs), dtype=int).reshape(-1, 2)
+    return divide(data[:, pairs[:, 0]], data[:, pairs[:, 1]], log2=log2)
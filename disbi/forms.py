@@ -2,6 +2,7 @@
 Forms used throughout the DISBi app.
 """
 # standard library
+import threading
 from collections import namedtuple
 
 # third-party
@@ -14,8 +15,42 @@ from django.db.models.fields.related import ForeignKey
 from django.utils.translation import ugettext_lazy as _
 
 # DISBi
+from disbi.change_tracking import get_table_versions, install_version_triggers
 from disbi.utils import camelize, construct_none_displayer, get_choices
 
+# The experiment models mapped to the versions of the tables their filter
+# forms are constructed from and the form classes.
+_forms = {}
+_forms_lock = threading.Lock()
+
+
+# ------------------------------ classes ------------------------------
+
+class InstanceChoiceField(forms.TypedChoiceField):
+    """
+    Field for selecting a model instance from choices, that are fetched
+    once when the field is constructed.
+    
+    Unlike the choices of a ``ModelChoiceField``, they are not queried 
+    again whenever a form is rendered or validated, so that fields of 
+    cached form classes do not hit the DB, see :func:`construct_forms`. 
+    The cleaned value is the primary key of the selected instance.
+    """
+    def __init__(self, queryset, empty_label='---------', **kwargs):
+        """
+        Initialize InstanceChoiceField.
+        
+        Args:
+            queryset (QuerySet): The selectable instances.
+            
+        Keyword Args:
+            empty_label (str): The label of the empty choice.
+        """
+        instance_choices = [(instance.pk, str(instance)) for instance in queryset]
+        self.instance_count = len(instance_choices)
+        super().__init__(choices=[('', empty_label)] + instance_choices,
+                         coerce=queryset.model._meta.pk.to_python, **kwargs)
+
 
 # ----------------------------- functions -----------------------------
 
@@ -88,9 +123,8 @@ def construct_direct_select_form(model):
         model (models.Model): A Django model, for which the form is constructed.
     """
     cls_name = model.__name__ + 'Form'
-    entries = model.objects.all()
-    mymax_num = len(entries)
-    myselect_field = forms.ModelChoiceField(queryset=entries)
+    myselect_field = InstanceChoiceField(queryset=model.objects.all())
+    mymax_num = myselect_field.instance_count
     form = type(cls_name, (forms.Form,), {
                 model.__name__.lower(): myselect_field,
                 'max_num': mymax_num,}
@@ -108,9 +142,8 @@ def construct_foreign_select_field(model, field):
     entries = field.related_model.objects.filter(pk__in=
                 model.objects.values_list(field.name, flat=True).distinct()
             )
-    max_num = len(entries)
-    select_field = forms.ModelChoiceField(queryset=entries)
-    return select_field, max_num 
+    select_field = InstanceChoiceField(queryset=entries)
+    return select_field, select_field.instance_count
 
 
 
@@ -164,8 +197,45 @@ def construct_modelfieldsform(model, exclude=['id'], direct_select=False):
             formclasses.append(NamedFormClass(form, field.name))
     return formclasses
 
+def get_form_dependencies(experiment_model):
+    """
+    Get the DB tables the choices of the filter forms are selected from.
+    
+    Args:
+        experiment_model (models.Model): The experiment model.
+    
+    Returns:
+        tuple: The table of the experiment model and the tables of the
+        models it has a ForeignKey to.
+    """
+    dbtables = [experiment_model._meta.db_table]
+    dbtables.extend(field.related_model._meta.db_table 
+                    for field in experiment_model._meta.get_fields()
+                    if isinstance(field, ForeignKey))
+    return tuple(unique_everseen(dbtables))
+
 def construct_forms(experiment_model):
-    """Wrapper for `construct_modelfieldsform` with appropriate arguments."""
+    """
+    Wrapper for `construct_modelfieldsform` with appropriate arguments.
+    
+    The form classes are cached until one of the tables their choices 
+    are selected from changes, see :func:`get_form_dependencies`. Their
+    choices are fetched once when they are constructed.
+    
+    Args:
+        experiment_model (models.Model): The experiment model.
+    
+    Returns:
+        tuple: The namedtuples with the form classes and the prefix.
+    """
+    dbtables = get_form_dependencies(experiment_model)
+    # Ensure that changes to the tables are tracked.
+    install_version_triggers(dbtables)
+    versions = get_table_versions(dbtables)
+    with _forms_lock:
+        cached = _forms.get(experiment_model)
+    if cached is not None and cached[0] == versions:
+        return cached[1]
     
     exclude_fields = [
                       field.name for field in experiment_model._meta.get_fields()
@@ -173,11 +243,14 @@ def construct_forms(experiment_model):
                       not getattr(field, 'di_choose', False)
                       ]
     
-    return  construct_modelfieldsform(
-                experiment_model,
-                direct_select=True, 
-                exclude=exclude_fields
-            )
+    formclasses = tuple(construct_modelfieldsform(
+                            experiment_model,
+                            direct_select=True, 
+                            exclude=exclude_fields
+                        ))
+    with _forms_lock:
+        _forms[experiment_model] = (versions, formclasses)
+    return formclasses
 
 def foldchange_form_factory(experiments):
     """
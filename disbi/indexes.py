@@ -0,0 +1,144 @@
+"""
+Provides the composite indexes that serve the extraction of experiment data
+from the measurement tables.
+
+The data of an experiment is selected with ``WHERE experiment_id = X`` and
+joined on the foreign key to the biological model. An index on both columns,
+that additionally covers the shown columns, lets PostgreSQL answer these
+queries with an index-only scan.
+"""
+# Django
+from django.apps import apps
+from django.db import connection
+
+# DISBi
+from disbi.db_utils import db_table_exists, exec_query, from_db, get_index_name
+from disbi.models import BiologicalModel, MeasurementModel
+
+# First server version that supports INCLUDE columns in indexes.
+INCLUDE_MIN_VERSION = 110000
+
+
+def get_measurement_models(app_configs=None):
+    """
+    Get all concrete measurement models.
+
+    Keyword Args:
+        app_configs (iterable of AppConfig): Restrict the models to these
+            apps. Defaults to all installed apps.
+
+    Returns:
+        list: The measurement models.
+    """
+    if app_configs is None:
+        app_configs = apps.get_app_configs()
+    return [model for app_config in app_configs for model in app_config.get_models()
+            if issubclass(model, MeasurementModel) and not model._meta.proxy]
+
+def get_measurement_indexes(model):
+    """
+    Get the composite indexes that a measurement model should have.
+
+    Args:
+        model (Model): The measurement model.
+
+    Returns:
+        list: One tuple for each foreign key to a biological model, with
+        the name of the index, the key columns and the covered columns.
+    """
+    experiment_column = model._meta.get_field('experiment').column
+    covered_columns = [field.column for field in model._meta.concrete_fields
+                       if getattr(field, 'di_show', False)
+                       or getattr(field, 'exclude', False)]
+    indexes = []
+    for field in model._meta.concrete_fields:
+        if field.is_relation and issubclass(field.related_model, BiologicalModel):
+            key_columns = [experiment_column, field.column]
+            index_name = get_index_name(model._meta.db_table, '_'.join(key_columns))
+            indexes.append((index_name, key_columns,
+                            [column for column in covered_columns
+                             if column not in key_columns]))
+    return indexes
+
+def index_exists(table_name, key_columns):
+    """
+    Check whether a table has an index starting with the given columns.
+
+    Args:
+        table_name (str): The name of the table.
+        key_columns (list of str): The leading key columns of the index
+            in order.
+
+    Returns:
+        bool: True if such an index exists, else False.
+    """
+    joins = '\n'.join('''
+    JOIN pg_catalog.pg_attribute a%(i)d
+        ON a%(i)d.attrelid = i.indrelid AND a%(i)d.attnum = i.indkey[%(i)d]
+        AND a%(i)d.attname = %%s''' % {'i': i} for i in range(len(key_columns)))
+    select_query = '''
+    SELECT count(*)
+    FROM pg_catalog.pg_index i
+    %s
+    WHERE i.indrelid = to_regclass(%%s) AND i.indisvalid;
+    ''' % joins
+    row = from_db(select_query, list(key_columns) + [table_name], fetch_as='tuple')
+    return row[0][0] > 0
+
+def get_missing_measurement_indexes(models):
+    """
+    Get the composite indexes that are missing on the measurement tables.
+
+    Tables that do not exist yet, e.g. because their migration was not
+    applied, are skipped.
+
+    Args:
+        models (iterable of Model): The measurement models.
+
+    Returns:
+        list: Tuples of the model and the index as returned by
+        :func:`get_measurement_indexes`.
+    """
+    missing = []
+    for model in models:
+        table_name = model._meta.db_table
+        if not db_table_exists(table_name):
+            continue
+        for index in get_measurement_indexes(model):
+            if not index_exists(table_name, index[1]):
+                missing.append((model, index))
+    return missing
+
+def create_measurement_index(model, index):
+    """
+    Create a composite index on a measurement table without blocking writes.
+
+    On servers that do not support INCLUDE, the covered columns are
+    appended to the key columns instead. As the index is built
+    concurrently, this must not be called inside a transaction.
+
+    Args:
+        model (Model): The measurement model.
+        index (tuple): The index as returned by :func:`get_measurement_indexes`.
+
+    Returns:
+        str: The SQL statement that was executed.
+    """
+    index_name, key_columns, covered_columns = index
+    # A failed concurrent build leaves an invalid index behind, that
+    # would be skipped by IF NOT EXISTS.
+    select_query = '''
+    SELECT count(*)
+    FROM pg_catalog.pg_index
+    WHERE indexrelid = to_regclass(%s) AND NOT indisvalid;
+    '''
+    if from_db(select_query, [index_name], fetch_as='tuple')[0][0]:
+        exec_query('DROP INDEX CONCURRENTLY IF EXISTS %s;' % index_name)
+    if covered_columns and connection.pg_version >= INCLUDE_MIN_VERSION:
+        columns = '(%s) INCLUDE (%s)' % (', '.join(key_columns), ', '.join(covered_columns))
+    else:
+        columns = '(%s)' % ', '.join(key_columns + covered_columns)
+    sql = 'CREATE INDEX CONCURRENTLY IF NOT EXISTS %s ON %s %s;' % (
+        index_name, model._meta.db_table, columns)
+    exec_query(sql)
+    return sql
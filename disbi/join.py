@@ -3,20 +3,24 @@ Contains the class Relations that stores relations between models
 and joins them together appropriately.
 """
 # standard library
+import time
 from collections import deque
 from itertools import product
 
+# third-party
+from more_itertools import unique_everseen
+
 # Django
 from django.apps import apps
 from django.conf import settings
-from django.db import connection, models
+from django.db import OperationalError, connection, models, transaction
 
 # DISBi
-from disbi.db_utils import (exec_query, get_field_query_name,
-                            get_fk_query_name, get_m2m_field,
+from disbi.db_utils import (advisory_lock, exec_query, get_field_query_name,
+                            get_fk_query_name, get_index_name, get_m2m_field,
                             get_pk_query_name)
 from disbi.models import MetaModel
-from disbi.option_utils import get_models_of_superclass
+from disbi.option_utils import get_field_descriptor, get_models_of_superclass
 
 
 class Relations():
@@ -25,6 +29,14 @@ class Relations():
     """
     # pylint: disable=too-many-instance-attributes
     # Eight is reasonable in this case.
+    
+    # Suffix of the table the joined table is built in before it is swapped in.
+    SHADOW_SUFFIX = 'new'
+    # Settings for acquiring the lock on the old table during the swap.
+    SWAP_ATTEMPTS = 5
+    SWAP_LOCK_TIMEOUT = '2s'
+    SWAP_RETRY_DELAY = 1
+    
     def __init__(self, app_label, model_superclass=None):
         """
         Initialize Relations.
@@ -190,6 +202,17 @@ class Relations():
         # Confirm that DB backend is Postgres.
         if not connection.vendor == 'postgresql':
             raise ValueError('Database system {} not supported. Use PostgreSQL.'.format(connection.vendor))
+        self.compile_join()
+        
+    def compile_join(self):
+        """
+        Linearize the models and construct the SQL JOIN without 
+        executing it.
+        
+        Raises:
+            ValueError: If the relations do not form a tree or no model
+                is marked as its root with ``di_first``.
+        """
         # First check whether the graph formed by the relation_map
         # is actually a tree.
         if not self.is_tree:
@@ -199,10 +222,11 @@ class Relations():
         # determining the order the columns are displayed in the end.
         self.linearized = []
         # Get the model that was set as the root of the relation tree.
-        for model in self.models:
-            if getattr(model, 'di_first', False):
-                first = model
-                break
+        roots = [model for model in self.models if getattr(model, 'di_first', False)]
+        if not roots:
+            raise ValueError('No model is set as the root of the relation tree '
+                             'with di_first.')
+        first = roots[0]
         self.linearized.append(first)
         
         # Construct the from statement with the root model.
@@ -398,8 +422,7 @@ class Relations():
         # Add all columns where `show` is True. 
         column_names += [
                             self._as_display_name(model, field)
-                            for field in model._meta.get_fields() 
-                            if getattr(field, 'di_show', False)
+                            for field in get_field_descriptor(model).show_fields
                         ]
 
         return column_names
@@ -425,15 +448,103 @@ class Relations():
             return field.column
         
     
+    def get_index_columns(self):
+        """
+        Get the columns of the joined table that should be indexed.
+        
+        These are the id columns of all models, on which the experiment 
+        data is joined, and the human readable keys, by which rows are
+        looked up. 
+        
+        Returns:
+            list: The column names in the joined table.
+        """
+        index_columns = []
+        for model in self.linearized:
+            index_columns.append('%s_%s' % (model.__name__.lower(), model._meta.pk.column))
+            for field in get_field_descriptor(model).show_fields:
+                if getattr(field, 'di_hr_primary_key', False) or field.unique:
+                    index_columns.append(getattr(field, 'di_display_name', None) 
+                                         or field.column)
+        return list(unique_everseen(index_columns))
+    
     def create_joined_table(self):
         """
-        Execute the the SQL JOIN and create a table thereof. 
+        Execute the the SQL JOIN and create a table thereof, see 
+        :meth:`build_joined_table`.
         """
-        table_name = '%s_%s' % (self.app_label, settings.DISBI['JOINED_TABLENAME'])
-        exec_query('DROP TABLE IF EXISTS %s;' % table_name)
-        sql = '''
-        CREATE TABLE %s AS
-        %s
-        ''' % (table_name,
-               self.sql)
-        exec_query(sql)
+        self.build_joined_table(self.app_label, self.sql, self.get_index_columns())
+        
+    @classmethod
+    def build_joined_table(cls, app_label, sql, index_columns):
+        """
+        Create the joined table from a compiled SQL JOIN.
+        
+        The table is built under a temporary name, indexed and analyzed, 
+        before it replaces the old table with a rename in a single 
+        transaction. Thus readers never see a missing or partially built 
+        table and are only blocked for the short moment of the swap.
+        
+        Args:
+            app_label (str): The label of the app the models live in.
+            sql (str): The SQL JOIN, see :meth:`compile_join`.
+            index_columns (iterable of str): The columns that are indexed,
+                see :meth:`get_index_columns`.
+        """
+        # Confirm that DB backend is Postgres.
+        if not connection.vendor == 'postgresql':
+            raise ValueError('Database system {} not supported. Use PostgreSQL.'.format(connection.vendor))
+        table_name = '%s_%s' % (app_label, settings.DISBI['JOINED_TABLENAME'])
+        shadow_table_name = '%s_%s' % (table_name, cls.SHADOW_SUFFIX)
+        # Prevent concurrent rebuilds from using the same shadow table.
+        with advisory_lock(shadow_table_name):
+            exec_query('DROP TABLE IF EXISTS %s;' % shadow_table_name)
+            create_sql = '''
+            CREATE TABLE %s AS
+            %s
+            ''' % (shadow_table_name,
+                   sql)
+            exec_query(create_sql)
+            for column in index_columns:
+                exec_query('CREATE INDEX %s ON %s (%s);' 
+                           % (get_index_name(shadow_table_name, column), 
+                              shadow_table_name, column))
+            exec_query('ANALYZE %s;' % shadow_table_name)
+            cls._swap_tables(shadow_table_name, table_name, index_columns)
+        
+    @classmethod
+    def _swap_tables(cls, shadow_table_name, table_name, index_columns=()):
+        """
+        Replace a table with its shadow table.
+        
+        The swap needs an exclusive lock on the old table. To not queue up
+        readers behind a swap waiting for a long running query, the lock is
+        only waited for a short time and the swap is retried, before 
+        waiting without timeout in the last attempt.
+        
+        Args:
+            shadow_table_name (str): The name of the newly built table.
+            table_name (str): The name of the table that is replaced.
+            
+        Keyword Args:
+            index_columns (iterable of str): The indexed columns, whose
+                indexes are renamed along with the table.
+        """
+        for attempt in range(cls.SWAP_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    if attempt < cls.SWAP_ATTEMPTS - 1:
+                        exec_query("SET LOCAL lock_timeout = '%s';" % cls.SWAP_LOCK_TIMEOUT)
+                    exec_query('DROP TABLE IF EXISTS %s;' % table_name)
+                    exec_query('ALTER TABLE %s RENAME TO %s;' % (shadow_table_name, 
+                                                                table_name))
+                    for column in index_columns:
+                        exec_query('ALTER INDEX %s RENAME TO %s;' 
+                                   % (get_index_name(shadow_table_name, column),
+                                      get_index_name(table_name, column)))
+                return
+            except OperationalError:
+                # The lock could not be acquired in time.
+                if attempt == cls.SWAP_ATTEMPTS - 1:
+                    raise
+                time.sleep(cls.SWAP_RETRY_DELAY)
@@ -0,0 +1,60 @@
+"""
+Management command for comparing the query strategies for constructing
+the result table.
+"""
+# standard library
+import json
+
+# Django
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+# DISBi
+from disbi.db_utils import from_db
+from disbi.models import DisbiExperimentMetaInfo
+from disbi.result import DataResult
+
+
+class Command(BaseCommand):
+    help = ('Run EXPLAIN ANALYZE on the result table query for a set of '
+            'experiments with each query strategy and report the timings.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('app_label', help='The app the experiments belong to.')
+        parser.add_argument('experiment_ids', nargs='+', type=int,
+                            help='The ids of the requested experiments.')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Number of runs per strategy. The fastest is reported.')
+        parser.add_argument('--plan', action='store_true',
+                            help='Print the query plan of the fastest run.')
+
+    def handle(self, *args, **options):
+        app_config = apps.get_app_config(options['app_label'])
+        meta_models = [model for model in app_config.get_models()
+                       if issubclass(model, DisbiExperimentMetaInfo)]
+        if not meta_models:
+            raise CommandError('%s has no model deriving from DisbiExperimentMetaInfo.'
+                               % app_config.label)
+        experiment_meta_model = meta_models[0]
+        requested_exps = experiment_meta_model.objects.filter(pk__in=options['experiment_ids'])
+        result = DataResult(requested_exps, experiment_meta_model)
+
+        for strategy in DataResult.STRATEGIES:
+            sql = result.construct_base_table(strategy=strategy)
+            runs = []
+            for _ in range(options['repeat']):
+                plan = from_db('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) %s' % sql,
+                               fetch_as='tuple')[0][0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                runs.append(plan[0])
+            fastest = min(runs, key=lambda run: run['Execution Time'])
+            self.stdout.write('%-6s planning %9.3f ms  execution %9.3f ms  rows %d  '
+                              'shared blocks hit %d read %d'
+                              % (strategy, fastest['Planning Time'],
+                                 fastest['Execution Time'],
+                                 fastest['Plan']['Actual Rows'],
+                                 fastest['Plan'].get('Shared Hit Blocks', 0),
+                                 fastest['Plan'].get('Shared Read Blocks', 0)))
+            if options['plan']:
+                self.stdout.write(json.dumps(fastest['Plan'], indent=2))
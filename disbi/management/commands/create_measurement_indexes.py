@@ -0,0 +1,37 @@
+"""
+Management command for creating the composite indexes on the measurement
+tables, that serve the extraction of experiment data.
+"""
+# Django
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+# DISBi
+from disbi.indexes import (create_measurement_index, get_measurement_models,
+                           get_missing_measurement_indexes)
+
+
+class Command(BaseCommand):
+    help = ('Create a covering index on (experiment, biological foreign key) '
+            'for each measurement table that lacks one. The indexes are built '
+            'concurrently, so the tables stay writable.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('app_label', nargs='*',
+                            help='Only create the indexes for these apps.')
+        parser.add_argument('--dry-run', action='store_true', dest='dry_run',
+                            help='Only list the missing indexes.')
+
+    def handle(self, *args, **options):
+        app_configs = None
+        if options['app_label']:
+            app_configs = [apps.get_app_config(app_label)
+                           for app_label in options['app_label']]
+        missing = get_missing_measurement_indexes(get_measurement_models(app_configs))
+        for model, index in missing:
+            if options['dry_run']:
+                self.stdout.write('Missing %s on %s' % (index[0], model._meta.db_table))
+            else:
+                self.stdout.write(create_measurement_index(model, index))
+        if not missing:
+            self.stdout.write('All measurement indexes exist.')
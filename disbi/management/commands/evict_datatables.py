@@ -0,0 +1,32 @@
+"""
+Management command for dropping cached datatables that expired or exceed
+the size budget of the cache.
+"""
+# Django
+from django.core.management.base import BaseCommand
+
+# DISBi
+from disbi.cache_table import evict_datatables
+
+
+class Command(BaseCommand):
+    help = ('Drop the cached datatables that were not accessed within the TTL '
+            'and the least recently used ones exceeding the size budget. '
+            'Limits default to the CACHE_TTL and CACHE_MAX_BYTES settings.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--app', dest='app_label',
+                            help='Only evict the datatables of this app.')
+        parser.add_argument('--max-bytes', type=int, dest='max_bytes',
+                            help='Total size the cached datatables may occupy.')
+        parser.add_argument('--ttl', type=float, dest='ttl',
+                            help='Seconds after the last access after which '
+                                 'a datatable expires.')
+
+    def handle(self, *args, **options):
+        evicted = evict_datatables(app_label=options['app_label'],
+                                   max_bytes=options['max_bytes'],
+                                   ttl=options['ttl'])
+        for table_name in evicted:
+            self.stdout.write('Dropped %s' % table_name)
+        self.stdout.write('Evicted %d datatable(s).' % len(evicted))
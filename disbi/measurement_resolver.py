@@ -0,0 +1,111 @@
+"""
+Resolves the measurement models holding the data of experiments in bulk.
+
+Instead of probing each measurement table for each experiment, the
+measurement models of all experiments of an app are determined with a
+single query, that checks each measurement table with ``EXISTS``. The
+result is memoized per process until the version of a measurement table
+changes, i.e. when measurement data is imported, changed or deleted,
+see :mod:`disbi.change_tracking`.
+"""
+# standard library
+import threading
+
+# DISBi
+from disbi.change_tracking import get_table_versions, install_version_triggers
+from disbi.db_utils import from_db
+from disbi.models import BiologicalModel, MeasurementModel
+from disbi.option_utils import get_models_of_superclass
+
+# The app labels mapped to the versions of the measurement tables and the
+# experiment ids mapped to their measurement model.
+_resolved = {}
+_resolved_lock = threading.Lock()
+
+
+def _query_measurement_models(models):
+    """
+    Map the experiments to the measurement models, that hold their data.
+
+    Args:
+        models (list): The measurement models of an app.
+
+    Returns:
+        dict: The ids of all experiments with data mapped to their
+        measurement model. If data of an experiment is found in several
+        tables, the last model takes precedence.
+    """
+    branches = []
+    for index, model in enumerate(models):
+        exp_field = model._meta.get_field('experiment')
+        exp_meta = exp_field.related_model._meta
+        branches.append('''
+        SELECT {index} AS model_index, e.{pk} AS experiment_id
+        FROM {exp_table} AS e
+        WHERE EXISTS (SELECT 1 FROM {table} AS m WHERE m.{column} = e.{pk})
+        '''.format(index=index, pk=exp_meta.pk.column, exp_table=exp_meta.db_table,
+                   table=model._meta.db_table, column=exp_field.column))
+    rows = from_db('%s ORDER BY model_index;' % ' UNION ALL '.join(branches),
+                   fetch_as='tuple')
+    return dict((experiment_id, models[index]) for index, experiment_id in rows)
+
+def get_experiment_measurement_models(app_label):
+    """
+    Get the measurement models of all experiments of an app.
+
+    Args:
+        app_label (str): The label of the app the experiments live in.
+
+    Returns:
+        dict: The ids of all experiments with data mapped to their
+        measurement model. Experiments without data are missing.
+    """
+    models = get_models_of_superclass(app_label, (MeasurementModel,))
+    if not models:
+        return {}
+    dbtables = tuple(model._meta.db_table for model in models)
+    # Ensure that changes to the tables are tracked.
+    install_version_triggers(dbtables)
+    versions = get_table_versions(dbtables)
+    with _resolved_lock:
+        resolved = _resolved.get(app_label)
+    if resolved is not None and resolved[0] == versions:
+        return resolved[1]
+    measurement_models = _query_measurement_models(models)
+    with _resolved_lock:
+        _resolved[app_label] = (versions, measurement_models)
+    return measurement_models
+
+def get_biofield(model):
+    """
+    Get the field of a measurement model relating it to the biological model.
+
+    Args:
+        model (Model): The measurement model.
+
+    Returns:
+        models.Field: The field, or None if the model is not related to a
+        biological model. Assuming that each measurement model maps to
+        one biological model, the last related field is returned.
+    """
+    biofield = None
+    for field in model._meta.get_fields():
+        if field.remote_field and issubclass(field.related_model, BiologicalModel):
+            biofield = field
+    return biofield
+
+def resolve_measurement_models(experiments):
+    """
+    Attach the measurement model, the biological field and the biological
+    model to many experiments at once.
+
+    Args:
+        experiments (iterable of DisbiExperimentMetaInfo): Experiments of
+            the same app.
+    """
+    experiments = list(experiments)
+    if not experiments:
+        return
+    measurement_models = get_experiment_measurement_models(experiments[0]._meta.app_label)
+    for exp in experiments:
+        exp.set_measurementmodel(measurement_models.get(exp.pk))
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# future
+from __future__ import unicode_literals
+
+# Django
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('disbi', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TableVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table_name', models.CharField(max_length=512, unique=True)),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunSQL(
+            # Create the trigger function that increments the version counter
+            # of the table the trigger fired on.
+            '''CREATE OR REPLACE FUNCTION disbi_increment_table_version() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO disbi_tableversion (table_name, version)
+                VALUES (TG_TABLE_NAME, 1)
+                ON CONFLICT (table_name) 
+                DO UPDATE SET version = disbi_tableversion.version + 1;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE PLPGSQL;''',
+            reverse_sql='DROP FUNCTION IF EXISTS disbi_increment_table_version() CASCADE;'
+        ),
+    ]
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# future
+from __future__ import unicode_literals
+
+# Django
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('disbi', '0002_tableversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CachedTable',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table_name', models.CharField(max_length=512, unique=True)),
+                ('app_label', models.CharField(max_length=100)),
+                ('experiment_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=None)),
+                ('dependencies', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=512), size=None)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChangedExperiment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table_name', models.CharField(max_length=512)),
+                ('experiment_id', models.IntegerField(null=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='changedexperiment',
+            unique_together=set([('table_name', 'experiment_id')]),
+        ),
+        migrations.RunSQL(
+            # Create the trigger function that logs the experiments of all
+            # rows changed by a statement. The name of the experiment column 
+            # is passed as argument to the trigger.
+            '''CREATE OR REPLACE FUNCTION disbi_log_changed_experiments() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'TRUNCATE' THEN
+                    INSERT INTO disbi_changedexperiment (table_name, experiment_id)
+                    VALUES (TG_TABLE_NAME, NULL);
+                END IF;
+                IF TG_OP = 'INSERT' OR TG_OP = 'UPDATE' THEN
+                    EXECUTE format(
+                        'INSERT INTO disbi_changedexperiment (table_name, experiment_id)
+                         SELECT DISTINCT %L, %I FROM disbi_new_rows
+                         ON CONFLICT DO NOTHING', TG_TABLE_NAME, TG_ARGV[0]);
+                END IF;
+                IF TG_OP = 'UPDATE' OR TG_OP = 'DELETE' THEN
+                    EXECUTE format(
+                        'INSERT INTO disbi_changedexperiment (table_name, experiment_id)
+                         SELECT DISTINCT %L, %I FROM disbi_old_rows
+                         ON CONFLICT DO NOTHING', TG_TABLE_NAME, TG_ARGV[0]);
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE PLPGSQL;''',
+            reverse_sql='DROP FUNCTION IF EXISTS disbi_log_changed_experiments() CASCADE;'
+        ),
+    ]
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# future
+from __future__ import unicode_literals
+
+# Django
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('disbi', '0003_changedexperiment_cachedtable'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cachedtable',
+            name='build_time',
+            field=models.FloatField(default=0, help_text='Duration of the last build in seconds.'),
+        ),
+        migrations.AddField(
+            model_name='cachedtable',
+            name='builds',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cachedtable',
+            name='byte_size',
+            field=models.BigIntegerField(default=0, help_text='Size of the table including indexes in bytes.'),
+        ),
+        migrations.AddField(
+            model_name='cachedtable',
+            name='cached',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='cachedtable',
+            name='hits',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cachedtable',
+            name='last_access',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='cachedtable',
+            name='row_count',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
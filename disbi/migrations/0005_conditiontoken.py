@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# future
+from __future__ import unicode_literals
+
+# Django
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('disbi', '0004_cachedtable_statistics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConditionToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('experiment_table', models.CharField(max_length=512)),
+                ('experiment_id', models.IntegerField()),
+                ('field_name', models.CharField(max_length=100)),
+                ('tokens', django.contrib.postgres.fields.ArrayField(base_field=models.TextField(), size=None)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='conditiontoken',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['tokens'], name='disbi_condi_tokens_aa50bd_gin'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='conditiontoken',
+            unique_together=set([('experiment_table', 'field_name', 'experiment_id')]),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# future
+from __future__ import unicode_literals
+
+# Django
+from django.db import migrations, models
+
+
+def delete_token_checksums(apps, schema_editor):
+    # The versions of the tokens were stored as checksums before.
+    Checksum = apps.get_model('disbi', 'Checksum')
+    Checksum.objects.filter(table_name__startswith='disbi_conditiontoken_').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('disbi', '0005_conditiontoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConditionTokenVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('experiment_table', models.CharField(max_length=512, unique=True)),
+                ('version', models.BigIntegerField()),
+            ],
+        ),
+        migrations.RunPython(delete_token_checksums, migrations.RunPython.noop),
+    ]
@@ -2,11 +2,14 @@
 from collections import OrderedDict
 
 # Django
-from django.apps import apps
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
+from django.utils import timezone
 
 # DISBi
 import disbi.disbimodels as dmodels
+from disbi.option_utils import get_field_descriptor
 
 
 class MetaModel(models.Model):
@@ -60,11 +63,7 @@ class DisbiExperiment():
             experiment object.
         """
         
-        cols = [
-                field.name for field in self.__class__._meta.get_fields()
-                if field.concrete and
-                getattr(field, 'di_show', False)
-            ]
+        cols = list(get_field_descriptor(self.__class__).concrete_show_names)
         # Use the string representation as first field.
         cols.insert(0, '__str__')
         
@@ -108,42 +107,58 @@ class DisbiExperiment():
             
 class DisbiExperimentMetaInfo():
     """
-    Mixin for Experiment proxy model, that fetches additionaly information about
-    the experiment when instantiated.
+    Mixin for Experiment proxy model, that provides additional information about
+    the data of the experiment.
     """
     
     class Meta:
         proxy = True 
     
-    def __init__(self, *args, **kwargs):
+    def set_measurementmodel(self, measurementmodel):
         """
-        Get the related MeasurementModel and the biological model for the experiment.
+        Attach the MeasurementModel and the biological model for the experiment.
         
-        The found classes are attached as attributes to the instance.
+        Args:
+            measurementmodel (Model): The MeasurementModel holding the 
+                data of the experiment or None if it has no data.
         """
-        super().__init__(*args, **kwargs)
-        
-        app_models = apps.get_app_config(self._meta.app_label).get_models()
-        # Iterate throw all models and check whether they are a MeasurementModel and no proxy.
-        # If the key of the experiment exists in the model table, that is the 
-        # right model.
-        self.measurementmodel = None
-        for model in app_models:  
-            if issubclass(model, MeasurementModel) and not model._meta.proxy:
-                related_data = model.objects.filter(experiment=self.id)
-                if related_data.exists():
-                    self.measurementmodel = model
-        if self.measurementmodel is not None:        
-            for field in self.measurementmodel._meta.get_fields():
-                # Assuming that each MeasurementModel maps to one type in the biological
-                # level, the first that is of that type is the right one.
-                if field.rel:
-                    if issubclass(field.related_model, BiologicalModel):
-                        self.biofield = field
-                        self.biomodel = field.related_model
+        self._measurementmodel = measurementmodel
+        if measurementmodel is not None:
+            # Imported here, as the resolver depends on the models.
+            from disbi.measurement_resolver import get_biofield
+            self._biofield = get_biofield(measurementmodel)
+            self._biomodel = self._biofield.related_model if self._biofield else None
         else:
-            self.biofield = None
-            self.biomodel = None
+            self._biofield = None
+            self._biomodel = None
+    
+    def _get_measurement_attr(self, name):
+        """
+        Get an attribute set by :meth:`set_measurementmodel`.
+        
+        The MeasurementModel is resolved lazily on first access, if it has
+        not been resolved in bulk with :func:`.resolve_measurement_models`.
+        """
+        if '_measurementmodel' not in self.__dict__:
+            # Imported here, as the resolver depends on the models.
+            from disbi.measurement_resolver import resolve_measurement_models
+            resolve_measurement_models([self])
+        return self.__dict__[name]
+    
+    @property
+    def measurementmodel(self):
+        """The MeasurementModel holding the data of the experiment or None."""
+        return self._get_measurement_attr('_measurementmodel')
+    
+    @property
+    def biofield(self):
+        """The field relating the MeasurementModel to the biological model."""
+        return self._get_measurement_attr('_biofield')
+    
+    @property
+    def biomodel(self):
+        """The biological model the data of the experiment maps to."""
+        return self._get_measurement_attr('_biomodel')
         
         
 class Checksum(models.Model):
@@ -153,3 +168,84 @@ class Checksum(models.Model):
     """
     table_name = models.CharField(max_length=512)
     checksum = models.CharField(max_length=1024, null=True)
+
+
+class TableVersion(models.Model):
+    """
+    Model for storing a version counter for each table watched by DISBi.
+    
+    The counter is incremented by a DB trigger for every statement 
+    that modifies the table, see :mod:`disbi.change_tracking`.
+    """
+    table_name = models.CharField(max_length=512, unique=True)
+    version = models.BigIntegerField(default=0)
+
+
+class ChangedExperiment(models.Model):
+    """
+    Model for logging the experiments whose data changed.
+    
+    Entries are written by a DB trigger on each measurement table and
+    consumed when the cached datatables are invalidated. An empty 
+    ``experiment_id`` denotes that all experiments of the table changed,
+    e.g. because the table was truncated.
+    """
+    table_name = models.CharField(max_length=512)
+    experiment_id = models.IntegerField(null=True)
+    
+    class Meta:
+        unique_together = (('table_name', 'experiment_id'),)
+
+
+class CachedTable(models.Model):
+    """
+    Model for registering the cached datatables and the experiments and
+    DB tables they were constructed from.
+    
+    Entries are kept after their table was dropped, with ``cached`` set to
+    False, so that the usage statistics of the cache are preserved.
+    """
+    table_name = models.CharField(max_length=512, unique=True)
+    app_label = models.CharField(max_length=100)
+    experiment_ids = ArrayField(models.IntegerField())
+    dependencies = ArrayField(models.CharField(max_length=512))
+    created = models.DateTimeField(auto_now_add=True)
+    cached = models.BooleanField(default=True)
+    byte_size = models.BigIntegerField(default=0,
+                                       help_text='Size of the table including indexes in bytes.')
+    row_count = models.BigIntegerField(default=0)
+    build_time = models.FloatField(default=0,
+                                   help_text='Duration of the last build in seconds.')
+    builds = models.PositiveIntegerField(default=0)
+    hits = models.PositiveIntegerField(default=0)
+    last_access = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return self.table_name
+
+
+class ConditionToken(models.Model):
+    """
+    Model for storing the values of the combinable fields of the 
+    experiments split into tokens on the ``SEPARATOR``.
+    
+    The tokens are indexed, so that experiments can be filtered by set
+    containment, see :mod:`disbi.condition_tokens`.
+    """
+    experiment_table = models.CharField(max_length=512)
+    experiment_id = models.IntegerField()
+    field_name = models.CharField(max_length=100)
+    tokens = ArrayField(models.TextField())
+    
+    class Meta:
+        unique_together = (('experiment_table', 'field_name', 'experiment_id'),)
+        indexes = [GinIndex(fields=['tokens'])]
+
+
+class ConditionTokenVersion(models.Model):
+    """
+    Model for storing the version of each experiment table, that its 
+    condition tokens were built from, see :mod:`disbi.condition_tokens`.
+    """
+    experiment_table = models.CharField(max_length=512, unique=True)
+    version = models.BigIntegerField()
@@ -1,8 +1,21 @@
 """
 Module for treating the custom DISBi options attached to the model fields.
 """
+# standard library
+from collections import namedtuple
+from functools import lru_cache
+from types import MappingProxyType
+
+# Django
 from django.apps import apps
 
+# The DISBi options of the fields of a model, see get_field_descriptor.
+FieldDescriptor = namedtuple('FieldDescriptor', [
+    'show_fields', 'show_names', 'show_columns', 'display_columns', 
+    'concrete_show_names', 'notnull_column', 'exclude_columns', 
+    'fields_by_display_name',
+])
+
 
 def get_display_name(field):
     """
@@ -50,3 +63,50 @@ def get_models_of_superclass(app_label, model_superclasses, intermediary=False):
             for intermediary_model in model._meta.many_to_many:
                 models_of_supcls.append(intermediary_model.remote_field.through)
     return models_of_supcls
+
+@lru_cache(maxsize=None)
+def get_field_descriptor(model):
+    """
+    Get the fields of a model grouped by their DISBi options.
+    
+    The options only depend on the model definition. They are collected
+    once per model, so that constructing the SQL and the views of many
+    experiments does not introspect the fields again.
+    
+    Args:
+        model (Model): The model.
+        
+    Returns:
+        FieldDescriptor: A namedtuple with the following attributes.
+        
+        - ``show_fields``: The fields with ``di_show=True``.
+        - ``show_names``: Their ``di_display_name`` or name.
+        - ``show_columns``: Their DB columns.
+        - ``display_columns``: Their ``di_display_name`` or DB column.
+        - ``concrete_show_names``: The names of the concrete fields with
+          ``di_show=True``.
+        - ``notnull_column``: The DB column of the first field with
+          ``di_show=True``, that is neither NULL nor blank, or None.
+        - ``exclude_columns``: The DB columns of the fields with 
+          ``exclude=True``.
+        - ``fields_by_display_name``: All fields mapped to their display 
+          name, see :func:`get_display_name`.
+    """
+    fields = model._meta.get_fields()
+    show_fields = tuple(field for field in fields if getattr(field, 'di_show', False))
+    notnull_columns = [field.column for field in show_fields 
+                       if not field.null and not field.blank]
+    return FieldDescriptor(
+        show_fields=show_fields,
+        show_names=tuple(getattr(field, 'di_display_name', None) or field.name
+                         for field in show_fields),
+        show_columns=tuple(field.column for field in show_fields),
+        display_columns=tuple(getattr(field, 'di_display_name', None) or field.column
+                              for field in show_fields),
+        concrete_show_names=tuple(field.name for field in show_fields if field.concrete),
+        notnull_column=notnull_columns[0] if notnull_columns else None,
+        exclude_columns=tuple(field.column for field in fields 
+                              if getattr(field, 'exclude', False)),
+        fields_by_display_name=MappingProxyType(dict((get_display_name(field), field)
+                                                     for field in fields)),
+    )
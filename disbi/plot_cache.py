@@ -0,0 +1,81 @@
+"""
+Caches rendered plots until the data they show changes.
+
+Plots are stored in a cache of Django's cache framework. The key of a plot
+contains the versions of all tables of the app and of the experiment
+table, that are maintained by the triggers of :mod:`disbi.change_tracking`.
+Any change to the data or the experiments thus leads to new keys and
+outdated plots are never served. They are evicted
+by the cache backend, that bounds the size of the cache, e.g. with the
+``MAX_ENTRIES`` option of the local memory and the file based cache.
+"""
+# standard library
+import hashlib
+
+# Django
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+# DISBi
+from disbi.change_tracking import (get_table_versions, get_tracked_tables,
+                                   install_version_triggers)
+
+PLOT_KEY_PREFIX = 'disbi_plot'
+
+
+def get_plot_key(experiment_model, parameters):
+    """
+    Construct the cache key of a plot.
+
+    The experiment table is part of the key, as the plots are labeled
+    with the experiments.
+
+    Args:
+        experiment_model (Model): The model of the experiments, whose data
+            is plotted.
+        parameters (tuple): The parameters that determine the plot, e.g.
+            the kind of plot, the plotted columns and the requested
+            experiments. Their ``repr`` must be stable.
+
+    Returns:
+        str: The cache key.
+    """
+    app_label = experiment_model._meta.app_label
+    dbtables = (get_tracked_tables(app_label)
+                + (experiment_model._meta.concrete_model._meta.db_table,))
+    # Ensure that changes to the tables are tracked.
+    install_version_triggers(dbtables)
+    versions = sorted(get_table_versions(dbtables).items())
+    digest = hashlib.sha1(repr((parameters, versions)).encode()).hexdigest()
+    return '%s:%s:%s' % (PLOT_KEY_PREFIX, app_label, digest)
+
+def get_or_render_plot(experiment_model, parameters, render):
+    """
+    Get a plot from the cache or render and cache it.
+
+    The cache is chosen by the ``PLOT_CACHE`` setting, which defaults to
+    the default cache. If it is None, plots are not cached. The timeout
+    is taken from the ``PLOT_CACHE_TIMEOUT`` setting and defaults to the
+    timeout of the cache.
+
+    Args:
+        experiment_model (Model): The model of the experiments, whose data
+            is plotted.
+        parameters (tuple): The parameters that determine the plot, see
+            :func:`get_plot_key`.
+        render (function): Called without arguments to render the plot.
+
+    Returns:
+        The cached or rendered plot.
+    """
+    cache_alias = settings.DISBI.get('PLOT_CACHE', DEFAULT_CACHE_ALIAS)
+    if cache_alias is None:
+        return render()
+    plot_cache = caches[cache_alias]
+    key = get_plot_key(experiment_model, parameters)
+    plot = plot_cache.get(key)
+    if plot is None:
+        plot = render()
+        plot_cache.set(key, plot, settings.DISBI.get('PLOT_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+    return plot
@@ -0,0 +1,311 @@
+"""
+Renders the plots of the data view as SVG.
+
+The plots are drawn on figures of the object-oriented API of matplotlib,
+which share no global state, and can be rendered in a pool of worker
+processes with :func:`render_in_pool`, so that rendering scales across
+cores and does not tie up the threads of the web server.
+"""
+# standard library
+import math
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from io import StringIO
+
+# third-party
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import LogNorm
+from matplotlib.figure import Figure
+
+# Django
+from django.conf import settings
+
+# DISBi
+from disbi.exceptions import PlotTimeoutError
+
+# BRICS blue 1 and grey 2.
+PLOT_COLOR = '#005374'
+LINE_COLOR = '#5f5f5f'
+# Points in cells of the density grid with at most this many points are
+# drawn individually.
+OUTLIER_CELL_COUNT = 2
+# Seconds the request waits for a worker longer than the render may take.
+RESULT_GRACE_PERIOD = 1
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def new_figure():
+    """
+    Create a figure, that is independent of the global state of pyplot.
+
+    Returns:
+        matplotlib.figure.Figure: The figure, attached to an Agg canvas.
+    """
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    return fig
+
+def to_svg(fig):
+    """
+    Render a figure as SVG.
+
+    Args:
+        fig (matplotlib.figure.Figure): The figure.
+
+    Returns:
+        str: The SVG.
+    """
+    buf = StringIO()
+    fig.savefig(buf, format='svg')
+    return buf.getvalue()
+
+def _raise_timeout(signum, frame):
+    """Abort a render, that exceeded its timeout, in the worker."""
+    raise PlotTimeoutError('Rendering the plot took too long.')
+
+def _render_with_timeout(timeout, function, args):
+    """
+    Call a render function in a worker process with a timeout.
+
+    Args:
+        timeout (float): The seconds after which the render is aborted
+            with a :class:`.PlotTimeoutError`. None for no timeout.
+        function (function): The render function.
+        args (tuple): The arguments of the render function.
+
+    Returns:
+        The result of the render function.
+    """
+    # Interval timers are not available on all platforms. The request
+    # still stops waiting after the timeout then.
+    alarm = timeout is not None and hasattr(signal, 'setitimer')
+    if alarm:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return function(*args)
+    finally:
+        if alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+def _get_pool(workers):
+    """
+    Get the pool of worker processes rendering the plots.
+
+    The pool is created on first use and shared by all threads.
+
+    Args:
+        workers (int): The number of worker processes.
+
+    Returns:
+        ProcessPoolExecutor: The pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers)
+        return _pool
+
+def _discard_pool(pool):
+    """Discard a pool, whose worker processes terminated abruptly."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+def render_in_pool(function, *args):
+    """
+    Render a plot in a bounded pool of worker processes.
+
+    The number of worker processes is set with ``PLOT_RENDER_WORKERS``
+    and defaults to the number of CPUs. If it is 0, the plot is rendered
+    in the calling thread. Renders taking longer than 
+    ``PLOT_RENDER_TIMEOUT`` seconds, 30 by default, are aborted.
+
+    Args:
+        function (function): The render function. It and its arguments 
+            must be picklable, i.e. defined at module level.
+        *args: The arguments of the render function.
+
+    Returns:
+        The result of the render function.
+
+    Raises:
+        PlotTimeoutError: If rendering exceeds the timeout.
+    """
+    workers = settings.DISBI.get('PLOT_RENDER_WORKERS', os.cpu_count() or 1)
+    timeout = settings.DISBI.get('PLOT_RENDER_TIMEOUT', 30)
+    if not workers:
+        return function(*args)
+    pool = _get_pool(workers)
+    try:
+        future = pool.submit(_render_with_timeout, timeout, function, args)
+        return future.result(timeout=timeout + RESULT_GRACE_PERIOD 
+                             if timeout is not None else None)
+    except FutureTimeoutError:
+        # The render has not started yet, if all workers are busy.
+        future.cancel()
+        raise PlotTimeoutError('Rendering the plot took longer than {} seconds.'
+                               .format(timeout))
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+
+def doane_bin_count(count, sums, minimum, maximum):
+    """
+    Get the number of histogram bins with Doane's formula.
+
+    The skewness is calculated from the sums of the powers of the 
+    deviations from the mean, so that the values do not need to be 
+    available, e.g. for a histogram computed in the DB with
+    :func:`.histogram_from_db`. The result matches the ``doane`` estimator
+    of :func:`numpy.histogram`.
+
+    Args:
+        count (int): The number of values.
+        sums (tuple): The sums of the squared and of the cubed deviations
+            of the values from their mean.
+        minimum (float): The smallest value.
+        maximum (float): The largest value.
+
+    Returns:
+        int: The number of bins.
+    """
+    if count <= 2 or minimum == maximum:
+        return 1
+    variance = sums[0] / count
+    if variance <= 0:
+        return 1
+    skewness = sums[1] / count / variance**1.5
+    skewness_sd = math.sqrt(6.0 * (count - 2) / ((count + 1.0) * (count + 3)))
+    return int(math.ceil(1 + math.log2(count) + math.log2(1 + abs(skewness) / skewness_sd)))
+
+def render_histogram(counts, edges, xlabel, ylabel, title):
+    """
+    Render a histogram from precomputed bins.
+
+    Args:
+        counts (list): The number of values per bin.
+        edges (list): The edges of the bins.
+        xlabel (str): The label of the x-axis.
+        ylabel (str): The label of the y-axis.
+        title (str): The title of the plot.
+
+    Returns:
+        str: The plot as SVG.
+    """
+    fig = new_figure()
+    ax = fig.add_subplot(111)
+    # Plot the counts as weights of the bin starts to get the same bars
+    # as from binning the values.
+    ax.hist(edges[:-1], bins=edges, weights=counts, color=PLOT_COLOR)
+    # Set labels and title.
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    return to_svg(fig)
+
+def bin_points(x, y, bins=100, outlier_count=OUTLIER_CELL_COUNT):
+    """
+    Bin points on a regular two-dimensional grid.
+
+    Points in sparse cells are kept as outliers and their cells are 
+    emptied, so that they can be drawn individually on top of the density.
+
+    Args:
+        x (numpy.ndarray): The x-coordinates.
+        y (numpy.ndarray): The y-coordinates.
+
+    Keyword Args:
+        bins (int): The number of bins along each axis.
+        outlier_count (int): The maximal number of points in a cell, for
+            which the points are kept as outliers.
+
+    Returns:
+        tuple: The counts per cell indexed by the x- and y-bin, the edges
+        of the x-bins, the edges of the y-bins and a boolean mask of the 
+        outliers.
+    """
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=bins)
+    # Locate the cell of each point. The last edge belongs to the last bin.
+    x_index = np.clip(np.searchsorted(x_edges, x, side='right') - 1, 0, bins - 1)
+    y_index = np.clip(np.searchsorted(y_edges, y, side='right') - 1, 0, bins - 1)
+    outliers = counts[x_index, y_index] <= outlier_count
+    counts[counts <= outlier_count] = 0
+    return counts.astype(int), x_edges, y_edges, outliers
+
+def density_grid(x, y, bins=100):
+    """
+    Bin points for drawing them as density grid in the client.
+
+    Args:
+        x (numpy.ndarray): The x-coordinates.
+        y (numpy.ndarray): The y-coordinates.
+
+    Keyword Args:
+        bins (int): The number of bins along each axis.
+
+    Returns:
+        dict: The edges of the bins under ``xEdges`` and ``yEdges``,
+        the counts per cell indexed by the x- and y-bin under ``counts``
+        and the coordinates of the outliers under ``outliers``, see
+        :func:`bin_points`.
+    """
+    counts, x_edges, y_edges, outliers = bin_points(x, y, bins=bins)
+    return {'xEdges': x_edges.tolist(),
+            'yEdges': y_edges.tolist(),
+            'counts': counts.tolist(),
+            'outliers': np.column_stack((x[outliers], y[outliers])).tolist()}
+
+def render_compare_plot(x, y, xlabel, ylabel, max_points=None, bins=100):
+    """
+    Render a scatter plot comparing two experiments.
+
+    Above ``max_points`` points the density of the points is drawn as an
+    image instead and only the outliers are drawn as points, see
+    :func:`bin_points`. This keeps the size of the SVG bounded.
+
+    Args:
+        x (numpy.ndarray): The x-coordinates.
+        y (numpy.ndarray): The y-coordinates.
+        xlabel (str): The label of the x-axis.
+        ylabel (str): The label of the y-axis.
+
+    Keyword Args:
+        max_points (int): The maximal number of points that are drawn
+            individually. Defaults to no limit.
+        bins (int): The number of bins along each axis of the density.
+
+    Returns:
+        str: The plot as SVG.
+    """
+    fig = new_figure()
+    ax = fig.add_subplot(111)
+    if max_points is not None and len(x) > max_points:
+        counts, x_edges, y_edges, outliers = bin_points(x, y, bins=bins)
+        density = np.ma.masked_equal(counts.T, 0)
+        if density.count():
+            image = ax.imshow(density, origin='lower', aspect='auto', 
+                              interpolation='nearest', cmap='Blues', 
+                              norm=LogNorm(vmin=1, vmax=density.max()),
+                              extent=(x_edges[0], x_edges[-1], y_edges[0], y_edges[-1]))
+            fig.colorbar(image, ax=ax, label='Number of data points')
+        ax.plot(x[outliers], y[outliers], '.', color=PLOT_COLOR)
+    else:
+        ax.plot(x, y, '.', color=PLOT_COLOR)
+    # Add a grey line through the origin.
+    a = np.linspace(*ax.get_xbound())
+    b = np.linspace(*ax.get_ybound())
+    ax.plot(a, b, '--', color=LINE_COLOR)
+    # Set labels.
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    return to_svg(fig)
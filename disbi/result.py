@@ -3,40 +3,131 @@ Class for getting the joined table with data based on a list of experiments.
 """
 # standard library
 import re
+import time
+from collections import OrderedDict
+from functools import wraps
+from types import GeneratorType
 
 # third-party
+import numpy as np
 from more_itertools import unique_everseen
 
 # Django
 from django.apps import apps
 from django.conf import settings
+from django.db import ProgrammingError, models, transaction
 
 # DISBi
-from disbi.db_utils import (db_table_exists, exec_query, from_db,
-                            get_columnnames)
+from disbi.cache_table import (FOLDCHANGE_TABLE_SUFFIX, VALUES_TABLE_SUFFIX,
+                               evict_datatables, record_datatable_hit,
+                               register_datatable, update_datatable_size)
+from disbi.db_utils import (advisory_lock, convert_rows, db_table_exists,
+                            exec_query, from_db, get_columnnames,
+                            histogram_from_db, is_undefined_table,
+                            stream_from_db)
 from disbi.exceptions import NoRelatedMeasurementModel, NotFoundError
-from disbi.join import Relations
-from disbi.models import BiologicalModel, MetaModel
+from disbi.foldchange import fold_changes, masked_log2, to_array, to_list
+from disbi.measurement_resolver import resolve_measurement_models
+from disbi.models import CachedTable
+from disbi.option_utils import get_field_descriptor
+from disbi.schema import get_schema
+from disbi.table_formats import format_scientific
 from disbi.utils import get_id_str, get_unique, sort_by_other
 
 
+# How often reading a base table is attempted, if it is evicted or 
+# invalidated by a concurrent request before it is read.
+READ_ATTEMPTS = 3
+
+
+def _resume(first, generator):
+    """Yield an item taken from a generator and then the rest of it."""
+    try:
+        yield first
+        yield from generator
+    finally:
+        generator.close()
+
+def rebuild_if_dropped(method):
+    """
+    Decorate a method of :class:`DataResult` reading the base table, so 
+    that it is called again if the table is dropped by a concurrent 
+    request between ensuring its existence and reading it. The method 
+    ensures the table again, which rebuilds it.
+    
+    If the method streams the rows, the query is started before the 
+    generator is returned, so that a missing table is detected here.
+    Inside a transaction each attempt runs in a savepoint, so that the 
+    failed read does not abort the transaction.
+    
+    Args:
+        method (function): The method to decorate.
+        
+    Returns:
+        function: The decorated method.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        for attempt in range(READ_ATTEMPTS):
+            # A savepoint is only created inside a transaction.
+            savepoint = transaction.savepoint()
+            try:
+                result = method(self, *args, **kwargs)
+                if isinstance(result, GeneratorType):
+                    result = _resume(next(result), result)
+            except ProgrammingError as exc:
+                if savepoint is not None:
+                    transaction.savepoint_rollback(savepoint)
+                if not is_undefined_table(exc) or attempt == READ_ATTEMPTS - 1:
+                    raise
+            else:
+                if savepoint is not None:
+                    transaction.savepoint_commit(savepoint)
+                return result
+    return wrapper
+
+
 class DataResult():
     """Constructs the datatable based on the request from the filter view."""
     
 # ---------------------- Static class attributes ----------------------
-    # SQL function for scientifc formatting of floting point numbers and zero devision.
-    DB_FUNCTION_ZERO = 'divide_without_zeroerr'
+    # Format for the scientific formatting of floating point numbers in SQL.
     DB_PRECISION = '\'9.9999EEEE\''
+    # Strategies for selecting the experiment data in the result table.
+    STRATEGY_PIVOT = 'pivot'
+    STRATEGY_JOIN = 'join'
+    STRATEGIES = (STRATEGY_PIVOT, STRATEGY_JOIN)
+    # Layouts for storing the result table. The wide layout stores the 
+    # result table as is. The long layout stores the rows of the biological
+    # entities and the data points separately, see :meth:`create_long_table`.
+    LAYOUT_WIDE = 'wide'
+    LAYOUT_LONG = 'long'
+    LAYOUTS = (LAYOUT_WIDE, LAYOUT_LONG)
+    # Fields, whose values can be stored as floats in the long layout.
+    NUMERIC_FIELDS = (models.AutoField, models.DecimalField, models.FloatField, 
+                      models.IntegerField)
+    # Prefix of the columns of the base table, that are not part of the 
+    # result table, e.g. the columns in the long layout, that link the rows 
+    # to the data points.
+    HIDDEN_COLUMN_PREFIX = 'disbi_'
+    # Hidden column numbering the rows of the base table consecutively 
+    # from 1, that cached fold changes are aligned to.
+    ROW_ID_COLUMN = HIDDEN_COLUMN_PREFIX + 'row_id'
     
     
 
-    def __init__(self, requested_experiments, experiment_meta_model):
+    def __init__(self, requested_experiments, experiment_meta_model, follow_up=False):
         """
         Initialize a new DataResult object.
         
         Args:
             requested_experiments (iterable): The experiments that were
                 requested in the interface.
+                
+        Keyword Args:
+            follow_up (bool): The result is read for a follow-up request 
+                of a view, e.g. for the rows of the data view. Reading the
+                cached base table is not counted as a hit then.
         
         Raises:
             NoRelatedMeasurementModel: If an experiment was chooses for which 
@@ -46,15 +137,52 @@ class DataResult():
         if not False in [isinstance(exp, experiment_meta_model) for exp in requested_experiments]: 
             self.req_exps = requested_experiments 
         else:
-            self.req_exps = [experiment_meta_model.objects.get(pk=exp.pk) 
-                             for exp in requested_experiments]
-            
-        self.app_label = experiment_meta_model._meta.app_label
+            meta_exps = experiment_meta_model.objects.in_bulk(
+                [exp.pk for exp in requested_experiments])
+            self.req_exps = [meta_exps[exp.pk] for exp in requested_experiments]
+        # Resolve the data of all experiments at once.
+        resolve_measurement_models(self.req_exps)
         for exp in self.req_exps:
             if exp.measurementmodel is None:
                 raise NoRelatedMeasurementModel(exp)
+            
+        self.app_label = experiment_meta_model._meta.app_label
+        self.layout = self.choose_layout()
+        # The name of the cached table is based on the sorted ids.
+        self.table_name = '%s_%s_%s%s' % (self.app_label, 
+                                          settings.DISBI['DATATABLE_PREFIX'],
+                                          'long_' if self.layout == self.LAYOUT_LONG else '',
+                                          get_id_str(self.req_exps))
+        self.follow_up = follow_up
+        # Whether the access to the base table was already recorded.
+        self.access_recorded = False
         
 # -------------------------- Getter methods ---------------------------        
+    def choose_layout(self):
+        """
+        Choose the layout of the base table according to the 
+        ``DATATABLE_LAYOUT`` setting.
+        
+        The long layout stores the data points as floats. If a measurement
+        model of the requested experiments shows fields that are not 
+        numeric, the wide layout is used instead.
+        
+        Returns:
+            str: The layout.
+            
+        Raises:
+            ValueError: If the setting names an unknown layout.
+        """
+        layout = settings.DISBI.get('DATATABLE_LAYOUT', self.LAYOUT_WIDE)
+        if layout not in self.LAYOUTS:
+            raise ValueError('Unknown datatable layout: {}'.format(layout))
+        if layout == self.LAYOUT_LONG:
+            for exp in self.req_exps:
+                for field in get_field_descriptor(exp.measurementmodel).show_fields:
+                    if not isinstance(field, self.NUMERIC_FIELDS):
+                        return self.LAYOUT_WIDE
+        return layout
+        
     def get_display_names(self, exp):
         """
         Get the display names for the columns of a MeasurementModel of an experiment.
@@ -67,11 +195,7 @@ class DataResult():
             suffixed by the experiment id.
         """
         alias = str(exp.id)
-        column_display_names = [
-                                field.di_display_name if field.di_display_name else field.name
-                                for field in exp.measurementmodel._meta.get_fields() 
-                                if getattr(field, 'di_show', False)
-                                ]
+        column_display_names = get_field_descriptor(exp.measurementmodel).show_names
         return tuple('%s_%s' % (name, alias) for name in column_display_names)
         
     def get_colnames(self, model):
@@ -84,11 +208,7 @@ class DataResult():
         Returns:
             list: A list of strings with the DB column names.
         """
-        return [
-                    field.column  
-                    for field in model._meta.get_fields() 
-                    if getattr(field, 'di_show', False)
-                ]
+        return list(get_field_descriptor(model).show_columns)
                           
     def get_notnull_column(self, exp):
         """
@@ -105,9 +225,9 @@ class DataResult():
         Raises:
             NotFoundError
         """
-        for field in exp.measurementmodel._meta.get_fields():
-            if not field.null and not field.blank and field.di_show:
-                return field.column
+        notnull_column = get_field_descriptor(exp.measurementmodel).notnull_column
+        if notnull_column is not None:
+            return notnull_column
         raise NotFoundError('{experiment} has no column with di_show=True that is neither NULL nor blank.'
                             .format(experiment=exp))
     
@@ -122,11 +242,7 @@ class DataResult():
             list: List of strings containing the DB column names of the fields
             to be shown.
         """
-        return [
-                getattr(field, 'di_display_name', False) or field.column 
-                for field in model._meta.get_fields() 
-                if getattr(field, 'di_show', False)
-                ]
+        return list(get_field_descriptor(model).display_columns)
     
     def construct_SELECT_AS(self, exp):
         """
@@ -165,10 +281,7 @@ class DataResult():
         
         # Statement for excluding the rows where fields with the option
         # exclude=True are False.
-        exclude_fields = [field for field in exp.measurementmodel._meta.get_fields() 
-                          if getattr(field, 'exclude', False)]
-        exclude_columns = [field.column for field in exclude_fields]
-        exclude_data = ' '.join(['AND %s IS NOT FALSE' % column for column in exclude_columns])
+        exclude_data = self.get_exclude_condition(exp.measurementmodel)
         
         sql = '''
             SELECT %s, %s 
@@ -179,21 +292,112 @@ class DataResult():
                exp.measurementmodel._meta.get_field('experiment').column, exp.id, exclude_data)
         return sql          
       
-    def construct_result_table(self, biomodels):
+    def get_bio_columns(self, biomodel, schema):
+        """
+        Get the columns of a biological model and its meta models, that
+        should be shown in the result table.
+        
+        Args:
+            biomodel (models.Model): The biological model.
+            schema (SchemaGraph): The relations between the biological and
+                meta models.
+            
+        Returns:
+            list: The column names in the backbone table.
+        """
+        columns = self.get_show_columns(biomodel)
+        # Get Meta models for Bio model and the show columns to the 
+        # SELECT clause.
+        for metamodel in schema.get_related_metamodels(biomodel):
+            columns.extend(self.get_show_columns(metamodel))
+        return columns
+    
+    def get_exclude_condition(self, model):
+        """
+        Construct the condition for excluding the rows where fields with 
+        the option exclude=True are False.
+        
+        Args:
+            model (models.Model): The measurement model.
+            
+        Returns:
+            str: The partial statement, that can be appended to a WHERE clause.
+        """
+        exclude_columns = get_field_descriptor(model).exclude_columns
+        return ' '.join(['AND %s IS NOT FALSE' % column for column in exclude_columns])
+    
+    def construct_pivot_table(self, exps):
+        """
+        Construct the subquery for selecting the data points of several 
+        experiments with the same MeasurementModel in a single scan.
+        
+        The data points are grouped by the biological entity they map to 
+        and each column of each experiment is picked with a filtered 
+        aggregate, resulting in one row per entity and one column per 
+        experiment and field.
+        
+        Args:
+            exps (list): The experiments. They must share the same 
+                MeasurementModel.
+        
+        Returns:
+            str: A SQL statement for the selection of the datapoints.
+        """
+        model = exps[0].measurementmodel
+        biofield_column = exps[0].biofield.column
+        exp_column = model._meta.get_field('experiment').column
+        db_colnames = self.get_colnames(model)
+        # The array_agg picks the value of the single data point of an 
+        # experiment and works for all column types, unlike min or max. 
+        aggregates = [
+            '(array_agg(%s) FILTER (WHERE %s = %s))[1] AS %s' % (db_col, exp_column, 
+                                                                exp.id, display_col)
+            for exp in exps
+            for db_col, display_col in zip(db_colnames, self.get_display_names(exp))
+        ]
+        sql = '''
+            SELECT %s, %s
+            FROM %s
+            WHERE %s IN (%s) %s
+            GROUP BY %s
+        ''' % (', '.join(aggregates), biofield_column,
+               model._meta.db_table,
+               exp_column, ', '.join(str(exp.id) for exp in exps), 
+               self.get_exclude_condition(model),
+               biofield_column)
+        return sql
+    
+    def construct_result_table(self, biomodels, strategy=None):
         """
         Construct the SQL statement for getting the result table.
         
         For each biological model, the respective experiments will be filtered.
-        For those experiments a subquery is constructed, that is then LEFT JOINed
-        into the prejoined backbone table. Only rows that have at least one
-        data point are preserved.
+        For those experiments subqueries are constructed, that are then LEFT 
+        JOINed into the prejoined backbone table. Only rows that have at least 
+        one data point are preserved.
+        
+        With the ``pivot`` strategy, one subquery is constructed for all 
+        experiments of the same MeasurementModel, see 
+        :meth:`construct_pivot_table`. With the ``join`` strategy, one 
+        subquery is constructed for each experiment.
         
         Args:
             biomodels (list): List of Biological models.
+            
+        Keyword Args:
+            strategy (str): Either ``pivot`` or ``join``. Defaults to the 
+                ``RESULT_QUERY_STRATEGY`` setting or ``pivot``.
         
         Returns:
             str: The SQL statement for the result table.
+            
+        Raises:
+            ValueError: If the strategy is unknown.
         """
+        if strategy is None:
+            strategy = settings.DISBI.get('RESULT_QUERY_STRATEGY', self.STRATEGY_PIVOT)
+        if strategy not in self.STRATEGIES:
+            raise ValueError('Unknown query strategy: {}'.format(strategy))
         select = 'SELECT DISTINCT '
         cached_alias = 'c'
         join_exps = 'FROM %s_%s AS %s' % (self.app_label, 
@@ -207,7 +411,7 @@ class DataResult():
         '''
         subtables_not_null_column = []
         select_bios = []
-        relations = Relations(self.app_label, model_superclass=(BiologicalModel, MetaModel))
+        schema = get_schema(self.app_label)
         for biomodel in biomodels:
             # Requested experiments related to biomodel.
             req_exps_for_bio = []    
@@ -215,55 +419,193 @@ class DataResult():
                 if exp.biomodel == biomodel:
                     req_exps_for_bio.append(exp)
             
-            select_bios.extend(self.get_show_columns(biomodel))
-            
-
-            # Get Meta models for Bio model and the show columns to the 
-            # SELECT clause.
-            metamodels_of_biomodel = relations.get_related_metamodels(biomodel)
-            #print(metamodels_of_biomodel)
-            for metamodel in metamodels_of_biomodel:
-                select_bios.extend(self.get_show_columns(metamodel))
-
+            select_bios.extend(self.get_bio_columns(biomodel, schema))
                 
             for exp in req_exps_for_bio:
                 select_bios.extend(self.get_display_names(exp))
-                exp_alias = 'exp%s' % exp.pk
+                subtables_not_null_column.append((self.get_notnull_column(exp), 
+                                                  str(exp.id)))
+            
+            if strategy == self.STRATEGY_PIVOT:
+                # Group the experiments by MeasurementModel.
+                exps_by_model = OrderedDict()
+                for exp in req_exps_for_bio:
+                    exps_by_model.setdefault(exp.measurementmodel, []).append(exp)
+                subtables = [(self.construct_pivot_table(exps), 
+                              'pivot_%s' % model._meta.model_name,
+                              exps[0].biofield.column)
+                             for model, exps in exps_by_model.items()]
+            else:
+                subtables = [(self.construct_exptable(exp), 'exp%s' % exp.pk,
+                              exp.biofield.column)
+                             for exp in req_exps_for_bio]
+            for subtable, alias, biofield_column in subtables:
                 join_exps += left_join_template % (
-                    self.construct_exptable(exp),
-                    exp_alias,
+                    subtable,
+                    alias,
                     '%s.%s_id' % (cached_alias, biomodel.__name__.lower()),
-                        '%s.%s' % (exp_alias, exp.biofield.column)
+                    '%s.%s' % (alias, biofield_column)
                     )
-                subtables_not_null_column.append((self.get_notnull_column(exp), 
-                                                  str(exp.id)))
         exclude_empty = 'WHERE ' + ' OR '.join(['%s_%s IS NOT NULL' % col 
                                              for col in subtables_not_null_column])
         
         sql = '\n'.join((select + ', '.join(select_bios), join_exps, exclude_empty))
         return re.sub(r'^\s+', '', sql, flags=re.MULTILINE) 
     
-    def construct_base_table(self):
+    def construct_base_table(self, strategy=None):
         """
         Construct the SQL statement for creating the base table.
         
+        Keyword Args:
+            strategy (str): The query strategy, see 
+                :meth:`construct_result_table`.
+        
         Returns:
             str: The SQL statement for creating the base table.
         """
+        # Construct the SQL statement.
+        sql = self.construct_result_table(self.get_requested_biomodels(), 
+                                          strategy=strategy)
+        return sql
+    
+    def get_requested_biomodels(self):
+        """
+        Get the biological models the requested experiments map to.
+        
+        Returns:
+            list: The biological models in the order of the linearized 
+            relation tree.
+        """
         # Get requested biological entities.
         req_biomodels = [exp.biomodel for exp in self.req_exps]
         # Remove duplicates.
         req_biomodels = list(unique_everseen(req_biomodels))
         # Order according to the linearized models.
-        relations = Relations(self.app_label, model_superclass=(BiologicalModel, MetaModel))
-        relations.start_join()
-        linearized_biomodels = relations.linearized
-        req_biomodels = sort_by_other(req_biomodels, 
-                                     order=linearized_biomodels)
-        # Construct the SQL statement.
-        sql = self.construct_result_table(req_biomodels)
-        return sql
+        schema = get_schema(self.app_label)
+        schema.validate()
+        linearized_biomodels = schema.linearized
+        return sort_by_other(req_biomodels, order=linearized_biomodels)
+    
+    def get_hidden_column(self, biomodel):
+        """
+        Get the column of the long layout that links the rows to the data
+        points of a biological model.
+        
+        Args:
+            biomodel (models.Model): The biological model.
+            
+        Returns:
+            str: The column name.
+        """
+        return '%s%s_id' % (self.HIDDEN_COLUMN_PREFIX, biomodel.__name__.lower())
+    
+    def construct_values_table(self):
+        """
+        Construct the SQL statement for selecting the data points of all
+        requested experiments in long format.
+        
+        Each shown field of a data point becomes a row with the id of the
+        biological entity, the experiment, the display name of the field 
+        and the value. The shown fields of the measurement models are 
+        therefore numeric, see :meth:`choose_layout`.
+        
+        Returns:
+            str: The SQL statement for the values table.
+        """
+        exps_by_model = OrderedDict()
+        for exp in self.req_exps:
+            exps_by_model.setdefault(exp.measurementmodel, []).append(exp)
+        selects = []
+        for model, exps in exps_by_model.items():
+            exp_column = model._meta.get_field('experiment').column
+            display_names = [name[:-len('_%s' % exps[0].id)] 
+                             for name in self.get_display_names(exps[0])]
+            fields = ', '.join("('%s', m.%s::float8)" % (name, db_col)
+                               for name, db_col in zip(display_names, 
+                                                       self.get_colnames(model)))
+            selects.append('''
+            SELECT m.%s AS bio_id, m.%s AS experiment_id, f.field, f.value
+            FROM %s AS m
+            CROSS JOIN LATERAL (VALUES %s) AS f (field, value)
+            WHERE m.%s IN (%s) %s AND f.value IS NOT NULL
+            ''' % (exps[0].biofield.column, exp_column,
+                   model._meta.db_table,
+                   fields,
+                   exp_column, ', '.join(str(exp.id) for exp in exps),
+                   self.get_exclude_condition(model).replace('AND ', 'AND m.')))
+        return '\nUNION ALL\n'.join(selects)
+    
+    def construct_rows_table(self, values_table):
+        """
+        Construct the SQL statement for selecting the rows of the long 
+        layout. 
+        
+        Each row holds the shown columns of the biological and meta models
+        and the ids linking it to its data points. Only rows with at least 
+        one data point are selected.
+        
+        Args:
+            values_table (str): The name of the table with the data points.
+            
+        Returns:
+            str: The SQL statement for the rows table.
+        """
+        cached_alias = 'c'
+        schema = get_schema(self.app_label)
+        select_bios = []
+        has_data = []
+        for biomodel in self.get_requested_biomodels():
+            select_bios.extend(self.get_bio_columns(biomodel, schema))
+            id_column = '%s.%s_id' % (cached_alias, biomodel.__name__.lower())
+            select_bios.append('%s AS %s' % (id_column, self.get_hidden_column(biomodel)))
+            exp_ids = [str(exp.id) for exp in self.req_exps if exp.biomodel == biomodel]
+            has_data.append('''EXISTS (
+                SELECT 1 FROM %s AS v 
+                WHERE v.experiment_id IN (%s) AND v.bio_id = %s
+            )''' % (values_table, ', '.join(exp_ids), id_column))
+        sql = '''
+        SELECT DISTINCT %s
+        FROM %s_%s AS %s
+        WHERE %s
+        ''' % (', '.join(select_bios), 
+               self.app_label, settings.DISBI['JOINED_TABLENAME'], cached_alias,
+               ' OR '.join(has_data))
+        return re.sub(r'^\s+', '', sql, flags=re.MULTILINE)
+            
+    def get_dependencies(self):
+        """
+        Get the DB tables the base table is constructed from.
+        
+        These are the tables of the requested biological models, their 
+        meta models and all models connecting them in the relation tree, 
+        as well as the tables of the measurement models.
+        
+        Returns:
+            list: The names of the DB tables.
+        """
+        schema = get_schema(self.app_label)
+        req_models = list(unique_everseen(exp.biomodel for exp in self.req_exps))
+        for biomodel in list(req_models):
+            req_models.extend(schema.get_related_metamodels(biomodel))
+        connecting_models = schema.get_connecting_models(req_models)
+        dependencies = {model._meta.db_table for model in connecting_models}
+        dependencies |= schema.get_intermediary_tables(connecting_models)
+        dependencies |= {exp.measurementmodel._meta.db_table for exp in self.req_exps}
+        return sorted(dependencies)
+        
+    def number_rows(self, sql):
+        """
+        Add the hidden row id column to a SELECT statement.
+        
+        Args:
+            sql (str): The SELECT statement.
             
+        Returns:
+            str: The SELECT statement numbering the selected rows.
+        """
+        return 'SELECT row_number() OVER () AS %s, numbered.* FROM (%s) AS numbered' % (
+            self.ROW_ID_COLUMN, sql)
+        
     def create_base_table(self, table_name):
         """
         Create the base table and write it to the DB.
@@ -275,30 +617,207 @@ class DataResult():
             None: This is a procedure.
         """
         print('new')
-        # Create table at first.
-        select_stm = self.construct_base_table()
-        exec_query('DROP TABLE IF EXISTS %s;' % table_name) 
-        sql = """
-        CREATE TABLE %s AS
-        %s
-        """ % (table_name, select_stm)
-        exec_query(sql) 
+        start = time.time()
+        if self.layout == self.LAYOUT_LONG:
+            row_count = self.create_long_table(table_name)
+        else:
+            # Create table at first.
+            select_stm = self.construct_base_table()
+            exec_query('DROP TABLE IF EXISTS %s;' % table_name) 
+            sql = """
+            CREATE TABLE %s AS
+            %s
+            """ % (table_name, self.number_rows(select_stm))
+            row_count = exec_query(sql) 
+        build_time = time.time() - start
+        register_datatable(table_name, self.app_label, 
+                           [exp.id for exp in self.req_exps],
+                           self.get_dependencies(),
+                           row_count=row_count, build_time=build_time)
+        # Make room for the new table in the cache.
+        if settings.DISBI.get('CACHE_EVICT_ON_BUILD', True):
+            evict_datatables(keep=[table_name])
+            
+    def create_long_table(self, table_name):
+        """
+        Create the base table in the long layout.
+        
+        The data points are stored in a values table with one row per 
+        biological entity, experiment and field, so that the number of 
+        experiments is not limited by the maximum number of columns. The 
+        base table itself only holds the rows of the biological entities.
+        The result table is pivoted from both on read, see :meth:`_source`.
+        
+        Args:
+            table_name (str): The name under which the table should be created.
+            
+        Returns:
+            int: The number of rows in the base table.
+        """
+        values_table = table_name + VALUES_TABLE_SUFFIX
+        exec_query('DROP TABLE IF EXISTS %s, %s;' % (table_name, values_table))
+        exec_query('CREATE TABLE %s AS %s' % (values_table, self.construct_values_table()))
+        exec_query('CREATE INDEX ON %s (experiment_id, bio_id);' % values_table)
+        exec_query('ANALYZE %s;' % values_table)
+        # The base table is created last, as its existence marks the 
+        # layout as complete.
+        row_count = exec_query('CREATE TABLE %s AS %s' 
+                               % (table_name, 
+                                  self.number_rows(self.construct_rows_table(values_table))))
+        for biomodel in self.get_requested_biomodels():
+            exec_query('CREATE INDEX ON %s (%s);' 
+                       % (table_name, self.get_hidden_column(biomodel)))
+        return row_count
+    
+    def _source(self, exps=None, row_ids=False):
+        """
+        Get the relation the result table can be selected from.
+        
+        For the wide layout, this is the base table. For the long layout, 
+        the data points of the requested experiments are pivoted into 
+        the rows.
+        
+        Keyword Args:
+            exps (iterable): The experiments whose columns are needed. 
+                Defaults to all requested experiments. Only the long layout
+                omits the columns of the other experiments.
+            row_ids (bool): Make the hidden row id column selectable. It
+                is not part of the returned column names.
+                
+        Returns:
+            tuple: The FROM clause and a list of the column names of the 
+            relation in the order of the result table.
+        """
+        if self.layout != self.LAYOUT_LONG:
+            return self.table_name, [column_name for column_name 
+                                     in get_columnnames(self.table_name)
+                                     if not column_name.startswith(self.HIDDEN_COLUMN_PREFIX)]
+        exp_ids = {exp.id for exp in (self.req_exps if exps is None else exps)}
+        rows_alias = 'r'
+        schema = get_schema(self.app_label)
+        column_names = []
+        select = ['%s.%s' % (rows_alias, self.ROW_ID_COLUMN)] if row_ids else []
+        joins = ''
+        for biomodel in self.get_requested_biomodels():
+            bio_columns = self.get_bio_columns(biomodel, schema)
+            column_names.extend(bio_columns)
+            select.extend('%s.%s' % (rows_alias, column) for column in bio_columns)
+            exps_for_bio = [exp for exp in self.req_exps 
+                            if exp.biomodel == biomodel and exp.id in exp_ids]
+            if not exps_for_bio:
+                continue
+            aggregates = []
+            for exp in exps_for_bio:
+                for display_name in self.get_display_names(exp):
+                    field = display_name[:-len('_%s' % exp.id)]
+                    aggregates.append("(array_agg(value) FILTER (WHERE experiment_id = %s "
+                                      "AND field = '%s'))[1] AS %s" 
+                                      % (exp.id, field, display_name))
+                    column_names.append(display_name)
+                    select.append(display_name)
+            pivot_alias = 'pivot_%s' % biomodel.__name__.lower()
+            joins += '''
+            LEFT JOIN (
+                SELECT bio_id, %s
+                FROM %s%s
+                WHERE experiment_id IN (%s)
+                GROUP BY bio_id
+            ) AS %s
+            ON (%s.%s = %s.bio_id)
+            ''' % (', '.join(aggregates), 
+                   self.table_name, VALUES_TABLE_SUFFIX,
+                   ', '.join(str(exp.id) for exp in exps_for_bio),
+                   pivot_alias,
+                   rows_alias, self.get_hidden_column(biomodel), pivot_alias)
+        sql = '(SELECT %s FROM %s AS %s %s) AS %s' % (', '.join(select), self.table_name,
+                                                      rows_alias, joins, 
+                                                      self.table_name)
+        return sql, column_names
+    
+    def ensure_base_table(self):
+        """
+        Create the base table, unless it already exists.
+        
+        Concurrent requests for the same experiments are serialized with an
+        advisory lock on the table name. Thus only the first request 
+        creates the table, while the others wait for it and reuse it. 
+        Tables cached by earlier versions without row ids are rebuilt.
+        
+        A build or a hit is recorded at most once per result, however 
+        often the table is read.
             
-    def get_or_create_base_table(self, fetch_as='ordereddict'):
+        Returns:
+            None: This is a procedure.
+        """
+        if self.has_row_ids():
+            self.record_hit()
+            return
+        with advisory_lock(self.table_name):
+            # The table might have been created while waiting for the lock.
+            if self.has_row_ids():
+                self.record_hit()
+            else:
+                self.create_base_table(self.table_name)
+                self.access_recorded = True
+    
+    def record_hit(self):
+        """
+        Record that the base table was read from the cache, unless the 
+        access was already recorded. 
+        
+        For follow-up requests only the time of the last access is 
+        updated.
+            
+        Returns:
+            None: This is a procedure.
+        """
+        if not self.access_recorded:
+            record_datatable_hit(self.table_name, hit=not self.follow_up)
+            self.access_recorded = True
+    
+    @rebuild_if_dropped
+    def ensure_built(self):
+        """
+        Make sure the base table exists and describe it without fetching
+        any rows.
+        
+        Returns:
+            dict: The name of the base table, its number of rows and the
+            names of the columns of the result table.
+        """
+        self.ensure_base_table()
+        _, column_names = self._source()
+        registered = (CachedTable.objects
+                      .filter(table_name=self.table_name, builds__gt=0)
+                      .values_list('row_count', flat=True))
+        if registered:
+            row_count = registered[0]
+        else:
+            # The table was built before row counts were registered.
+            row_count = from_db('SELECT count(*) FROM %s' % self.table_name,
+                                fetch_as='tuple')[0][0]
+        return {'table_name': self.table_name,
+                'row_count': row_count,
+                'columns': column_names}
+    
+    @rebuild_if_dropped
+    def get_or_create_base_table(self, fetch_as='ordereddict', stream=False, formatted=True):
         """
         Retrieve the base table from the DB. Create it if it does not exist.
         
+        Keyword Args:
+            fetch_as (str): The data type as which the rows are fetched, 
+                see :func:`.from_db`.
+            stream (bool): Fetch the rows lazily in batches, see 
+                :func:`.stream_from_db`. ``fetch_as`` is ignored then.
+            formatted (bool): Format the numerical data in the DB, see 
+                :meth:`format_data_column`.
+        
         Returns:
             The values fetched from the DB.
         """
-        # Make a sorted list of all ids.
-        exp_id_str = get_id_str(self.req_exps)
-        table_name = '%s_%s_%s' % (self.app_label, 
-                                    settings.DISBI['DATATABLE_PREFIX'], 
-                                    exp_id_str)
-        if not db_table_exists(table_name):
-            self.create_base_table(table_name)
-        column_names = list(get_columnnames(table_name))
+        self.ensure_base_table()
+        table_name, column_names = self._source()
         # Escape all column names.
         column_names = ['%s' % column_name for column_name in column_names]
         # Format all columns with scientific notation that end with underscore and a number.
@@ -307,14 +826,33 @@ class DataResult():
         datacol_pattern = re.compile(r'_\d+$')
         for i, column_name in enumerate(column_names):
             if datacol_pattern.search(column_name) is not None:
-                column_names[i] = '{} as {}'.format(self.wrap_in_func('to_char', 
-                                                                  column_name, 
-                                                                  self.DB_PRECISION),
-                                                column_name)
+                column_names[i] = '{} as {}'.format(self.format_data_column(column_name,
+                                                                            formatted),
+                                                    column_name)
         sql = 'SELECT %s FROM %s' % (', '.join(column_names), table_name)
-        #return from_db(sql)
+        if stream:
+            return stream_from_db(sql)
         return from_db(sql, fetch_as=fetch_as)
     
+    def format_data_column(self, column, formatted=True):
+        """
+        Get the SQL expression for a numerical column as it is fetched.
+        
+        Args:
+            column (str): The SQL expression of the column.
+            
+        Keyword Args:
+            formatted (bool): Format the values as text in scientific 
+                notation. Otherwise the values are fetched as floats and 
+                formatting is left to the client.
+                
+        Returns:
+            str: The SQL expression.
+        """
+        if formatted:
+            return self.wrap_in_func('to_char', column, self.DB_PRECISION)
+        return '(%s)::float8' % column
+    
     def wrap_in_func(self, func, *cols):
         """
         Pass column names as arguments to DB function.
@@ -322,126 +860,494 @@ class DataResult():
         return '{func}({args})'.format(func=func,
                                        args=', '.join(cols))
     
-    def add_foldchange(self, exps_for_fc, fetch_as='ordereddict'):
+    def get_foldchange_columns(self, exps_for_fc):
         """
-        Add the fold change to a base table.
+        Get the columns from which the fold changes are calculated.
+        
+        Each fold change is calculated from the first column of the 
+        dividend and the divisor.
+        
+        Args:
+            exps_for_fc (iterable of dict): Dicts with the experiments for
+                the fold changes under the keys ``dividend`` and ``divisor``.
+                
+        Returns:
+            list: Tuples with the name of the fold change column and the 
+            names of the dividend and divisor columns.
+        """
+        req_exps = {exp.id: exp for exp in self.req_exps}
+        fc_columns = []
+        for pair in get_unique(exps_for_fc):
+            dividend = req_exps[pair['dividend'].id]
+            divisor = req_exps[pair['divisor'].id]
+            fc_columns.append(('fc_%s_%s' % (dividend.id, divisor.id),
+                               self.get_display_names(dividend)[0],
+                               self.get_display_names(divisor)[0]))
+        return fc_columns
+    
+    def has_row_ids(self):
+        """
+        Check whether the base table exists and has the hidden row id 
+        column. 
+        
+        Tables cached by earlier versions lack it.
+        
+        Returns:
+            bool: True if the rows are numbered, else False.
+        """
+        query = """
+        SELECT EXISTS (
+            SELECT 1 FROM pg_attribute
+            WHERE attrelid = to_regclass(%s) AND attname = %s AND NOT attisdropped
+        );
+        """
+        return from_db(query, [self.table_name, self.ROW_ID_COLUMN], 
+                       fetch_as='tuple')[0][0]
+    
+    def cache_foldchanges(self, exps_for_fc, fetch=False):
+        """
+        Store the fold changes for pairs of experiments in the fold change
+        table of the base table.
+        
+        The fold changes, that are not cached yet, are calculated from a 
+        single read of the needed columns. The cached fold changes are 
+        keyed by the OID of the base table, so that fold changes of a 
+        dropped and rebuilt base table are never read. The fold change 
+        table is dropped along with the base table, see 
+        :func:`.drop_datatable`.
+        
+        Args:
+            exps_for_fc (iterable of dict): Experiments for fold change
+                columns, see :meth:`get_foldchange_columns`.
+                
+        Keyword Args:
+            fetch (bool): Read the fold changes, that are already cached.
+                
+        Returns:
+            tuple: The OID of the base table and a dict with the pairs of
+            the ids of the dividend and the divisor mapped to the fold 
+            changes that were calculated or read. In each, the value for 
+            the row with id ``i`` is at index ``i - 1``. Missing values 
+            are NaN.
         """
-        exp_id_str = get_id_str(self.req_exps)
-        table_name = '%s_datatable_%s' % (self.app_label, exp_id_str)
-        # Make experiment for fold change unique.
         exps_for_fc = get_unique(exps_for_fc)
-        if not db_table_exists(table_name):
-            self.create_base_table(table_name)
-        column_names = list(get_columnnames(table_name))
-        # Inititialize lists.
-        dividend = [None] * len(exps_for_fc)
-        divisor = [None] * len(exps_for_fc)
-        fc_col_position = [None] * len(exps_for_fc)
-        # Format all columns with scientific notation that end with underscore and a number.
-        datacol_pattern = re.compile(r'_\d+$')
-        for i, column_name in enumerate(column_names):
-            if datacol_pattern.search(column_name) is not None:
-                column_names[i] = '{} AS {}'.format(self.wrap_in_func('to_char',
-                                                                      column_name, 
-                                                                      self.DB_PRECISION),
-                                                    column_name)
-                for j, pair in enumerate(exps_for_fc):
-                    pattern = r'_{}$'.format(str(pair['dividend'].id))
-                    if re.search(pattern, column_name):
-                        if not dividend[j]: 
-                            dividend[j] = (column_name, pair['dividend'].id,)
-                            # For the j-th column there will be j columns inserted before that.
-                            fc_col_position[j] = i + j
-                    elif (str(pair['divisor'].id) in column_name and 
-                          not divisor[j]):
-                        divisor[j] = (column_name, pair['divisor'].id)
-        
-        # Insert the columns for calculating the fold change.
-        for i in range(len(dividend)): 
-            fc_col = '{quotient} AS {quotient_name}'.format(
-                quotient=self.wrap_in_func(
-                            'to_char', 
-                            self.wrap_in_func(
-                                self.DB_FUNCTION_ZERO, 
-                                dividend[i][0], divisor[i][0]
-                            ),
-                            self.DB_PRECISION
-                ),
-                quotient_name='"fc_%s_%s"' % (dividend[i][1], divisor[i][1]),
-            )
-            
-            column_names.insert(fc_col_position[i], fc_col)
-        sql = "SELECT %s FROM %s" % (', '.join(column_names), table_name)
-        return from_db(sql, fetch_as=fetch_as)
+        fc_table = self.table_name + FOLDCHANGE_TABLE_SUFFIX
+        pairs = [(pair['dividend'].id, pair['divisor'].id) for pair in exps_for_fc]
+        table_oid = from_db('SELECT to_regclass(%s)::oid', [self.table_name],
+                            fetch_as='tuple')[0][0]
+        vectors = {}
+        cached = set()
+        if db_table_exists(fc_table):
+            select_query = """
+            SELECT dividend_id, divisor_id%s
+            FROM %s
+            WHERE table_oid = %%s AND (dividend_id, divisor_id) IN %%s;
+            """ % (', fold_changes' if fetch else '', fc_table)
+            for row in from_db(select_query, [table_oid, tuple(pairs)], fetch_as='tuple'):
+                cached.add(row[:2])
+                if fetch:
+                    vectors[row[:2]] = to_array(row[2])
+        missing = [(pair, fc_column) 
+                   for pair, fc_column in zip(pairs, self.get_foldchange_columns(exps_for_fc))
+                   if pair not in cached]
+        if missing:
+            column_names = list(unique_everseen(
+                column_name for _, (_, dividend, divisor) in missing 
+                for column_name in (dividend, divisor)))
+            positions = {column_name: k for k, column_name in enumerate(column_names)}
+            table_name, _ = self._source(
+                [pair[role] for pair in exps_for_fc for role in ('dividend', 'divisor')],
+                row_ids=True)
+            sql = 'SELECT %s, %s FROM %s' % (
+                self.ROW_ID_COLUMN,
+                ', '.join(self.format_data_column(column_name, False) 
+                          for column_name in column_names),
+                table_name)
+            data = to_array(from_db(sql, fetch_as='tuple')).reshape(-1, len(column_names) + 1)
+            row_indexes = data[:, 0].astype(int) - 1
+            quotients = fold_changes(data[:, 1:], 
+                                     [(positions[dividend], positions[divisor]) 
+                                      for _, (_, dividend, divisor) in missing])
+            insert_query = """
+            INSERT INTO %s (table_oid, dividend_id, divisor_id, fold_changes)
+            VALUES (%%s, %%s, %%s, %%s)
+            ON CONFLICT DO NOTHING;
+            """ % fc_table
+            with advisory_lock(fc_table):
+                exec_query("""
+                CREATE TABLE IF NOT EXISTS %s (
+                    table_oid oid,
+                    dividend_id integer,
+                    divisor_id integer,
+                    fold_changes float8[],
+                    PRIMARY KEY (table_oid, dividend_id, divisor_id)
+                );
+                """ % fc_table)
+                for k, (pair, _) in enumerate(missing):
+                    vector = np.full(len(row_indexes), np.nan)
+                    vector[row_indexes] = quotients[:, k]
+                    exec_query(insert_query, [table_oid, pair[0], pair[1], to_list(vector)])
+                    vectors[pair] = vector
+            update_datatable_size(self.table_name)
+        return table_oid, vectors
+    
+    def get_foldchange_vectors(self, exps_for_fc):
+        """
+        Get the fold changes for pairs of experiments from the fold change
+        table of the base table, see :meth:`cache_foldchanges`.
         
-    def get_foldchange(self, exps_for_fc):
+        Args:
+            exps_for_fc (iterable of dict): Experiments for fold change
+                columns, see :meth:`get_foldchange_columns`.
+                
+        Returns:
+            list: One float array per fold change, in which the value for 
+            the row with id ``i`` is at index ``i - 1``. Missing values
+            are NaN.
         """
-        Get only the fold change column.
+        exps_for_fc = get_unique(exps_for_fc)
+        _, vectors = self.cache_foldchanges(exps_for_fc, fetch=True)
+        return [vectors[(pair['dividend'].id, pair['divisor'].id)] for pair in exps_for_fc]
+    
+    def join_foldchanges(self, exps_for_fc):
+        """
+        Construct the joins, that add the cached fold changes to the rows
+        of the result table in the DB.
+        
+        Each fold change is joined as a relation named like its column, 
+        whose column ``fold_change`` holds the values.
+        
+        Args:
+            exps_for_fc (iterable of dict): Experiments for fold change
+                columns, see :meth:`get_foldchange_columns`.
+                
+        Returns:
+            str: The joins, that are appended to the FROM clause of 
+            :meth:`_source` with row ids.
         """
-        exp_id_str = get_id_str(self.req_exps)
-        table_name = '%s_datatable_%s' % (self.app_label, exp_id_str)
-        # Make experiment for fold change unique.
         exps_for_fc = get_unique(exps_for_fc)
-        if not db_table_exists(table_name):
-            self.create_base_table(table_name)
-        column_names = list(get_columnnames(table_name))
-        # Inititialize lists.
-        dividend = [None] * len(exps_for_fc)
-        divisor = [None] * len(exps_for_fc)
-        fc_col_position = [None] * len(exps_for_fc)
-        # Format all columns with scientific notation that end with underscore and a number.
+        if not exps_for_fc:
+            return ''
+        table_oid, _ = self.cache_foldchanges(exps_for_fc)
+        joins = ''
+        for pair, (fc_name, _, _) in zip(exps_for_fc, self.get_foldchange_columns(exps_for_fc)):
+            joins += '''
+            LEFT JOIN (
+                SELECT fold_change, row_id
+                FROM %s, unnest(fold_changes) WITH ORDINALITY AS u (fold_change, row_id)
+                WHERE table_oid = %s AND dividend_id = %s AND divisor_id = %s
+            ) AS %s
+            ON (%s.row_id = %s.%s)
+            ''' % (self.table_name + FOLDCHANGE_TABLE_SUFFIX, 
+                   table_oid, pair['dividend'].id, pair['divisor'].id,
+                   fc_name, 
+                   fc_name, self.table_name, self.ROW_ID_COLUMN)
+        return joins
+    
+    def construct_foldchange_query(self, exps_for_fc, formatted=True):
+        """
+        Construct the query for the result table and a function, that adds 
+        the fold change columns to the fetched rows.
+        
+        The numerical data is fetched unformatted, so that it can be 
+        converted with NumPy. The fold changes are taken from the fold 
+        change table, see :meth:`get_foldchange_vectors`. Each fold change
+        column is inserted before the columns of its dividend.
+        
+        Args:
+            exps_for_fc (iterable of dict): Experiments for fold change
+                columns, see :meth:`get_foldchange_columns`.
+                
+        Keyword Args:
+            formatted (bool): Format the numerical data like 
+                :meth:`format_data_column` does.
+                
+        Returns:
+            tuple: The SQL query, the names of the columns after adding the 
+            fold changes, whether each of them holds numerical data and the
+            function converting a list of fetched rows.
+        """
+        self.ensure_base_table()
+        fc_columns = self.get_foldchange_columns(exps_for_fc)
+        vectors = self.get_foldchange_vectors(exps_for_fc) if fc_columns else None
+        table_name, column_names = self._source(row_ids=vectors is not None)
         datacol_pattern = re.compile(r'_\d+$')
+        data_indexes = [i for i, column_name in enumerate(column_names) 
+                        if datacol_pattern.search(column_name) is not None]
+        data_positions = {column_names[i]: k for k, i in enumerate(data_indexes)}
+        fc_before = {}
+        for j, (_, dividend, _) in enumerate(fc_columns):
+            fc_before.setdefault(dividend, []).append(j)
+        # Each output column is taken from the fetched rows, the data array
+        # or the fold change array.
+        layout = []
         for i, column_name in enumerate(column_names):
-            if datacol_pattern.search(column_name) is not None:
-                for j, pair in enumerate(exps_for_fc):
-                    pattern = r'_{}$'.format(str(pair['dividend'].id))
-                    if re.search(pattern, column_name):
-                        if not dividend[j]: 
-                            dividend[j] = (column_name, pair['dividend'].id,)
-                            # For the jth column there will be j columns inserted before that.
-                            fc_col_position[j] = i + j
-                    elif (str(pair['divisor'].id) in column_name and 
-                          not divisor[j]):
-                        divisor[j] = (column_name, pair['divisor'].id)
-        
-        # Insert the columns for calculating the fold change.
-        for i in range(len(dividend)): 
-            fc_col = '{quotient} AS {quotient_name}'.format(
-                quotient=self.wrap_in_func(self.DB_FUNCTION_ZERO, dividend[i][0], divisor[i][0]),
-                quotient_name='"fc_%s/%s"' % (dividend[i][1], divisor[i][1]),
-            )
-            column_names.insert(fc_col_position[i], fc_col)
-    
-        sql = "SELECT %s FROM %s" % (fc_col, table_name)
-        return from_db(sql, fetch_as='tuple')
+            layout.extend((fc_columns[j][0], 'fc', j) for j in fc_before.get(column_name, ()))
+            if column_name in data_positions:
+                layout.append((column_name, 'data', data_positions[column_name]))
+            else:
+                layout.append((column_name, 'row', i))
+        
+        def convert(rows):
+            if not rows:
+                return []
+            arrays = {'data': to_array([[row[i] for i in data_indexes] for row in rows])}
+            if vectors is not None:
+                # The row id is selected last.
+                row_indexes = np.array([row[-1] for row in rows]) - 1
+                arrays['fc'] = np.column_stack([vector[row_indexes] for vector in vectors])
+            columns = []
+            for _, source, index in layout:
+                if source == 'row':
+                    columns.append([row[index] for row in rows])
+                elif formatted:
+                    columns.append(format_scientific(arrays[source][:, index]))
+                else:
+                    columns.append(to_list(arrays[source][:, index]))
+            return list(zip(*columns))
+        
+        select = ['%s AS %s' % (self.format_data_column(column_name, False), column_name)
+                  if column_name in data_positions else column_name
+                  for column_name in column_names]
+        if vectors is not None:
+            select.append(self.ROW_ID_COLUMN)
+        sql = 'SELECT %s FROM %s' % (', '.join(select), table_name)
+        return (sql, [name for name, _, _ in layout], 
+                [source != 'row' for _, source, _ in layout], convert)
+    
+    @rebuild_if_dropped
+    def add_foldchange(self, exps_for_fc, fetch_as='ordereddict', stream=False, 
+                       formatted=True):
+        """
+        Add the fold change to a base table.
+        
+        The table is read once and all fold changes are calculated with 
+        NumPy, see :meth:`construct_foldchange_query`.
+        
+        Keyword Args:
+            fetch_as (str): The data type as which the rows are fetched.
+            stream (bool): Fetch the rows lazily in batches.
+            formatted (bool): Format the numerical data.
+        """
+        sql, column_names, _, convert = self.construct_foldchange_query(exps_for_fc, 
+                                                                        formatted)
+        if stream:
+            return self._convert_batches(stream_from_db(sql), column_names, convert)
+        return convert_rows(column_names, convert(from_db(sql, fetch_as='tuple')), fetch_as)
+    
+    @staticmethod
+    def _convert_batches(batches, column_names, convert):
+        """
+        Convert the batches of rows from :func:`.stream_from_db`.
+        
+        Args:
+            batches (generator): The column names followed by the batches.
+            column_names (list of str): The column names after conversion.
+            convert (function): The function converting a batch.
+            
+        Yields:
+            The converted column names followed by the converted batches.
+        """
+        try:
+            next(batches)
+            yield column_names
+            for batch in batches:
+                yield convert(batch)
+        finally:
+            batches.close()
+        
+    @rebuild_if_dropped
+    def get_foldchange(self, exps_for_fc, log2=False):
+        """
+        Get only the fold change columns.
+        
+        The fold changes are read from the fold change table, see 
+        :meth:`get_foldchange_vectors`.
+        
+        Args:
+            exps_for_fc (iterable of dict): Experiments for fold change
+                columns, see :meth:`get_foldchange_columns`.
+                
+        Keyword Args:
+            log2 (bool): Get the binary logarithm of the fold changes.
+            
+        Returns:
+            numpy.ndarray: A two-dimensional array with one column per fold
+            change, in which missing values are NaN.
+        """
+        self.ensure_base_table()
+        quotients = np.column_stack(self.get_foldchange_vectors(exps_for_fc))
+        return masked_log2(quotients) if log2 else quotients
     
+    @rebuild_if_dropped
+    def get_foldchange_histogram(self, exps_for_fc, bin_count=None):
+        """
+        Compute the histogram of the log2 fold change between two
+        experiments in the DB.
+
+        The fold changes are read from the fold change table, so that 
+        repeated requests do not calculate them again, see 
+        :meth:`cache_foldchanges`. Fold changes that are missing or not 
+        positive are left out.
+
+        Args:
+            exps_for_fc (dict): The experiments for the fold change under
+                the keys ``dividend`` and ``divisor``.
+
+        Keyword Args:
+            bin_count (function): Determines the number of bins, see
+                :func:`.histogram_from_db`.
+
+        Returns:
+            tuple: The counts per bin and the edges of the bins.
+        """
+        self.ensure_base_table()
+        table_oid, _ = self.cache_foldchanges((exps_for_fc,))
+        from_clause = '%s, unnest(fold_changes) AS u (fold_change)' % (
+            self.table_name + FOLDCHANGE_TABLE_SUFFIX)
+        condition = ('table_oid = %s AND dividend_id = %s AND divisor_id = %s '
+                     'AND fold_change > 0')
+        return histogram_from_db('ln(fold_change) / ln(2)', from_clause, 
+                                 condition=condition,
+                                 parameters=[table_oid, exps_for_fc['dividend'].id, 
+                                             exps_for_fc['divisor'].id],
+                                 bin_count=bin_count)
+
+    @rebuild_if_dropped
     def get_exp_columns(self, wanted_exps):
         """
         Get column of respective experiment.
         """
-        # Get the dict.
-        exp_id_str = get_id_str(self.req_exps)
-        table_name = '%s_datatable_%s' % (self.app_label, exp_id_str)
-        # Make experiment unique.
-        if not db_table_exists(table_name):
-            self.create_base_table(table_name)
-        column_names = list(get_columnnames(table_name))
-        divisor_col = None
-        dividend_col = None
-        #exp_cols = []
-        #potential_columns = []
-        # Iterate over all column names, and make a list of those that hold data.
+        self.ensure_base_table()
+        table_name, _ = self._source((wanted_exps['dividend'], wanted_exps['divisor']))
+        _, dividend_col, divisor_col = self.get_foldchange_columns((wanted_exps,))[0]
+        sql = "SELECT %s, %s FROM %s;" % (dividend_col, divisor_col, table_name)
+        return from_db(sql, fetch_as='tuple')
+    
+    def get_result_columns(self, exps_for_fc=()):
+        """
+        Get the columns of the result table with optional fold change 
+        columns.
+        
+        Each fold change column is inserted before the columns of its 
+        dividend. The fold changes are joined from the fold change table, 
+        see :meth:`join_foldchanges`, so that they equal the fold changes
+        calculated with NumPy.
+        
+        Keyword Args:
+            exps_for_fc (iterable of dict): Dicts with the experiments for
+                the fold changes under the keys ``dividend`` and ``divisor``.
+                
+        Returns:
+            tuple: The FROM clause and a list of tuples with the name of 
+            each column, the SQL expression for its raw value and whether
+            it holds numerical data.
+        """
+        self.ensure_base_table()
+        table_name, column_names = self._source(row_ids=True)
+        fc_columns = {}
+        for fc_name, dividend, _ in self.get_foldchange_columns(exps_for_fc):
+            fc_columns.setdefault(dividend, []).append((fc_name, 
+                                                        '%s.fold_change' % fc_name, True))
         datacol_pattern = re.compile(r'_\d+$')
-        dividend_pattern = r'_{}$'.format(str(wanted_exps['dividend'].id))
-        divisor_pattern = r'_{}$'.format(str(wanted_exps['divisor'].id))
+        columns = []
         for column_name in column_names:
-            if datacol_pattern.search(column_name) is not None:
-                if divisor_col is None:
-                    if re.search(divisor_pattern, column_name):
-                        divisor_col = column_name
-                if dividend_col is None:
-                    if re.search(dividend_pattern, column_name):
-                        dividend_col = column_name
+            columns.extend(fc_columns.get(column_name, []))
+            columns.append((column_name, '%s.%s' % (self.table_name, column_name), 
+                            datacol_pattern.search(column_name) is not None))
+        return table_name + self.join_foldchanges(exps_for_fc), columns
+
+    @rebuild_if_dropped
+    def get_raw_table(self, exps_for_fc=()):
+        """
+        Get the result table with the unformatted numerical values.
+
+        Keyword Args:
+            exps_for_fc (iterable of dict): Experiments for fold change
+                columns, see :meth:`get_foldchange_columns`.
+
+        Returns:
+            tuple: The column names, whether each column holds numerical
+            data and the rows.
+        """
+        sql, column_names, numeric, convert = self.construct_foldchange_query(
+            exps_for_fc, formatted=False)
+        return column_names, numeric, convert(from_db(sql, fetch_as='tuple'))
+
+    @rebuild_if_dropped
+    def get_page(self, start, length, order=(), search='', column_search=None,
+                 exps_for_fc=(), formatted=True):
+        """
+        Get a page of the result table, that is filtered and sorted in the DB.
         
-        sql = "SELECT %s, %s FROM %s;" % (dividend_col, divisor_col, table_name)
-        return from_db(sql, fetch_as='tuple')
+        Numerical columns are searched in the same scientific notation in 
+        which they are displayed, but sorted by their values. Rows that 
+        are equal in the sorted columns are sorted by their row id, so 
+        that the pages neither overlap nor leave out rows. Column indexes
+        that do not refer to a column are ignored.
+        
+        Args:
+            start (int): The offset of the first row.
+            length (int): The maximum number of rows.
+            
+        Keyword Args:
+            order (iterable): Tuples with the index of a column and the 
+                direction, either ``ASC`` or ``DESC``.
+            search (str): Only keep rows where any column contains the value.
+            column_search (dict): The indexes of columns mapped to a value,
+                that they must contain.
+            exps_for_fc (iterable of dict): Experiments for fold change
+                columns, see :meth:`get_result_columns`.
+            formatted (bool): Format the numerical data in the DB, see 
+                :meth:`format_data_column`.
+                
+        Returns:
+            tuple: The total number of rows, the number of rows after
+            filtering, the column names and the rows of the page.
+        """
+        table_name, columns = self.get_result_columns(exps_for_fc)
+        order = [(index, direction) for index, direction in order 
+                 if index < len(columns) and direction in ('ASC', 'DESC')]
+        column_search = {index: value for index, value in (column_search or {}).items()
+                         if index < len(columns)}
+        searchable = [
+            self.format_data_column(name) if is_data else '%s::text' % name
+            for name, _, is_data in columns
+        ]
+        
+        def contains(value):
+            escaped = (value.replace('\\', '\\\\').replace('%', '\\%')
+                       .replace('_', '\\_'))
+            return '%' + escaped + '%'
+        
+        conditions = []
+        parameters = []
+        if search:
+            conditions.append('(%s)' % ' OR '.join('%s ILIKE %%s' % expr 
+                                                   for expr in searchable))
+            parameters.extend([contains(search)] * len(searchable))
+        for index, value in column_search.items():
+            conditions.append('%s ILIKE %%s' % searchable[index])
+            parameters.append(contains(value))
+        where = 'WHERE %s' % ' AND '.join(conditions) if conditions else ''
+        order_by = 'ORDER BY %s' % ', '.join(
+            ['%s %s NULLS LAST' % (columns[index][0], direction) 
+             for index, direction in order]
+            + [self.ROW_ID_COLUMN])
+        subquery = '(SELECT %s, %s.%s FROM %s) AS page_source' % (
+            ', '.join('%s AS %s' % (expr, name) for name, expr, _ in columns), 
+            self.table_name, self.ROW_ID_COLUMN, table_name)
+        records_total = from_db('SELECT count(*) FROM %s' % self.table_name, 
+                                fetch_as='tuple')[0][0]
+        if conditions:
+            records_filtered = from_db('SELECT count(*) FROM %s %s' % (subquery, where),
+                                       parameters, fetch_as='tuple')[0][0]
+        else:
+            records_filtered = records_total
+        sql = 'SELECT %s FROM %s %s %s OFFSET %%s LIMIT %%s' % (
+            ', '.join('%s AS %s' % (self.format_data_column(name, formatted), name) 
+                      if is_data else name 
+                      for name, _, is_data in columns),
+            subquery, where, order_by)
+        rows = from_db(sql, parameters + [start, length], fetch_as='tuple')
+        return records_total, records_filtered, [name for name, _, _ in columns], rows
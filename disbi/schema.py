@@ -0,0 +1,209 @@
+"""
+Compiles the relation graph of the biological and meta models of an app
+once at startup.
+
+Introspecting the relations of the models, checking that they form a tree
+and constructing the JOIN of the backbone table only depend on the model
+definitions. They are done once for each app in :meth:`.DisbiConfig.ready`
+and stored in an immutable :class:`SchemaGraph`, so that requests only
+look the results up. Errors in the relation graph are reported by a
+system check.
+"""
+# standard library
+import threading
+from collections import deque, namedtuple
+from types import MappingProxyType
+
+# Django
+from django.apps import apps
+from django.db import models
+
+# DISBi
+from disbi.join import Relations
+from disbi.models import BiologicalModel, MetaModel
+from disbi.option_utils import get_models_of_superclass
+
+# The compiled graphs mapped to the app labels.
+_graphs = {}
+_graphs_lock = threading.Lock()
+
+
+class SchemaGraph(namedtuple('SchemaGraph', ['app_label', 'models', 'relations',
+                                             'adjacency', 'linearized', 'backbone_sql',
+                                             'index_columns', 'related_metamodels',
+                                             'errors'])):
+    """
+    Immutable relation graph of the biological and meta models of an app.
+
+    Attributes:
+        app_label (str): The label of the app the models live in.
+        models (tuple): The biological and meta models.
+        relations (Mapping): Pairs of related models mapped to the
+            ForeignKey field or the intermediary model relating them.
+        adjacency (Mapping): The models mapped to a tuple of the models
+            related to them.
+        linearized (tuple): The models in the order they are joined and
+            their columns are displayed in the backbone table.
+        backbone_sql (str): The SQL JOIN selecting the backbone table.
+        index_columns (tuple): The columns of the backbone table, that
+            are indexed.
+        related_metamodels (Mapping): The biological models mapped to a
+            tuple of the meta models related to them.
+        errors (tuple): Messages describing why the models cannot be
+            joined. The attributes describing the join are empty then.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def compile(cls, app_label):
+        """
+        Introspect the models of an app and compile their relation graph.
+
+        Args:
+            app_label (str): The label of the app the models live in.
+
+        Returns:
+            SchemaGraph: The compiled graph.
+        """
+        relations = Relations(app_label, model_superclass=(BiologicalModel, MetaModel))
+        related_pairs = dict((pair, relation)
+                             for pair, relation in relations.relation_map.items()
+                             if relation)
+        adjacency = dict((model, tuple(other for other in relations.models
+                                       if (model, other) in related_pairs))
+                         for model in relations.models)
+        errors = ()
+        linearized, backbone_sql, index_columns = (), '', ()
+        try:
+            relations.compile_join()
+        except ValueError as exc:
+            errors = (str(exc),)
+        else:
+            linearized = tuple(relations.linearized)
+            backbone_sql = relations.sql
+            index_columns = tuple(relations.get_index_columns())
+        related_metamodels = dict((model, tuple(relations.get_related_metamodels(model)))
+                                  for model in relations.models
+                                  if issubclass(model, BiologicalModel))
+        return cls(app_label=app_label,
+                   models=tuple(relations.models),
+                   relations=MappingProxyType(related_pairs),
+                   adjacency=MappingProxyType(adjacency),
+                   linearized=linearized,
+                   backbone_sql=backbone_sql,
+                   index_columns=index_columns,
+                   related_metamodels=MappingProxyType(related_metamodels),
+                   errors=errors)
+
+    def validate(self):
+        """
+        Ensure that the models can be joined.
+
+        Raises:
+            ValueError: If the relation graph has errors.
+        """
+        if self.errors:
+            raise ValueError(self.errors[0])
+
+    def get_related_metamodels(self, model):
+        """
+        Get all meta models related to a biological model.
+
+        Args:
+            model (Model): The biological model.
+
+        Returns:
+            tuple: The meta models.
+        """
+        return self.related_metamodels[model]
+
+    def get_connecting_models(self, target_models):
+        """
+        Get all models on the paths of the relation tree that connect ``target_models``.
+
+        Args:
+            target_models (list): The models that should be connected.
+
+        Returns:
+            set: The models and all models between them.
+        """
+        start = target_models[0]
+        # Breadth first search, remembering the parent of each model.
+        parents = {start: None}
+        models_to_search = deque([start])
+        while models_to_search:
+            searched_model = models_to_search.popleft()
+            for model in self.adjacency[searched_model]:
+                if model not in parents:
+                    parents[model] = searched_model
+                    models_to_search.append(model)
+        # Walk up from each model until the path joins the connected models.
+        connecting_models = {start}
+        for model in target_models[1:]:
+            while model not in connecting_models:
+                connecting_models.add(model)
+                model = parents[model]
+        return connecting_models
+
+    def get_intermediary_tables(self, target_models):
+        """
+        Get the DB tables of the intermediary models between N:M related models.
+
+        Args:
+            target_models (iterable): The models for which the intermediary
+                models are searched.
+
+        Returns:
+            set: The DB table names of the intermediary models.
+        """
+        intermediary_tables = set()
+        for model in target_models:
+            for other in self.adjacency[model]:
+                relation = self.relations[model, other]
+                if other in target_models and not isinstance(relation, models.ForeignKey):
+                    intermediary_tables.add(relation._meta.db_table)
+        return intermediary_tables
+
+
+def get_schema_app_labels(app_configs=None):
+    """
+    Get the labels of the apps that have biological or meta models.
+
+    Keyword Args:
+        app_configs (iterable): The configs of the apps to consider.
+            Defaults to all installed apps.
+
+    Returns:
+        list: The app labels.
+    """
+    if app_configs is None:
+        app_configs = apps.get_app_configs()
+    return [app_config.label for app_config in app_configs
+            if get_models_of_superclass(app_config.label, (BiologicalModel, MetaModel))]
+
+def compile_schemas():
+    """Compile the relation graphs of all apps with biological or meta models."""
+    graphs = dict((app_label, SchemaGraph.compile(app_label))
+                  for app_label in get_schema_app_labels())
+    with _graphs_lock:
+        _graphs.update(graphs)
+
+def get_schema(app_label):
+    """
+    Get the compiled relation graph of an app.
+
+    Graphs of apps, that were not compiled at startup, are compiled on
+    first use.
+
+    Args:
+        app_label (str): The label of the app.
+
+    Returns:
+        SchemaGraph: The compiled graph.
+    """
+    graph = _graphs.get(app_label)
+    if graph is None:
+        graph = SchemaGraph.compile(app_label)
+        with _graphs_lock:
+            graph = _graphs.setdefault(app_label, graph)
+    return graph
@@ -80,10 +80,20 @@ function makeFooter($table, tableHeaders) {
 	});
 }
 
-function initTable($table, tableData) {
-	var table = $table.DataTable({
+function dataColumnIndexes( columns ) {
+	// Get the indexes of the columns holding numerical data.
+	var indexes = [];
+	$.each( columns, function( i, name ) {
+		if ( /_\d+$/.test( name ) ) {
+			indexes.push( i );
+		}
+	});
+	return indexes;
+}
+
+function initTable($table, data) {
+	var options = {
     	
-	data: tableData,
 	dom: 'B<"top"i>rt<"bottom"flp><"clear">',
 	scrollY: false,
 	scrollX: 'width', // allow scrolling horizontally
@@ -116,9 +126,34 @@ function initTable($table, tableData) {
 	        ],
     // always use first column for initial ordering to actually get data displayed
     order: [[ 0, "desc" ]], 
-    });
+    columnDefs: [{
+    	// Numbers are sorted by value, but displayed and searched in 
+    	// scientific notation.
+    	targets: dataColumnIndexes( data.columns ),
+    	render: function( value, type ) {
+    		if ( typeof value === "number" && type !== "sort" && type !== "type" ) {
+    			return formatScientific( value );
+    		}
+    		return value;
+    	},
+    }],
+    };
+	
+	if ( data.serverSide ) {
+		// Let the server page, sort and filter the rows.
+		options.serverSide = true;
+		options.processing = true;
+		options.ajax = {
+			url: "get_table_data/",
+			data: function( params ) {
+				params.fc = ( data.foldChanges || [] ).join( "," );
+			},
+		};
+	} else {
+		options.data = data.tableData;
+	}
 	
-	return table;
+	return $table.DataTable( options );
 }
 
 function addSearch(table) {
@@ -137,6 +172,144 @@ function addSearch(table) {
 	});
 }
 
+// Media types of the table formats, the binary columnar format is preferred.
+// Servers streaming the table answer with rows as JSON, see requestTable.
+var TABLE_ACCEPT = "application/vnd.disbi.columnar, " +
+	"application/vnd.disbi.columnar+json;q=0.9, application/json;q=0.5";
+
+function formatScientific( value ) {
+	// Format a number like to_char(value, '9.9999EEEE') in PostgreSQL.
+	if ( value === null ) {
+		return null;
+	}
+	if ( !isFinite( value ) ) {
+		return String( value );
+	}
+	var parts = Math.abs( value ).toExponential( 4 ).split( "e" );
+	var exponent = parseInt( parts[1], 10 );
+	var exponentStr = ( Math.abs( exponent ) < 10 ? "0" : "" ) + Math.abs( exponent );
+	return ( value < 0 ? "-" : " " ) + parts[0] + "e" + ( exponent < 0 ? "-" : "+" ) + exponentStr;
+}
+
+function columnsToRows( columns, rowCount ) {
+	// Turn a list of column arrays into the row arrays expected by DataTables.
+	var rows = new Array( rowCount );
+	for ( var i = 0; i < rowCount; i++ ) {
+		var row = new Array( columns.length );
+		for ( var j = 0; j < columns.length; j++ ) {
+			row[j] = columns[j][i];
+		}
+		rows[i] = row;
+	}
+	return rows;
+}
+
+function decodeNumeric( values, validity, rowCount ) {
+	// Distribute the valid values of a numerical column on the rows and 
+	// fill the rows, that are unset in the validity bitmap, with null.
+	var column = new Array( rowCount );
+	var k = 0;
+	for ( var i = 0; i < rowCount; i++ ) {
+		if ( validity === null || ( validity[i >> 3] & ( 128 >> ( i & 7 ) ) ) ) {
+			column[i] = values[k++];
+		} else {
+			column[i] = null;
+		}
+	}
+	return column;
+}
+
+function decodeBase64( str ) {
+	var binary = atob( str );
+	var bytes = new Uint8Array( binary.length );
+	for ( var i = 0; i < binary.length; i++ ) {
+		bytes[i] = binary.charCodeAt( i );
+	}
+	return bytes;
+}
+
+function decodeColumnar( data ) {
+	// Decode the table data of the columnar JSON format, see
+	// disbi.table_formats.to_columnar.
+	var columns = $.map( data.columnData, function( column ) {
+		if ( column.type === "float64" ) {
+			var validity = column.validity ? decodeBase64( column.validity ) : null;
+			return [ decodeNumeric( column.values, validity, data.rowCount ) ];
+		}
+		return [ column.values ];
+	});
+	return {columns: data.columns, tableData: columnsToRows( columns, data.rowCount )};
+}
+
+function decodeBinaryTable( buffer ) {
+	// Decode the response of the binary columnar format, see 
+	// disbi.table_formats.to_binary.
+	var headerLength = new DataView( buffer ).getUint32( 0, true );
+	var header = JSON.parse( new TextDecoder( "utf-8" ).decode(
+		new Uint8Array( buffer, 4, headerLength ) ) );
+	var dataOffset = Math.ceil( ( 4 + headerLength ) / 8 ) * 8;
+	var names = [];
+	var columns = [];
+	$.each( header.columns, function( i, column ) {
+		names.push( column.name );
+		if ( column.type === "float64" ) {
+			var values = new Float64Array( buffer, dataOffset + column.offset, column.length );
+			var validity = null;
+			if ( column.validityOffset !== null ) {
+				validity = new Uint8Array( buffer, dataOffset + column.validityOffset,
+				                           Math.ceil( header.rowCount / 8 ) );
+			}
+			columns.push( decodeNumeric( values, validity, header.rowCount ) );
+		} else {
+			columns.push( column.values );
+		}
+	});
+	return {
+		status: header.status,
+		data: {columns: names, tableData: columnsToRows( columns, header.rowCount )},
+		err_msg: null,
+	};
+}
+
+function requestTable( params ) {
+	// Request table data in a compact format and decode it according to the
+	// content type chosen by the server.
+	var xhr = new XMLHttpRequest();
+	xhr.open( params.method, params.url );
+	xhr.responseType = "arraybuffer";
+	xhr.setRequestHeader( "Accept", TABLE_ACCEPT );
+	xhr.setRequestHeader( "X-Requested-With", "XMLHttpRequest" );
+	if ( params.data ) {
+		xhr.setRequestHeader( "Content-Type", "application/x-www-form-urlencoded; charset=UTF-8" );
+	}
+	xhr.onload = function() {
+		var contentType = xhr.getResponseHeader( "Content-Type" ) || "";
+		if ( xhr.status >= 200 && xhr.status < 300 ) {
+			var response;
+			if ( contentType.indexOf( "application/vnd.disbi.columnar+json" ) === 0 ) {
+				response = JSON.parse( new TextDecoder( "utf-8" ).decode( xhr.response ) );
+				response.data = decodeColumnar( response.data );
+			} else if ( contentType.indexOf( "application/vnd.disbi.columnar" ) === 0 ) {
+				response = decodeBinaryTable( xhr.response );
+			} else {
+				response = JSON.parse( new TextDecoder( "utf-8" ).decode( xhr.response ) );
+			}
+			params.success( response );
+		} else if ( params.error ) {
+			params.error( {responseText: new TextDecoder( "utf-8" ).decode( xhr.response )} );
+		}
+		if ( params.complete ) {
+			params.complete();
+		}
+	};
+	xhr.onerror = function() {
+		if ( params.complete ) {
+			params.complete();
+		}
+	};
+	xhr.send( params.data || null );
+}
+
 function renderDataTable( data ) {
 	var tableHeaders = "";
 	$.each(data.columns, function(i, val){
@@ -148,12 +321,12 @@ function renderDataTable( data ) {
     
     var $table = $( "#result_table" );
     makeFooter($table, tableHeaders);
-    var table = initTable($table, data.tableData);
+    var table = initTable($table, data);
     addSearch(table);
 }
 
 function getTableData() {
-	$.ajax({
+	requestTable({
 		url: "get_table_data/",
 		method: "GET",
 		success: function( response ) {
@@ -167,19 +340,17 @@ function getTableData() {
 }
 
 function calcFoldChange() {
+	// Remove any warnings.
+	$( "#fold-change--warning" ).empty();
+	// Show loading message.
+	var $foldChangeLoading = $( "#fold-change--loading" );
+	$foldChangeLoading.removeClass( "invisible" );
+	$foldChangeLoading.show();
 	
-	$.ajax({
+	requestTable({
 		url: "calculate_fold_change/",
 		method: "POST",
 		data: $( "#fold-change-form" ).serialize(),
-		beforeSend: function() {
-			// Remove any warnings.
-			$( "#fold-change--warning" ).empty();
-			// Show loading message.
-			var $foldChangeLoading = $( "#fold-change--loading" );
-			$foldChangeLoading.removeClass( "invisible" );
-			$foldChangeLoading.show();
-		},
 		success: function( response ) {
 			console.log( "fold change response" );
 			if ( response.status ) {
@@ -0,0 +1,225 @@
+"""
+Compact formats for transferring the result table to the client.
+
+Instead of one array per row with numbers formatted as strings, the
+columnar formats send one array per column with the raw numbers. Missing
+numbers are marked once per column in a validity bitmap and left out of
+the values. The binary format additionally packs the numbers as 
+little-endian float64 arrays, that the client can view as 
+``Float64Array`` without parsing.
+
+The format is negotiated with the Accept header of the request, see
+:func:`negotiate_format`.
+"""
+# standard library
+import base64
+import json
+import math
+import struct
+
+# third-party
+import numpy as np
+
+# Django
+from django.core.serializers.json import DjangoJSONEncoder
+
+FORMAT_ROWS = 'rows'
+FORMAT_COLUMNAR = 'columnar'
+FORMAT_BINARY = 'binary'
+# Media types of the formats in the order of preference on equal quality.
+MEDIA_TYPES = (
+    ('application/vnd.disbi.columnar', FORMAT_BINARY),
+    ('application/vnd.disbi.columnar+json', FORMAT_COLUMNAR),
+    ('application/json', FORMAT_ROWS),
+)
+CONTENT_TYPES = dict((table_format, media_type) for media_type, table_format in MEDIA_TYPES)
+FLOAT_TYPE = 'float64'
+JSON_TYPE = 'json'
+
+
+def negotiate_format(accept):
+    """
+    Choose the format of the table data based on an Accept header.
+
+    Args:
+        accept (str): The value of the Accept header.
+
+    Returns:
+        str: One of ``rows``, ``columnar`` or ``binary``. Defaults to
+        ``rows`` if no columnar format is accepted.
+    """
+    qualities = {}
+    for media_range in (accept or '').split(','):
+        params = [param.strip() for param in media_range.split(';')]
+        quality = 1.0
+        for param in params[1:]:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        qualities[params[0].lower()] = quality
+    best_format = FORMAT_ROWS
+    best_quality = 0.0
+    for media_type, table_format in MEDIA_TYPES:
+        quality = qualities.get(media_type, 0.0)
+        if quality > best_quality:
+            best_format = table_format
+            best_quality = quality
+    return best_format
+
+def format_scientific(values):
+    """
+    Format numbers in scientific notation like ``to_char(value, '9.9999EEEE')``
+    in PostgreSQL.
+
+    Args:
+        values (numpy.ndarray): A float array, in which missing values are NaN.
+
+    Returns:
+        list: The formatted values. Missing values are None.
+    """
+    values = np.asarray(values, dtype=float)
+    formatted = np.char.add(np.where(values < 0, '-', ' '),
+                            np.char.mod('%.4e', np.abs(values))).astype(object)
+    formatted[np.isnan(values)] = None
+    return formatted.tolist()
+
+def _encode_numeric(values):
+    """
+    Split a numerical column into its validity bitmap and the valid values.
+
+    Args:
+        values (tuple): The values of the column.
+
+    Returns:
+        tuple: The validity bitmap as bytes and the valid values as float64
+        array. Bit ``i`` of the bitmap is set if row ``i`` holds a value.
+        The bits are ordered from the most significant bit of each byte,
+        as with :func:`numpy.packbits`. The bitmap is None if all rows
+        hold a value.
+    """
+    valid = np.array([value is not None for value in values], dtype=bool)
+    floats = np.array([value for value in values if value is not None], dtype='<f8')
+    if valid.all():
+        return None, floats
+    return np.packbits(valid).tobytes(), floats
+
+def to_columnar(columns, rows, numeric, status=None):
+    """
+    Encode a table in the columnar JSON format.
+
+    Numerical columns hold only the valid values and a base64 encoded
+    validity bitmap, see :func:`_encode_numeric`. As JSON has no
+    representation for them, NaN and infinite values are treated as
+    missing. Other columns hold all values.
+
+    Args:
+        columns (list of str): The column names.
+        rows (list of tuple): The rows.
+        numeric (list of bool): Whether each column holds numbers.
+
+    Keyword Args:
+        status: The value of the status in the response.
+
+    Returns:
+        str: The JSON document.
+    """
+    column_data = []
+    for values, is_numeric in zip(zip(*rows) if rows else [()] * len(columns), numeric):
+        if is_numeric:
+            validity, floats = _encode_numeric([
+                value if value is not None and math.isfinite(value) else None
+                for value in values
+            ])
+            column_data.append({
+                'type': FLOAT_TYPE,
+                'values': floats.tolist(),
+                'validity': base64.b64encode(validity).decode() if validity else None,
+            })
+        else:
+            column_data.append({'type': JSON_TYPE, 'values': list(values)})
+    return json.dumps({'status': status,
+                       'data': {'format': FORMAT_COLUMNAR,
+                                'columns': list(columns),
+                                'rowCount': len(rows),
+                                'columnData': column_data},
+                       'err_msg': None}, cls=DjangoJSONEncoder)
+
+def to_binary(columns, rows, numeric, status=None):
+    """
+    Encode a table in the binary columnar format.
+
+    The document starts with the length of a JSON header as unsigned
+    32 bit little-endian integer, followed by the header and padding to
+    the next multiple of 8 bytes. The header describes each column. For
+    numerical columns, the validity bitmap and the valid values as 
+    float64 array are appended, see :func:`_encode_numeric`. Their offsets
+    relative to the end of the padding are given in the header. Other
+    columns are included in the header.
+
+    Args:
+        columns (list of str): The column names.
+        rows (list of tuple): The rows.
+        numeric (list of bool): Whether each column holds numbers.
+
+    Keyword Args:
+        status: The value of the status in the response.
+
+    Returns:
+        bytes: The binary document.
+    """
+    header_columns = []
+    buffers = []
+    offset = 0
+    for name, values, is_numeric in zip(columns,
+                                        zip(*rows) if rows else [()] * len(columns),
+                                        numeric):
+        if not is_numeric:
+            header_columns.append({'name': name, 'type': JSON_TYPE, 'values': list(values)})
+            continue
+        validity, floats = _encode_numeric(values)
+        column = {'name': name, 'type': FLOAT_TYPE, 'length': len(floats),
+                  'validityOffset': None}
+        if validity is not None:
+            column['validityOffset'] = offset
+            # Keep the values aligned for viewing them as Float64Array.
+            validity += b'\0' * (-len(validity) % 8)
+            buffers.append(validity)
+            offset += len(validity)
+        column['offset'] = offset
+        buffers.append(floats.tobytes())
+        offset += floats.nbytes
+        header_columns.append(column)
+    header = json.dumps({'status': status,
+                         'rowCount': len(rows),
+                         'columns': header_columns}, cls=DjangoJSONEncoder).encode()
+    padding = -(4 + len(header)) % 8
+    return b''.join([struct.pack('<I', len(header)), header, b' ' * padding] + buffers)
+
+def encode_table(table_format, columns, rows, numeric, status=None):
+    """
+    Encode a table in a columnar format.
+
+    Args:
+        table_format (str): Either ``columnar`` or ``binary``.
+        columns (list of str): The column names.
+        rows (list of tuple): The rows.
+        numeric (list of bool): Whether each column holds numbers.
+
+    Keyword Args:
+        status: The value of the status in the response.
+
+    Returns:
+        tuple: The encoded table and its content type.
+
+    Raises:
+        ValueError: If the format is not columnar.
+    """
+    if table_format == FORMAT_BINARY:
+        content = to_binary(columns, rows, numeric, status=status)
+    elif table_format == FORMAT_COLUMNAR:
+        content = to_columnar(columns, rows, numeric, status=status)
+    else:
+        raise ValueError('Unknown columnar format: {}'.format(table_format))
+    return content, CONTENT_TYPES[table_format]
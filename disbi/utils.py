@@ -341,3 +341,57 @@ def camelize(string, uppercase_first_letter=True):
         words[0] = words[0].lower()
         return ''.join(words)
 
+
+def parse_datatables_params(params, max_length=1000):
+    """
+    Parse the parameters of a DataTables server-side processing request.
+    
+    Columns are referenced by their index in the result table. The 
+    indexes still need to be checked against the columns of the table.
+    
+    Args:
+        params (QueryDict): The GET parameters of the request.
+        
+    Keyword Args:
+        max_length (int): The maximum number of rows per page. Also used
+            if all rows are requested.
+            
+    Returns:
+        dict: The draw counter, the offset and number of rows of the page,
+        the global search value, the search values mapped to the column 
+        indexes and the order as list of tuples with the column index and 
+        either ``ASC`` or ``DESC``.
+        
+    Raises:
+        ValueError: If a numeric parameter is malformed.
+    """
+    length = int(params.get('length', max_length))
+    if length < 0 or length > max_length:
+        length = max_length
+    parsed = {'draw': int(params.get('draw', 0)),
+              'start': max(int(params.get('start', 0)), 0),
+              'length': length,
+              'search': params.get('search[value]', ''),
+              'column_search': OrderedDict(),
+              'order': []}
+    # Map the position of each column in the request to its index in the 
+    # result table, which differ if the columns were reordered.
+    data_indexes = {}
+    i = 0
+    while 'columns[%d][data]' % i in params:
+        data = params['columns[%d][data]' % i]
+        index = int(data) if data.isdigit() else i
+        data_indexes[i] = index
+        value = params.get('columns[%d][search][value]' % i, '')
+        if value:
+            parsed['column_search'][index] = value
+        i += 1
+    j = 0
+    while 'order[%d][column]' % j in params:
+        position = int(params['order[%d][column]' % j])
+        index = data_indexes.get(position, position)
+        direction = 'DESC' if params.get('order[%d][dir]' % j) == 'desc' else 'ASC'
+        if index >= 0:
+            parsed['order'].append((index, direction))
+        j += 1
+    return parsed
@@ -3,31 +3,82 @@ DISBi views that need to subclassed and configured with
 the appropriate experiment models by a concrete app. 
 """
 # standard library
+import json
 import re
-from io import StringIO
 
 # third-party
-import matplotlib
-matplotlib.use('agg')
-import matplotlib.pyplot as plt
 import numpy as np
 
 # Django
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.forms import formset_factory
-from django.http.response import HttpResponse, JsonResponse
+from django.http.response import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect, render
 from django.views.decorators.http import require_safe
 from django.views.generic import View
 
 # DISBi
 from disbi.cache_table import check_for_table_change
-from disbi.exceptions import NoRelatedMeasurementModel, NotSupportedError
+from disbi.db_utils import histogram_from_db
+from disbi.exceptions import (NoRelatedMeasurementModel, NotSupportedError,
+                              PlotTimeoutError)
+from disbi.foldchange import to_array
 from disbi.forms import construct_forms, foldchange_form_factory
-from disbi.option_utils import get_display_name
+from disbi.option_utils import get_field_descriptor
+from disbi.plot_cache import get_or_render_plot
+from disbi.plotting import (density_grid, doane_bin_count, render_compare_plot,
+                            render_histogram, render_in_pool)
 from disbi.experiment_filter import get_requested_experiments
 from disbi.result import DataResult
+from disbi.table_formats import FORMAT_ROWS, encode_table, negotiate_format
 from disbi.templatetags.custom_template_tags import nested_dict_as_table
-from disbi.utils import get_id_str, get_ids
+from disbi.utils import get_id_str, get_ids, get_unique, parse_datatables_params
+
+
+def format_in_sql():
+    """
+    Check whether the numerical data in the table data is formatted by
+    the DB as text or sent as numbers to be formatted by the client.
+    
+    Returns:
+        bool: The value of the ``FORMAT_IN_SQL`` setting.
+    """
+    return settings.DISBI.get('FORMAT_IN_SQL', False)
+
+def stream_table_response(batches, status=None):
+    """
+    Construct a response that writes the rows of a table as JSON while 
+    they are fetched.
+    
+    The JSON has the same structure as the non-streamed responses for 
+    the datatable.
+    
+    Args:
+        batches (generator): The column names followed by batches of rows, 
+            as yielded by :func:`disbi.db_utils.stream_from_db`.
+            
+    Keyword Args:
+        status: The value of the status in the response.
+        
+    Returns:
+        StreamingHttpResponse: The response.
+    """
+    # Execute the query before the response is started, so that errors 
+    # are not raised in the middle of the response.
+    columns = next(batches)
+    
+    def generate():
+        yield '{"status": %s, "data": {"columns": %s, "tableData": [' % (
+            json.dumps(status), json.dumps(columns))
+        separator = ''
+        for rows in batches:
+            yield separator + ', '.join(json.dumps(row, cls=DjangoJSONEncoder) 
+                                        for row in rows)
+            separator = ', '
+        yield ']}, "err_msg": null}'
+    
+    return StreamingHttpResponse(generate(), content_type='application/json')
 
 
 # ---------------------------- main views -----------------------------
@@ -156,13 +207,13 @@ class DisbiDataView(View):
             else:
                 foldchange_formset = None
                 plotcompare_form = None
-            # Create the data table.
+            # Create the data table. The rows are fetched by the client.
             result = DataResult(requested_exps, self.experiment_meta_model)  
-            table_data = result.get_or_create_base_table()
+            table_info = result.ensure_built()
             # Create the talbe with information about the selected experiments.
             view_exps = [exp.result_view() for exp in requested_exps]
             
-            context = {'table_data': table_data,
+            context = {'table_info': table_info,
                        'view_exps': view_exps,
                        'num_exps': num_exps,
                        'foldchange_formset': foldchange_formset,
@@ -229,6 +280,12 @@ class DisbiExpInfoView(View):
 class DisbiGetTableData(View):
     """
     View for initially getting the data for the datatable.
+    
+    If the ``SERVER_SIDE_PROCESSING`` setting is True, only the columns are
+    returned initially. The rows are then requested page by page with the
+    parameters of the DataTables server-side processing protocol.
+    Otherwise the format of the table is negotiated with the Accept header,
+    see :mod:`disbi.table_formats`.
     """
     experiment_meta_model = None
     
@@ -250,13 +307,71 @@ class DisbiGetTableData(View):
         response['err_msg'] = None
         exp_ids = get_ids(exp_id_str)
         requested_exps = self.experiment_meta_model.objects.filter(pk__in=exp_ids)
-        result = DataResult(requested_exps, self.experiment_meta_model)  
-        table_data = result.get_or_create_base_table(fetch_as='namedtuple')
+        # The rows are requested after the data view, that was counted
+        # as a hit already.
+        result = DataResult(requested_exps, self.experiment_meta_model, follow_up=True)
+        if 'draw' in request.GET:
+            return self.get_page(request, result)
+        if settings.DISBI.get('SERVER_SIDE_PROCESSING', False):
+            _, columns = result.get_result_columns()
+            response['data']['columns'] = [name for name, _, _ in columns]
+            response['data']['serverSide'] = True
+            return JsonResponse(response)
+        # The columnar formats need the whole table, so streaming takes
+        # precedence and the rows are sent as JSON.
+        if settings.DISBI.get('STREAM_TABLE_DATA', False):
+            return stream_table_response(result.get_or_create_base_table(
+                stream=True, formatted=format_in_sql()))
+        table_format = negotiate_format(request.META.get('HTTP_ACCEPT'))
+        if table_format != FORMAT_ROWS:
+            columns, numeric, rows = result.get_raw_table()
+            return HttpResponse(*encode_table(table_format, columns, rows, numeric))
+        table_data = result.get_or_create_base_table(fetch_as='namedtuple',
+                                                     formatted=format_in_sql())
         
         response['data']['columns'] = table_data[0]._fields
         response['data']['tableData'] = [tuple(row) for row in table_data]
         
         return JsonResponse(response)
+    
+    def get_page(self, request, result):
+        """
+        Answer a DataTables server-side processing request.
+        
+        Fold change columns are requested with the ``fc`` parameter, that
+        holds the pairs of experiments separated by commas, each given as 
+        the ids of the dividend and divisor joined on "_".
+        
+        Args:
+            request: The WSGI request.
+            result (DataResult): The result for the requested experiments.
+            
+        Returns:
+            JSONResponse: The rows of the page and the number of rows in the
+            format expected by DataTables.
+        """
+        req_exps = {exp.id: exp for exp in result.req_exps}
+        try:
+            exps_for_fc = []
+            for pair in filter(None, request.GET.get('fc', '').split(',')):
+                dividend_id, divisor_id = pair.split('_')
+                exps_for_fc.append({'dividend': req_exps[int(dividend_id)], 
+                                    'divisor': req_exps[int(divisor_id)]})
+            params = parse_datatables_params(
+                request.GET, 
+                max_length=settings.DISBI.get('SERVER_SIDE_MAX_LENGTH', 1000)
+            )
+        except (KeyError, ValueError):
+            return JsonResponse({'draw': request.GET.get('draw'),
+                                 'error': 'Invalid request parameters.'})
+        records_total, records_filtered, _, rows = result.get_page(
+            params['start'], params['length'], order=params['order'], 
+            search=params['search'], column_search=params['column_search'],
+            exps_for_fc=exps_for_fc, formatted=format_in_sql())
+        return JsonResponse({'draw': params['draw'],
+                             'recordsTotal': records_total,
+                             'recordsFiltered': records_filtered,
+                             'data': [list(row) for row in rows]})
 
 
 class DisbiCalculateFoldChangeView(View):
@@ -310,7 +425,32 @@ class DisbiCalculateFoldChangeView(View):
                     if dividend.measurementmodel != divisor.measurementmodel:
                         raise ValueError('To compare experiments, they need to have the same datatype.')
                 result = DataResult(requested_exps, self.experiment_meta_model)
-                table_data = result.add_foldchange(exps_for_foldchange, fetch_as='namedtuple')
+                if settings.DISBI.get('SERVER_SIDE_PROCESSING', False):
+                    # Only send the new columns. The rows are requested by
+                    # the table with the fold changes as parameters.
+                    _, columns = result.get_result_columns(exps_for_foldchange)
+                    response['data']['columns'] = [name for name, _, _ in columns]
+                    response['data']['serverSide'] = True
+                    response['data']['foldChanges'] = [
+                        '%s_%s' % (pair['dividend'].id, pair['divisor'].id)
+                        for pair in get_unique(exps_for_foldchange)
+                    ]
+                    response['status'] = True
+                    return JsonResponse(response)
+                # Streaming takes precedence over the columnar formats.
+                if settings.DISBI.get('STREAM_TABLE_DATA', False):
+                    return stream_table_response(
+                        result.add_foldchange(exps_for_foldchange, stream=True,
+                                              formatted=format_in_sql()),
+                        status=True
+                    )
+                table_format = negotiate_format(request.META.get('HTTP_ACCEPT'))
+                if table_format != FORMAT_ROWS:
+                    columns, numeric, rows = result.get_raw_table(exps_for_foldchange)
+                    return HttpResponse(*encode_table(table_format, columns, rows, numeric,
+                                                      status=True))
+                table_data = result.add_foldchange(exps_for_foldchange, fetch_as='namedtuple',
+                                                   formatted=format_in_sql())
                 response['data']['columns'] = table_data[0]._fields
                 response['data']['tableData'] = [tuple(row) for row in table_data]
                 response['status'] = True
@@ -340,7 +480,12 @@ class DisbiComparePlotView(View):
         Get the scatter plot comparing two experiments.
         
         If the data model of the two experiments matches, a plot is generated,
-        else an error message is raised.
+        else an error message is raised. Above ``COMPARE_PLOT_MAX_POINTS``
+        points, the density of the points is plotted and only the outliers 
+        are plotted as points. If ``format`` is ``grid`` in the POST data,
+        the binned points are returned as JSON instead of the plot, see
+        :func:`.density_grid`. Plots are cached until the data changes, 
+        see :func:`.get_or_render_plot`.
          
         Args:
             request: The WSGI request.
@@ -348,7 +493,8 @@ class DisbiComparePlotView(View):
                 joined on "_".
         
         Returns:
-            JSONResponse: The plot image SVG or the error message.
+            JSONResponse: The plot image SVG, the binned points or the 
+            error message.
         """
         response = {}
         response['status'] = None
@@ -370,32 +516,32 @@ class DisbiComparePlotView(View):
                 if dividend.measurementmodel != divisor.measurementmodel:
                     raise ValueError('To compare experiments, they need to have the same datatype.')
                 if exps_for_compare:
-                    # Get the data from the DB
-                    result = DataResult(requested_exps, self.experiment_meta_model)
-                    data = result.get_exp_columns(exps_for_compare)
-                    # Remove None values, because might be missing in the SVG otherwise.
-                    data = [pair for pair in data if pair[0] and pair[1]]
-                    # Load the data into arrays.
-                    data = np.array(data).transpose()
-                    x = data[0]
-                    y = data[1]
-                    fig = plt.figure()
-                    ax = fig.add_subplot(111)
-                    # Add the scatter plot.
-                    ax.plot(x, y, '.', color='#005374') # color=BRICS blue 1
-                    # Add a grey line through the origin.
-                    a = np.linspace(*ax.get_xbound())
-                    b = np.linspace(*ax.get_ybound())
-                    ax.plot(a, b, '--', color='#5f5f5f') # color=BRICS grey 2
-                    # Set labels.
-                    ax.set_xlabel(str(dividend))
-                    ax.set_ylabel(str(divisor))
-                    # Write SVG tho string buffer and return it as response.
-                    buf = StringIO()
-                    fig.savefig(buf, format='svg')
-                    buf.seek(0)  # rewind the data
-                    plt.close('all')
-                    response['data'] = buf.read()
+                    plot_format = request.POST.get('format')
+                    max_points = settings.DISBI.get('COMPARE_PLOT_MAX_POINTS', 5000)
+                    bins = settings.DISBI.get('COMPARE_PLOT_BINS', 100)
+                    
+                    def render():
+                        # Get the data from the DB
+                        result = DataResult(requested_exps, self.experiment_meta_model)
+                        data = result.get_exp_columns(exps_for_compare)
+                        # Load the data into a float array. Remove missing values, 
+                        # because they might be missing in the SVG otherwise.
+                        data = to_array(data).reshape(-1, 2)
+                        data = data[np.all(~np.isnan(data) & (data != 0), axis=1)]
+                        x = data[:, 0]
+                        y = data[:, 1]
+                        if plot_format == 'grid':
+                            # Let the client draw the binned points.
+                            return density_grid(x, y, bins=bins)
+                        return render_in_pool(render_compare_plot, x, y, 
+                                              str(dividend), str(divisor), max_points, bins)
+                    
+                    # Plots are cached until the data changes.
+                    response['data'] = get_or_render_plot(
+                        self.experiment_meta_model,
+                        ('compare', dividend.pk, divisor.pk, exp_ids, 
+                         plot_format, max_points, bins),
+                        render)
                     response['status'] = True
                     
                     return JsonResponse(response)
@@ -404,7 +550,7 @@ class DisbiComparePlotView(View):
                 response['err_msg'] = ('You need to select at least two unequal experiments '
                             'to compare experiments.')
                 return JsonResponse(response)
-        except ValueError as exc:
+        except (ValueError, PlotTimeoutError) as exc:
             response['status'] = False
             response['err_msg'] = str(exc)
             return JsonResponse(response)
@@ -418,15 +564,85 @@ class DisbiDistributionPlotView(View):
     experiment_model = None
     experiment_meta_model = None
     
+    def render_plot(self, col, exp_id_str):
+        """
+        Render the histogram of a column.
+        
+        If a non fold change column is plotted, the values are binned in
+        the table of the measurement model.
+        If a fold change column is selected, a new DataResult object is 
+        instantiated and the log2 fold changes are binned in the result 
+        table cached in the DB.
+        
+        Args:
+            col (str): The name of the column in the data table.
+            exp_id_str: The ids of all requested experiments from the table view
+                joined on "_".
+        
+        Returns:
+            str: The plot as SVG.
+            
+        Raises:
+            NotSupportedError: If the experiments of a fold change have 
+                different data types.
+        """
+        # Pattern that matches the trailing id of th experiment (e.g. _16)  
+        # or of a fold change column (e.g. _16_17). 
+        id_pattern = re.compile(r'_(\d+(?:_\d+)*)')
+        # Get the id.
+        exp_id = id_pattern.search(col).group(1)
+        # Substitute the experiment id with '' to get the name.
+        column_display_name = id_pattern.sub('', col)
+        if 'fc' not in column_display_name:
+            # We're not dealing with a fold change.    
+            exp = self.experiment_meta_model.objects.get(pk=exp_id)
+            # Map the name used to display the column to its field. 
+            field = (get_field_descriptor(exp.measurementmodel)
+                     .fields_by_display_name[column_display_name])
+            # Bin the values of the experiment in the DB. Use Doane's
+            # formula, as it also fits non normal distributed data.
+            counts, edges = histogram_from_db(
+                field.column, exp.measurementmodel._meta.db_table,
+                condition='%s = %%s' % exp.measurementmodel._meta.get_field('experiment').column,
+                parameters=[exp.pk], bin_count=doane_bin_count)
+            xlabel = '{} {}'.format(exp.measurementmodel._meta.verbose_name, column_display_name)
+            title = 'Distribution of {} {} {}'.format(exp.measurementmodel._meta.verbose_name,
+                                                   column_display_name,
+                                                   exp_id)                
+    
+        else:
+            # We're dealing with a fold change column.
+            dividend_id, divisor_id = exp_id.split('_')
+            dividend_exp = self.experiment_meta_model.objects.get(pk=dividend_id)
+            divisor_exp = self.experiment_meta_model.objects.get(pk=divisor_id)
+           
+            if dividend_exp.measurementmodel != divisor_exp.measurementmodel:
+                raise NotSupportedError('To plot a fold change the experiments '
+                                        'must have the same datatype.')
+            # Get the displayed experiments from the URL.
+            exp_ids = get_ids(exp_id_str)
+            requested_exps = self.experiment_model.objects.filter(pk__in=exp_ids)
+            # Create the data table.
+            result = DataResult(requested_exps, self.experiment_meta_model) 
+            # Bin the log2 fold changes in the DB. log(0), log(-a) and 
+            # divisions by zero are left out.
+            counts, edges = result.get_foldchange_histogram(
+                {'dividend': dividend_exp, 'divisor': divisor_exp},
+                bin_count=doane_bin_count)
+            xlabel = 'log2 fold change {}/{}'.format(dividend_exp.id, divisor_exp.id)
+            title = 'Distribution of fold change {}/{}'.format(
+                        dividend_exp.id, divisor_exp.id
+                        )
+        ylabel = 'Number of data points' # The y-label is always same for histograms.
+        return render_in_pool(render_histogram, counts, edges, xlabel, ylabel, title)
+    
     def post(self, request, exp_id_str):
         """
         Get the distribution of a column as a histogram.
         
-        If a non fold change column is plotted the matching data is fetched
-        from the DB with the ORM.
-        If a fold change column is selected, a new DataResult object is 
-        instantiated and only the fold change column is retrieved from the 
-        result table cached in the DB.
+        The histogram is computed in the DB and only the counts per bin are
+        fetched, see :func:`.histogram_from_db` and :meth:`render_plot`. 
+        Rendered plots are cached, see :func:`.get_or_render_plot`.
         
         Args:
             request: The WSGI request.
@@ -441,88 +657,18 @@ class DisbiDistributionPlotView(View):
         response['data'] = None
         response['err_msg'] = None
         try:
-            fold_change = False
             # The column to be plotted.
             col = self.request.POST['column']
-            # Pattern that matches the trailing id of th experiment (e.g. _16)  
-            # or of a fold change column (e.g. _16_17). 
-            id_pattern = re.compile(r'_(\d+(?:_\d+)*)')
-            # Get the id.
-            exp_id = id_pattern.search(col).group(1)
-            # Substitute the experiment id with '' to get the name.
-            column_display_name = id_pattern.sub('', col)
-            if 'fc' not in column_display_name:
-                # We're not dealing with a fold change.    
-                exp = self.experiment_meta_model.objects.get(pk=exp_id)
-                # Map the names used to display the columns to their actual names. 
-                display_names_to_names = dict(
-                                    (get_display_name(field), field.name, )
-                                    for field in exp.measurementmodel._meta.get_fields() 
-                                    )
-                column_name = display_names_to_names[column_display_name]
-                # Get only values that are not NULL.
-                filter_conds = {'experiment': exp,
-                               column_name+'__isnull': False}
-                data = exp.measurementmodel.objects.filter(**filter_conds).values_list(column_name)
-                xlabel = '{} {}'.format(exp.measurementmodel._meta.verbose_name, column_display_name)
-                title = 'Distribution of {} {} {}'.format(exp.measurementmodel._meta.verbose_name,
-                                                       column_display_name,
-                                                       exp_id)                
-        
-            else:
-                # We're dealing with a fold change column.
-                dividend_id, divisor_id = exp_id.split('_')
-                dividend_exp = self.experiment_meta_model.objects.get(pk=dividend_id)
-                divisor_exp = self.experiment_meta_model.objects.get(pk=divisor_id)
-               
-                if dividend_exp.measurementmodel != divisor_exp.measurementmodel:
-                    raise NotSupportedError('To plot a fold change the experiments '
-                                            'must have the same datatype.')
-                # Get the displayed experiments from the URL.
-                exp_ids = get_ids(exp_id_str)
-                requested_exps = self.experiment_model.objects.filter(pk__in=exp_ids)
-                # Create the data table.
-                result = DataResult(requested_exps, self.experiment_meta_model) 
-                data = result.get_foldchange(({'dividend': dividend_exp, 
-                                               'divisor': divisor_exp},))
- 
-                # Filter out NULL values.
-                ## Flatten.
-                data = sum(data, ())
-                data = list((datapoint for datapoint in data if datapoint is not None))
-                xlabel = 'log2 fold change {}/{}'.format(dividend_exp.id, divisor_exp.id)
-                fold_change = True
-                title = 'Distribution of fold change {}/{}'.format(
-                            dividend_exp.id, divisor_exp.id
-                            )
-            ylabel = 'Number of data points' # The y-label is always same for histograms.
-            fig = plt.figure()
-            ax = fig.add_subplot(111)
-            data = np.array(data)
-            if fold_change:
-                # Calculate log2 for fold change and filter out inf and NaN values
-                # as result from log(0) and log(-a).
-                data = np.log2(data)
-                data = data[~np.isinf(data) & ~np.isnan(data)]
-            # Use `doane` estimator as using `auto` for non normal distributed data
-            # takes forever. 
-            ax.hist(data, bins='doane', color='#005374')
-            # Set labels and title.
-            ax.set_xlabel(xlabel)
-            ax.set_ylabel(ylabel)
-            ax.set_title(title)
-            
-            # Store the plot in a byte stream and encode it as base64.
-            buf = StringIO()
-            fig.savefig(buf, format='svg')
-            buf.seek(0)  # rewind the data
-            plt.close('all')
+            # Plots are cached until the data changes.
+            svg = get_or_render_plot(self.experiment_meta_model,
+                                     ('distribution', col, get_ids(exp_id_str)),
+                                     lambda: self.render_plot(col, exp_id_str))
     
             response['status'] = True
-            response['data'] = buf.read()
+            response['data'] = svg
             return JsonResponse(response)
         
-        except NotSupportedError as exc:
+        except (NotSupportedError, PlotTimeoutError) as exc:
             response['status'] = False
             response['err_msg'] = str(exc)
             return JsonResponse(response)
@@ -1,24 +1,51 @@
 """
-Unittest for DISBi components that work without database interaction.
+Unittest for DISBi components that work without database interaction 
+or with tables created in the test database.
 """
 # standard library
+import base64
+import json
+import struct
+import time
 from copy import deepcopy
+from datetime import datetime, timedelta
 from itertools import product
 from types import SimpleNamespace
+from unittest import mock
+
+# third-party
+import numpy as np
 
 # Django
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.test import TestCase
+from django.db import ProgrammingError, models
+from django.http import QueryDict
+from django.test import TestCase, override_settings
 
 # DISBi
+import disbi.disbimodels as dmodels
 from disbi.admin import *
+from disbi.cache_table import get_datatable_owner, select_evictions
+from disbi.condition_tokens import tokenize
+from disbi.db_utils import exec_query, get_index_name
+from disbi.exceptions import PlotTimeoutError
 from disbi.join import Relations
+from disbi.models import CachedTable
+from disbi.option_utils import get_field_descriptor
+from disbi.plotting import (bin_points, doane_bin_count, render_histogram,
+                            render_in_pool)
 from disbi.experiment_filter import combine_on_sep
-from disbi.result import DataResult
+from disbi.foldchange import divide, fold_changes, masked_log2, to_array, to_list
+from disbi.result import DataResult, rebuild_if_dropped
+from disbi.schema import SchemaGraph
+from disbi.table_formats import (format_scientific, negotiate_format, to_binary,
+                                 to_columnar)
 from disbi.utils import get_choices, sort_by_other, construct_none_displayer,\
     get_hr_val, get_optgroups, remove_optgroups, get_id_str, get_ids,\
-    get_unique
+    get_unique, parse_datatables_params
 from disbi.validators import *
+from disbi.views import stream_table_response
 
     
 
@@ -289,6 +316,28 @@ class UtilsTest(TestCase):
     
         self.assertEqual(unique_list, get_unique(non_unique_list))
         
+    def test_parse_datatables_params(self):
+        params = QueryDict(
+            'draw=2&start=20&length=10&search[value]=SSO'
+            '&columns[0][data]=1&columns[0][search][value]='
+            '&columns[1][data]=0&columns[1][search][value]=p1'
+            '&order[0][column]=0&order[0][dir]=desc'
+            '&order[1][column]=1&order[1][dir]=asc;drop'
+        )
+        parsed = parse_datatables_params(params)
+        self.assertEqual(parsed['draw'], 2)
+        self.assertEqual(parsed['start'], 20)
+        self.assertEqual(parsed['length'], 10)
+        self.assertEqual(parsed['search'], 'SSO')
+        # Reordered columns are mapped back to their index in the table.
+        self.assertEqual(dict(parsed['column_search']), {0: 'p1'})
+        self.assertEqual(parsed['order'], [(1, 'DESC'), (0, 'ASC')])
+        # All rows are limited to the maximum page size.
+        parsed = parse_datatables_params(QueryDict('draw=1&length=-1'), max_length=50)
+        self.assertEqual(parsed['length'], 50)
+        with self.assertRaises(ValueError):
+            parse_datatables_params(QueryDict('draw=1&start=a'))
+        
 class QueryTest(TestCase):
     
     
@@ -298,6 +347,322 @@ class QueryTest(TestCase):
         combined_list =  ['a/b', 'a/c', 'a/d', 'b/a', 'b/c', 'b/d', 'c/a', 'c/b', 
                           'c/d', 'd/a', 'd/b', 'd/c']
         self.assertEqual(combine_on_sep(l, '/'), combined_list)
+        
+    def test_tokenize(self):
+        # Tokens are distinct and the empty condition is normalized.
+        self.assertEqual(tokenize('xylose/-/glucose/xylose'), ['', 'glucose', 'xylose'])
+        self.assertEqual(tokenize(''), [''])
+        self.assertEqual(tokenize('-'), [''])
+        
+    def test_unknown_query_strategy(self):
+        result = DataResult.__new__(DataResult)
+        with self.assertRaises(ValueError):
+            result.construct_result_table([], strategy='unknown')
+
+    def test_choose_layout(self):
+
+        def measurement_model(*fields):
+            for i, field in enumerate(fields):
+                field.set_attributes_from_name('field_%s' % i)
+
+            class Model():
+                _meta = SimpleNamespace(get_fields=lambda: fields)
+            return Model
+
+        numeric_model = measurement_model(dmodels.FloatField(di_show=True),
+                                          dmodels.IntegerField(di_show=True),
+                                          dmodels.CharField(max_length=10))
+        text_model = measurement_model(dmodels.FloatField(di_show=True),
+                                       dmodels.CharField(max_length=10, di_show=True))
+        result = DataResult.__new__(DataResult)
+        result.req_exps = [SimpleNamespace(measurementmodel=numeric_model)]
+        self.assertEqual(result.choose_layout(), 'wide')
+        with override_settings(DISBI=dict(settings.DISBI, DATATABLE_LAYOUT='long')):
+            self.assertEqual(result.choose_layout(), 'long')
+            # Non-numeric values can not be stored in the long layout.
+            result.req_exps.append(SimpleNamespace(measurementmodel=text_model))
+            self.assertEqual(result.choose_layout(), 'wide')
+        with override_settings(DISBI=dict(settings.DISBI, DATATABLE_LAYOUT='tall')):
+            with self.assertRaises(ValueError):
+                result.choose_layout()
+
+    def test_rebuild_if_dropped(self):
+        
+        def dropped_error():
+            cause = Exception('relation does not exist')
+            cause.pgcode = '42P01'
+            exc = ProgrammingError(*cause.args)
+            exc.__cause__ = cause
+            return exc
+        
+        class Result():
+            def __init__(self, errors):
+                self.errors = errors
+                self.calls = 0
+                
+            @rebuild_if_dropped
+            def read(self):
+                self.calls += 1
+                if self.errors:
+                    raise self.errors.pop(0)
+                return 'rows'
+        
+        # Reading a dropped table is attempted again.
+        result = Result([dropped_error()])
+        self.assertEqual(result.read(), 'rows')
+        self.assertEqual(result.calls, 2)
+        # Other errors are raised immediately.
+        result = Result([ProgrammingError('syntax error')])
+        with self.assertRaises(ProgrammingError):
+            result.read()
+        self.assertEqual(result.calls, 1)
+        # The number of attempts is bounded.
+        result = Result([dropped_error() for _ in range(5)])
+        with self.assertRaises(ProgrammingError):
+            result.read()
+        self.assertEqual(result.calls, 3)
+
+
+class CacheTest(TestCase):
+    
+    def test_select_evictions(self):
+        now = datetime(2017, 1, 1, 12)
+        entries = [
+            SimpleNamespace(table_name='recent', byte_size=30, 
+                            last_access=now - timedelta(minutes=1)),
+            SimpleNamespace(table_name='old', byte_size=10, 
+                            last_access=now - timedelta(hours=2)),
+            SimpleNamespace(table_name='middle', byte_size=40, 
+                            last_access=now - timedelta(minutes=30)),
+        ]
+        
+        self.assertEqual(select_evictions(entries, now=now), [])
+        # Expired tables are evicted regardless of their size.
+        self.assertEqual(select_evictions(entries, ttl=3600, now=now), ['old'])
+        # Least recently used tables are evicted until the rest fits.
+        self.assertEqual(select_evictions(entries, max_bytes=70, now=now), ['old'])
+        self.assertEqual(select_evictions(entries, max_bytes=50, now=now), 
+                         ['old', 'middle'])
+        self.assertEqual(select_evictions(entries, max_bytes=50, ttl=3600, now=now), 
+                         ['old', 'middle'])
+        self.assertEqual(select_evictions(entries, max_bytes=0, now=now), 
+                         ['old', 'middle', 'recent'])
+        
+    def test_get_datatable_owner(self):
+        self.assertEqual(get_datatable_owner('app_datatable_1_2'), 'app_datatable_1_2')
+        self.assertEqual(get_datatable_owner('app_datatable_long_1_2_values'), 
+                         'app_datatable_long_1_2')
+        self.assertEqual(get_datatable_owner('app_datatable_1_2_fc'), 'app_datatable_1_2')
+
+        
+class DBUtilsTest(TestCase):
+    
+    def test_get_index_name(self):
+        self.assertEqual(get_index_name('app_table', 'gene_id'), 
+                         'app_table_gene_id_idx')
+        long_name = get_index_name('app_' + 'x' * 60, 'gene_id')
+        other_long_name = get_index_name('app_' + 'x' * 60, 'protein_id')
+        self.assertLessEqual(len(long_name), 63)
+        self.assertNotEqual(long_name, other_long_name)
+
+
+class ViewsTest(TestCase):
+    
+    def test_stream_table_response(self):
+        batches = iter([('a', 'b'), [(1, 'x'), (2, None)], [(3, 'z')]])
+        response = stream_table_response(batches, status=True)
+        content = b''.join(response.streaming_content).decode()
+        self.assertEqual(json.loads(content), 
+                         {'status': True, 
+                          'data': {'columns': ['a', 'b'],
+                                   'tableData': [[1, 'x'], [2, None], [3, 'z']]},
+                          'err_msg': None})
+        # Tables without rows.
+        response = stream_table_response(iter([('a',)]))
+        content = b''.join(response.streaming_content).decode()
+        self.assertEqual(json.loads(content)['data']['tableData'], [])
+
+
+class TableFormatsTest(TestCase):
+    
+    def test_negotiate_format(self):
+        self.assertEqual(negotiate_format(None), 'rows')
+        self.assertEqual(negotiate_format('application/json, text/javascript, */*; q=0.01'), 
+                         'rows')
+        self.assertEqual(negotiate_format('application/vnd.disbi.columnar+json'), 'columnar')
+        self.assertEqual(negotiate_format('application/vnd.disbi.columnar;q=0.5, '
+                                          'application/vnd.disbi.columnar+json'), 'columnar')
+        self.assertEqual(negotiate_format('application/vnd.disbi.columnar, '
+                                          'application/vnd.disbi.columnar+json'), 'binary')
+        
+    def test_to_columnar(self):
+        content = json.loads(to_columnar(['name', 'val_1'], 
+                                         [('a', 1.5), (None, None), ('c', float('inf'))],
+                                         [False, True]))
+        self.assertEqual(content['data']['rowCount'], 3)
+        self.assertEqual(content['data']['columnData'][0], 
+                         {'type': 'json', 'values': ['a', None, 'c']})
+        float_column = content['data']['columnData'][1]
+        self.assertEqual(float_column['values'], [1.5])
+        self.assertEqual(base64.b64decode(float_column['validity']), b'\x80')
+        
+    def test_to_binary(self):
+        content = to_binary(['name', 'val_1', 'val_2'], [('a', None, 2.0), ('b', 1.5, -1.0)], 
+                            [False, True, True])
+        header_length = struct.unpack('<I', content[:4])[0]
+        header = json.loads(content[4:4 + header_length].decode())
+        data = content[-(-(4 + header_length) // 8) * 8:]
+        self.assertEqual(header['rowCount'], 2)
+        self.assertEqual(header['columns'][0]['values'], ['a', 'b'])
+        sparse_column, dense_column = header['columns'][1:]
+        self.assertEqual(data[sparse_column['validityOffset']], 0b01000000)
+        self.assertEqual(sparse_column['length'], 1)
+        self.assertEqual(struct.unpack_from('<d', data, sparse_column['offset']), (1.5,))
+        self.assertIsNone(dense_column['validityOffset'])
+        self.assertEqual(struct.unpack_from('<2d', data, dense_column['offset']), (2.0, -1.0))
+
+
+class FoldChangeTest(TestCase):
+    
+    def test_divide(self):
+        quotient = divide([1, 4, None, 3, 0], [2, 0, 1, None, 5])
+        self.assertEqual(to_list(quotient), [0.5, None, None, None, 0.0])
+        log_quotient = divide([4, 1, 0, -2], [1, 4, 3, 1], log2=True)
+        self.assertEqual(to_list(log_quotient), [2.0, -2.0, None, None])
+        self.assertEqual(to_list(masked_log2(to_array([8, None, 0, -1]))), 
+                         [3.0, None, None, None])
+        
+    def test_fold_changes(self):
+        data = to_array([(1, 2, 0), (None, 4, 8), (6, 3, 3)])
+        quotients = fold_changes(data, [(0, 1), (1, 2), (2, 0)])
+        self.assertEqual(quotients.shape, (3, 3))
+        self.assertEqual([to_list(column) for column in quotients.T],
+                         [[0.5, None, 2.0], [None, 0.5, 1.0], [0.0, None, 0.5]])
+        self.assertEqual(fold_changes(data, []).shape, (3, 0))
+        
+    def test_format_scientific(self):
+        self.assertEqual(format_scientific(to_array([1234.5, -0.0, None, -2.5e-7, 1e100])),
+                         [' 1.2345e+03', ' 0.0000e+00', None, '-2.5000e-07', ' 1.0000e+100'])
+
+
+class TableResult(DataResult):
+    """
+    A result reading a wide base table in the test database, that is 
+    created if rows are given.
+    """
+    
+    def __init__(self, rows=None, follow_up=False):
+        self.app_label = 'core'
+        self.layout = self.LAYOUT_WIDE
+        self.req_exps = [SimpleNamespace(id=1), SimpleNamespace(id=2)]
+        self.table_name = 'core_datatable_1_2'
+        self.follow_up = follow_up
+        self.access_recorded = False
+        if rows is None:
+            return
+        exec_query('CREATE TABLE %s (%s bigint, name text, value_1 float8, value_2 float8);'
+                   % (self.table_name, self.ROW_ID_COLUMN))
+        for row_id, row in enumerate(rows, 1):
+            exec_query('INSERT INTO %s VALUES (%%s, %%s, %%s, %%s);' % self.table_name,
+                       [row_id] + list(row))
+        
+    def get_display_names(self, exp):
+        return ('value_%s' % exp.id,)
+    
+    
+class ResultTableTest(TestCase):
+    
+    def test_page_foldchanges(self):
+        result = TableResult([('a', 1, 2), ('b', 4, 0), ('c', None, 1), ('d', -3, 2), 
+                              ('e', 0, -5), ('f', 2, None)])
+        exps_for_fc = [{'dividend': result.req_exps[0], 'divisor': result.req_exps[1]}]
+        _, _, names, rows = result.get_page(0, 10, exps_for_fc=exps_for_fc, 
+                                            formatted=False)
+        self.assertEqual(names, ['name', 'fc_1_2', 'value_1', 'value_2'])
+        # The fold changes equal those calculated with NumPy.
+        data = to_array([row[2:] for row in rows])
+        self.assertEqual([row[1] for row in rows], to_list(divide(data[:, 0], data[:, 1])))
+        _, records_filtered, _, rows = result.get_page(
+            0, 10, order=[(1, 'DESC')], column_search={1: 'e+00'}, exps_for_fc=exps_for_fc,
+            formatted=False)
+        self.assertEqual(records_filtered, 2)
+        self.assertEqual([row[0] for row in rows], ['e', 'd'])
+        
+    def test_page_order(self):
+        result = TableResult([(name, value, None) 
+                              for name, value in zip('abcdefg', [1, 2, 1, 1, 2, None, 1])])
+        for order in [(), [(1, 'ASC')], [(1, 'DESC')]]:
+            pages = [result.get_page(start, 2, order=order)[3] for start in range(0, 8, 2)]
+            names = [row[0] for page in pages for row in page]
+            # Rows with equal values are not repeated on later pages.
+            self.assertEqual(sorted(names), list('abcdefg'))
+        self.assertEqual(names, list('beacdgf'))
+        
+    def test_record_hit(self):
+        result = TableResult([('a', 1, 2), ('b', 4, 0)])
+        CachedTable.objects.create(table_name=result.table_name, app_label='core', 
+                                   experiment_ids=[1, 2], dependencies=[])
+        exps_for_fc = [{'dividend': result.req_exps[0], 'divisor': result.req_exps[1]}]
+        # A view reading the table several times counts as a single hit.
+        result.ensure_built()
+        result.get_raw_table(exps_for_fc)
+        result.get_foldchange_histogram(exps_for_fc[0])
+        cached_table = CachedTable.objects.get()
+        self.assertEqual(cached_table.hits, 1)
+        # Follow-up requests of the view only update the last access.
+        follow_up = TableResult(follow_up=True)
+        follow_up.get_page(0, 10, exps_for_fc=exps_for_fc)
+        follow_up.get_page(10, 10, exps_for_fc=exps_for_fc)
+        self.assertEqual(CachedTable.objects.get().hits, 1)
+        self.assertGreater(CachedTable.objects.get().last_access, cached_table.last_access)
+        
+    def test_foldchange_histogram(self):
+        result = TableResult([('a', 1, 2), ('b', 4, 0), ('c', 8, 1), ('d', -3, 2), 
+                              ('e', 3, 3), ('f', 2, None)])
+        exps_for_fc = {'dividend': result.req_exps[0], 'divisor': result.req_exps[1]}
+        with mock.patch('disbi.result.fold_changes', wraps=fold_changes) as calculate:
+            counts, edges = result.get_foldchange_histogram(exps_for_fc)
+            # The fold changes are calculated once and then read from the
+            # fold change table.
+            self.assertEqual(result.get_foldchange_histogram(exps_for_fc), (counts, edges))
+            self.assertEqual(calculate.call_count, 1)
+        expected_counts, expected_edges = np.histogram([-1, 3, 0], bins=10)
+        self.assertEqual(counts, expected_counts.tolist())
+        self.assertTrue(np.allclose(edges, expected_edges))
+        
+        
+class PlottingTest(TestCase):
+    
+    def test_doane_bin_count(self):
+        samples = ([1, 2, 2, 3, 3, 3, 4, 9, 20], [0.5, -1.5, 2.25, 7, 7, 0.125, -3, 4],
+                   [2 ** exponent for exponent in range(12)],
+                   # A large offset must not cancel out the skewness.
+                   1e8 + np.random.RandomState(0).standard_normal(10000))
+        for sample in samples:
+            values = to_array(sample)
+            deviations = values - values.mean()
+            sums = ((deviations**2).sum(), (deviations**3).sum())
+            self.assertEqual(doane_bin_count(len(values), sums, values.min(), values.max()),
+                             len(np.histogram(values, bins='doane')[0]))
+        self.assertEqual(doane_bin_count(2, (0.5, 0), 1, 2), 1)
+        self.assertEqual(doane_bin_count(5, (0, 0), 1, 1), 1)
+        
+    def test_bin_points(self):
+        x = np.concatenate([np.full(10, 0.1), [0.6, 0.9, 1.0]])
+        y = np.concatenate([np.full(10, 0.2), [0.4, 0.9, 1.0]])
+        counts, x_edges, y_edges, outliers = bin_points(x, y, bins=2)
+        np.testing.assert_allclose(x_edges, [0.1, 0.55, 1.0])
+        np.testing.assert_allclose(y_edges, [0.2, 0.6, 1.0])
+        # The sparse cells are emptied and their points kept as outliers.
+        np.testing.assert_array_equal(counts, [[10, 0], [0, 0]])
+        self.assertEqual(outliers.tolist(), [False] * 10 + [True] * 3)
+        
+    def test_render_in_pool(self):
+        svg = render_in_pool(render_histogram, [1, 3], [0.0, 1.0, 2.0], 'x', 'y', 'title')
+        self.assertTrue(svg.startswith('<?xml'))
+        with override_settings(DISBI=dict(settings.DISBI, PLOT_RENDER_TIMEOUT=0.2)):
+            with self.assertRaises(PlotTimeoutError):
+                render_in_pool(time.sleep, 5)
 
 
 class JoinTest(TestCase):
@@ -377,3 +742,51 @@ class JoinTest(TestCase):
         
         
         
+        
+        
+class SchemaTest(TestCase):
+    
+    def test_get_connecting_models(self):
+        # a - b - c and b - d, where b and d are related by an intermediary model.
+        foreign_key = models.ForeignKey('b', on_delete=models.CASCADE)
+        through = SimpleNamespace(_meta=SimpleNamespace(db_table='b_d'))
+        relations = {('a', 'b'): foreign_key, ('b', 'c'): foreign_key, ('b', 'd'): through}
+        relations.update(dict((tuple(reversed(pair)), relation) 
+                              for pair, relation in relations.items()))
+        adjacency = {'a': ('b',), 'b': ('a', 'c', 'd'), 'c': ('b',), 'd': ('b',)}
+        schema = SchemaGraph(app_label='app', models=('a', 'b', 'c', 'd'),
+                             relations=relations, adjacency=adjacency, 
+                             linearized=(), backbone_sql='', index_columns=(), 
+                             related_metamodels={}, errors=('No tree.',))
+        self.assertEqual(schema.get_connecting_models(['c', 'd']), {'b', 'c', 'd'})
+        self.assertEqual(schema.get_connecting_models(['a']), {'a'})
+        self.assertEqual(schema.get_intermediary_tables({'b', 'c', 'd'}), {'b_d'})
+        self.assertEqual(schema.get_intermediary_tables({'a', 'd'}), set())
+        with self.assertRaises(ValueError):
+            schema.validate()
+        
+        
+class OptionUtilsTest(TestCase):
+    
+    def test_get_field_descriptor(self):
+        fields = [dmodels.FloatField(di_show=True, di_display_name='mean'),
+                  dmodels.FloatField(di_show=True, null=True),
+                  dmodels.FloatField(di_show=True),
+                  dmodels.CharField(max_length=10)]
+        for field, name in zip(fields, ['mean_value', 'deviation', 'count', 'note']):
+            field.set_attributes_from_name(name)
+        fields[3].exclude = True
+        
+        class Model():
+            _meta = SimpleNamespace(get_fields=lambda: fields)
+            
+        descriptor = get_field_descriptor(Model)
+        self.assertEqual(descriptor.show_fields, tuple(fields[:3]))
+        self.assertEqual(descriptor.show_names, ('mean', 'deviation', 'count'))
+        self.assertEqual(descriptor.display_columns, ('mean', 'deviation', 'count'))
+        self.assertEqual(descriptor.show_columns, ('mean_value', 'deviation', 'count'))
+        self.assertEqual(descriptor.concrete_show_names, ('mean_value', 'deviation', 'count'))
+        self.assertEqual(descriptor.notnull_column, 'mean_value')
+        self.assertEqual(descriptor.exclude_columns, ('note',))
+        self.assertIs(descriptor.fields_by_display_name['mean'], fields[0])
+        self.assertIs(get_field_descriptor(Model), descriptor)